@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Student, Course, AttendanceSession, AttendanceRecord
+from .models import Student, Course, AttendanceSession, AttendanceRecord, EnrollmentJob
 
 
 @admin.register(Student)
@@ -19,6 +19,7 @@ class StudentAdmin(admin.ModelAdmin):
 class CourseAdmin(admin.ModelAdmin):
     list_display = ('course_name', 'course_code')
     search_fields = ('course_name', 'course_code')
+    filter_horizontal = ('enrolled_students',)
 
 @admin.register(AttendanceSession)
 class AttendanceSessionAdmin(admin.ModelAdmin):
@@ -30,3 +31,10 @@ class AttendanceRecordAdmin(admin.ModelAdmin):
     list_display = ('student', 'session', 'timestamp')
     list_filter = ('session__course', 'session__created_at')
 
+@admin.register(EnrollmentJob)
+class EnrollmentJobAdmin(admin.ModelAdmin):
+    list_display = ('email', 'matric_number', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('email', 'matric_number')
+    exclude = ('password', 'face_samples')
+    readonly_fields = ('job_id', 'student', 'attempts', 'last_error', 'started_at', 'finished_at')
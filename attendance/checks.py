@@ -0,0 +1,59 @@
+"""
+System checks for settings that only go wrong once several workers serve the app.
+
+Marks are claimed in the default cache (see marking.py), so the cache has to be
+shared by every worker for only one of them to report a student as newly marked.
+A local-memory or dummy cache claims per process instead. The register still ends
+up with one row per student, but two terminals may both be told "success".
+"""
+import logging
+
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+logger = logging.getLogger(__name__)
+
+# Backends whose cache.add() does not see the claims made by other processes.
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_is_per_process():
+    return settings.CACHES['default']['BACKEND'] in PER_PROCESS_CACHES
+
+
+def per_process_cache_message(reason):
+    return (
+        f"{reason}, but the default cache ({settings.CACHES['default']['BACKEND']}) is not shared between "
+        "processes, so several workers can each report the same student as newly marked. Set CACHE_BACKEND "
+        "and CACHE_LOCATION to a shared cache such as Redis."
+    )
+
+
+@register(Tags.caches)
+def check_marking_cache(app_configs, **kwargs):
+    """Warns when ATTENDANCE_WRITE_BEHIND is on with a per-process cache."""
+    if settings.ATTENDANCE_WRITE_BEHIND and cache_is_per_process():
+        return [Warning(
+            per_process_cache_message('ATTENDANCE_WRITE_BEHIND is on'),
+            hint='Write-behind journals are shared by the workers of a host; the mark claims must be too.',
+            id='attendance.W001',
+        )]
+    return []
+
+
+def warn_if_cache_per_process(workers, log=logger):
+    """
+    Logs a warning when a server starts `workers` processes with a per-process cache.
+
+    Called by gunicorn.conf.py, since system checks do not run when a WSGI server loads the app.
+
+    Returns:
+        bool: Whether a warning was logged.
+    """
+    if workers > 1 and cache_is_per_process():
+        log.warning(per_process_cache_message(f'{workers} workers are configured'))
+        return True
+    return False
@@ -0,0 +1,195 @@
+"""
+Per-student compaction of enrollment descriptors.
+
+Registration keeps every accepted sample, but the samples of one capture session
+are near-duplicates. They cost gallery memory and match time in proportion to
+their number, and a single bad sample (motion blur, half a face) widens the
+region that matches the student. compact_encodings() therefore:
+
+1. Prunes outliers: descriptors whose distance to the student's medoid is above
+   FACE_COMPACTION_OUTLIER_DISTANCE, or far above the typical spread of that
+   student's samples.
+2. Summarises the rest with k-means into FACE_COMPACTION_K representatives,
+   either the member closest to each cluster centre ("medoids") or the centres
+   themselves ("centroids").
+
+Enrollment only compacts new students with settings.FACE_COMPACTION on.
+evaluate_compaction() measures what this does to recognition on stored
+descriptors; see `manage.py compact_embeddings --evaluate`.
+"""
+import numpy as np
+from django.conf import settings
+
+from .index import kmeans, nearest_centroid, squared_distances
+from .matching import FaceMatcher
+
+METHODS = ('medoids', 'centroids')
+# A descriptor further than this many median absolute deviations beyond the median
+# distance to the medoid is treated as an outlier, whatever the absolute limit.
+OUTLIER_MAD_FACTOR = 4.0
+
+
+def pairwise_distances(encodings):
+    return np.sqrt(np.maximum(squared_distances(encodings, encodings), 0.0))
+
+
+def prune_outliers(encodings, max_distance, keep_at_least=1):
+    """
+    Finds the descriptors worth keeping for one student.
+
+    Args:
+        encodings (np.ndarray): The student's (N, 128) descriptors.
+        max_distance (float): Descriptors further than this from the medoid are dropped.
+        keep_at_least (int): Never keep fewer than this many; the closest to the medoid win.
+
+    Returns:
+        A sorted array of the indices of the descriptors to keep.
+    """
+    if len(encodings) <= max(keep_at_least, 2):
+        return np.arange(len(encodings))
+
+    distances = pairwise_distances(encodings)
+    medoid = int(np.argmin(distances.sum(axis=1)))
+    to_medoid = distances[medoid]
+    median = np.median(to_medoid)
+    spread = np.median(np.abs(to_medoid - median))
+    limit = min(max_distance, median + OUTLIER_MAD_FACTOR * spread) if spread > 0 else max_distance
+
+    keep = np.flatnonzero(to_medoid <= limit)
+    if len(keep) < keep_at_least:
+        keep = np.sort(np.argsort(to_medoid, kind='stable')[:keep_at_least])
+    return keep
+
+
+def summarise(encodings, qualities, k, method):
+    """
+    Reduces one student's descriptors to at most `k` representatives.
+
+    Returns:
+        A tuple (encodings, qualities). Medoids keep their own quality; a centroid
+        gets the mean quality of its cluster, or None if no qualities were stored.
+    """
+    if len(encodings) <= k:
+        return encodings, list(qualities)
+
+    centres = kmeans(encodings, k, seed=0)
+    assignments = nearest_centroid(encodings, centres)
+    has_quality = all(quality is not None for quality in qualities)
+
+    representatives, representative_qualities = [], []
+    for cluster in range(len(centres)):
+        members = np.flatnonzero(assignments == cluster)
+        if len(members) == 0:
+            continue
+        if method == 'centroids':
+            representatives.append(encodings[members].mean(axis=0))
+            representative_qualities.append(
+                float(np.mean([qualities[i] for i in members])) if has_quality else None
+            )
+        else:
+            closest = members[np.argmin(squared_distances(encodings[members], centres[cluster:cluster + 1])[:, 0])]
+            representatives.append(encodings[closest])
+            representative_qualities.append(qualities[closest])
+    return np.asarray(representatives, dtype=np.float32), representative_qualities
+
+
+def compact_encodings(encodings, qualities=None, k=None, method=None, outlier_distance=None):
+    """
+    Prunes outliers from one student's descriptors and keeps `k` representatives.
+
+    Args:
+        encodings (array-like): The student's descriptors, shape (N, 128).
+        qualities (list): Detector confidence per descriptor, or None.
+        k (int): Representatives to keep; defaults to settings.FACE_COMPACTION_K. 0 keeps
+            every descriptor that survives pruning.
+        method (str): "medoids" or "centroids"; defaults to settings.FACE_COMPACTION_METHOD.
+        outlier_distance (float): Absolute pruning limit; defaults to
+            settings.FACE_COMPACTION_OUTLIER_DISTANCE.
+
+    Returns:
+        A tuple (encodings, qualities) in the shape returned by train_dlib_model_from_samples.
+
+    Raises:
+        ValueError: If `method` is unknown.
+    """
+    k = settings.FACE_COMPACTION_K if k is None else k
+    method = method or settings.FACE_COMPACTION_METHOD
+    outlier_distance = settings.FACE_COMPACTION_OUTLIER_DISTANCE if outlier_distance is None else outlier_distance
+    if method not in METHODS:
+        raise ValueError(f"Unknown compaction method '{method}'; use one of {', '.join(METHODS)}.")
+
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+    qualities = list(qualities) if qualities is not None else [None] * len(encodings)
+
+    keep = prune_outliers(encodings, outlier_distance, keep_at_least=max(k, 1))
+    encodings, qualities = encodings[keep], [qualities[i] for i in keep]
+    if k > 0:
+        encodings, qualities = summarise(encodings, qualities, k, method)
+    return encodings, qualities
+
+
+def evaluate_compaction(student_encodings, tolerance=0.5, probe_every=4, **compaction_options):
+    """
+    Compares recognition with every stored descriptor against the compacted gallery.
+
+    Every `probe_every`-th descriptor of each student is held out as a probe and the
+    rest form the enrollment set. Genuine probes are matched against the galleries of
+    all students and count as correct only when they return their own student.
+    Impostor probes come from the students with an odd position in the input, matched
+    against galleries of the other students only, so any match is a false accept.
+
+    Args:
+        student_encodings (dict): {student_id: (N, 128) descriptors}.
+        compaction_options: Passed to compact_encodings.
+
+    Returns:
+        A dict with gallery sizes and accuracy figures for the "full" and "compacted" galleries.
+    """
+    enrolled, probes = {}, {}
+    for student_id, encodings in student_encodings.items():
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+        if len(encodings) < 2:
+            continue
+        held_out = np.zeros(len(encodings), dtype=bool)
+        held_out[probe_every - 1::probe_every] = True
+        if not held_out.any():
+            held_out[-1] = True
+        enrolled[student_id] = encodings[~held_out]
+        probes[student_id] = encodings[held_out]
+
+    galleries = {
+        'full': enrolled,
+        'compacted': {
+            student_id: compact_encodings(encodings, **compaction_options)[0]
+            for student_id, encodings in enrolled.items()
+        },
+    }
+    known = [student_id for position, student_id in enumerate(enrolled) if position % 2 == 0]
+    unknown = [student_id for position, student_id in enumerate(enrolled) if position % 2 == 1]
+
+    report = {'students': len(enrolled), 'tolerance': tolerance, 'probe_every': probe_every}
+    for name, gallery in galleries.items():
+        rows = sum(len(encodings) for encodings in gallery.values())
+        matcher = FaceMatcher.from_dict(gallery)
+        genuine_total = genuine_correct = 0
+        for student_id, queries in probes.items():
+            results = matcher.match(queries, tolerance)
+            genuine_total += len(results)
+            genuine_correct += sum(1 for matched_id, _ in results if matched_id == student_id)
+
+        known_matcher = FaceMatcher.from_dict({student_id: gallery[student_id] for student_id in known})
+        impostor_queries = [probes[student_id] for student_id in unknown]
+        impostor_results = known_matcher.match(np.concatenate(impostor_queries), tolerance) if impostor_queries else []
+        false_accepts = sum(1 for matched_id, _ in impostor_results if matched_id is not None)
+
+        report[name] = {
+            'rows': rows,
+            'bytes': rows * 128 * 4,
+            'genuine_probes': genuine_total,
+            'accuracy': round(genuine_correct / genuine_total, 4) if genuine_total else None,
+            'impostor_probes': len(impostor_results),
+            'false_accept_rate': round(false_accepts / len(impostor_results), 4) if impostor_results else None,
+        }
+    if report['compacted']['rows']:
+        report['reduction'] = round(report['full']['rows'] / report['compacted']['rows'], 2)
+    return report
@@ -0,0 +1,220 @@
+"""
+Student enrollment: turning captured face samples into a Student with embeddings.
+
+Samples are encoded by encode_samples, which also compacts each student's
+descriptors (see compaction.py) when FACE_COMPACTION is on. student_registration either does this and calls
+create_student_account within the request, or, with ENROLLMENT_BACKGROUND_JOBS
+on, stores the upload as an EnrollmentJob and returns at once.
+`manage.py run_enrollment_jobs` then claims pending jobs from the database and runs them here, so the web worker
+never waits on dlib. The browser polls the job status until it has finished.
+
+A job that fails because of its samples or because the email or matriculation
+number was taken in the meantime is failed straight away. Any other error is
+treated as transient: the job is retried with a growing delay until
+ENROLLMENT_JOB_MAX_ATTEMPTS is reached. The reason for the last failure is kept
+on the row either way.
+"""
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import inference
+from .compaction import compact_encodings
+from .models import EnrollmentJob, FaceEmbedding, Student
+
+logger = logging.getLogger(__name__)
+
+# Pending jobs looked at per claim attempt; other workers may take some of them first.
+CLAIM_CANDIDATES = 10
+
+
+class EnrollmentConflict(Exception):
+    """The email or matriculation number was registered by someone else before the job ran."""
+
+
+def create_student_account(first_name, last_name, email, matric_number, password_hash, encodings, qualities):
+    """
+    Creates the User, Student and FaceEmbedding rows for a new student in one transaction.
+
+    Args:
+        password_hash (str): The password, already hashed with make_password.
+        encodings (np.ndarray): (N, 128) face descriptors from train_dlib_model_from_samples.
+        qualities (list): Detector confidence for each descriptor.
+
+    Returns:
+        Student: The new student.
+
+    Raises:
+        EnrollmentConflict: If the email or matriculation number is already registered.
+    """
+    try:
+        with transaction.atomic():
+            if User.objects.filter(email__iexact=email).exists():
+                raise EnrollmentConflict('An account with this email address already exists.')
+            if Student.objects.filter(matric_number__iexact=matric_number).exists():
+                raise EnrollmentConflict('A student with this Matriculation Number is already registered.')
+            user = User.objects.create(
+                username=User.normalize_username(email),
+                email=User.objects.normalize_email(email),
+                first_name=first_name,
+                last_name=last_name,
+                password=password_hash,
+            )
+            student = Student.objects.create(user=user, matric_number=matric_number)
+            FaceEmbedding.objects.bulk_create(FaceEmbedding.from_encodings(student, encodings, qualities))
+    except IntegrityError as e:
+        raise EnrollmentConflict('This email address or Matriculation Number was registered at the same time.') from e
+    return student
+
+
+def encode_samples(face_samples_b64, map_samples=None):
+    """
+    Turns registration samples into the descriptors stored for a student.
+
+    The samples are encoded with train_dlib_model_from_samples. With FACE_COMPACTION
+    on, outliers are then pruned and the rest reduced to FACE_COMPACTION_K representatives.
+
+    Args:
+        map_samples (callable): Map used to prepare the samples; defaults to the configured inference runner.
+
+    Returns:
+        A tuple (encodings, qualities).
+
+    Raises:
+        ValueError: If too few samples contain a usable face.
+    """
+    # Imported here so OpenCV and dlib are only loaded by processes that enroll students.
+    from .recognition import train_dlib_model_from_samples
+
+    if map_samples is None:
+        encodings, qualities = train_dlib_model_from_samples(face_samples_b64, inference.map_jobs, inference.parallelism())
+    else:
+        encodings, qualities = train_dlib_model_from_samples(face_samples_b64, map_samples)
+    if not settings.FACE_COMPACTION:
+        return encodings, qualities
+    return compact_encodings(encodings, qualities)
+
+
+def enqueue_enrollment(cleaned_data):
+    """Stores a validated RegistrationForm submission as a pending EnrollmentJob and returns it."""
+    return EnrollmentJob.objects.create(
+        first_name=cleaned_data['first_name'],
+        last_name=cleaned_data['last_name'],
+        email=cleaned_data['email'],
+        matric_number=cleaned_data['matric_number'],
+        password=make_password(cleaned_data['password']),
+        face_samples=cleaned_data['face_samples'],
+    )
+
+
+def claim_next_job():
+    """
+    Marks the oldest runnable pending job as running and returns it, or None if there is none.
+
+    The claim is a conditional UPDATE on the job's status, so several runners can share
+    the queue on any database backend without taking row locks.
+    """
+    now = timezone.now()
+    candidates = (
+        EnrollmentJob.objects.filter(status=EnrollmentJob.PENDING, run_after__lte=now)
+        .order_by('run_after', 'id')
+        .values_list('id', flat=True)[:CLAIM_CANDIDATES]
+    )
+    for job_pk in candidates:
+        claimed = EnrollmentJob.objects.filter(pk=job_pk, status=EnrollmentJob.PENDING).update(
+            status=EnrollmentJob.RUNNING,
+            attempts=F('attempts') + 1,
+            started_at=now,
+            updated_at=now,
+        )
+        if claimed:
+            return EnrollmentJob.objects.get(pk=job_pk)
+    return None
+
+
+def requeue_stale_jobs():
+    """
+    Puts jobs left running by a worker that died back in the queue, or fails them if they are out of attempts.
+
+    Returns:
+        int: The number of jobs recovered.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.ENROLLMENT_JOB_STALE_SECONDS)
+    stale = EnrollmentJob.objects.filter(status=EnrollmentJob.RUNNING, started_at__lt=cutoff)
+    recovered = 0
+    for job in stale:
+        recovered += retry_or_fail(job, 'The worker processing this job stopped before it finished.', conditional=True)
+    return recovered
+
+
+def finish_job(job, status, error='', student=None):
+    job.status = status
+    job.last_error = error
+    job.student = student
+    job.face_samples = ''
+    job.password = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'last_error', 'student', 'face_samples', 'password', 'finished_at', 'updated_at'])
+
+
+def retry_or_fail(job, error, conditional=False):
+    """
+    Puts a job that hit a transient error back in the queue after a delay, or fails it after the last attempt.
+
+    Args:
+        conditional (bool): Only touch the row if it is still running, for jobs this worker did not claim.
+
+    Returns:
+        int: 1 if the job was updated, 0 if another worker had already moved it on.
+    """
+    now = timezone.now()
+    if job.attempts >= settings.ENROLLMENT_JOB_MAX_ATTEMPTS:
+        changes = {'status': EnrollmentJob.FAILED, 'face_samples': '', 'password': '', 'finished_at': now}
+    else:
+        delay = settings.ENROLLMENT_JOB_RETRY_DELAY * job.attempts
+        changes = {'status': EnrollmentJob.PENDING, 'run_after': now + timedelta(seconds=delay)}
+    rows = EnrollmentJob.objects.filter(pk=job.pk)
+    if conditional:
+        rows = rows.filter(status=EnrollmentJob.RUNNING, started_at=job.started_at)
+    updated = rows.update(last_error=error, updated_at=now, **changes)
+    for field, value in changes.items():
+        setattr(job, field, value)
+    job.last_error = error
+    return updated
+
+
+def run_job(job, map_samples=None):
+    """
+    Encodes a claimed job's samples and creates the student account, recording the outcome on the job.
+
+    Args:
+        job (EnrollmentJob): A job returned by claim_next_job.
+        map_samples (callable): Map used to prepare the samples; defaults to the configured inference runner.
+
+    Returns:
+        EnrollmentJob: The job, with its new status.
+    """
+    try:
+        face_samples_b64 = json.loads(job.face_samples)
+        encodings, qualities = encode_samples(face_samples_b64, map_samples)
+        student = create_student_account(
+            job.first_name, job.last_name, job.email, job.matric_number, job.password, encodings, qualities,
+        )
+    except ValueError as e:
+        finish_job(job, EnrollmentJob.FAILED, f"Face recognition setup failed: {e}")
+    except EnrollmentConflict as e:
+        finish_job(job, EnrollmentJob.FAILED, str(e))
+    except Exception as e:
+        logger.exception(f"Enrollment job {job.job_id} failed on attempt {job.attempts}.")
+        retry_or_fail(job, f"{type(e).__name__}: {e}")
+    else:
+        finish_job(job, EnrollmentJob.SUCCEEDED, student=student)
+        logger.info(f"Enrollment job {job.job_id} created student {student.id} on attempt {job.attempts}.")
+    return job
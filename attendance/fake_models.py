@@ -0,0 +1,153 @@
+"""
+A stand-in for the dlib models, for load tests on machines without the .dat files.
+
+With FACE_MODEL_BACKEND=fake in the environment, recognition.get_models() returns
+these objects instead of loading dlib's shape predictor and descriptor network.
+They keep the call signatures recognition.py relies on and return real dlib
+rectangles and detections, so the rest of the pipeline runs unchanged.
+
+The fake recognises frames drawn by fake_frame(): the face box is outlined in
+green, which the fake detector looks for, and the identity is painted inside it
+as grey stripes that survive JPEG compression. Every identity
+has a fixed random unit descriptor (fake_descriptor) to enroll students with.
+FACE_FAKE_MODEL_COST_MS keeps the CPU busy for that long per described face,
+split between detection and the descriptor, to stand in for dlib's cost.
+
+recognition.get_models() only uses these when DEBUG=True is also set.
+
+Like recognition.py, this module imports nothing from Django.
+"""
+import os
+import time
+
+import cv2
+import dlib
+import numpy as np
+
+# Hex digits painted into the face box; enough for 65536 identities.
+IDENTITY_DIGITS = 4
+FRAME_WIDTH = 320
+FRAME_HEIGHT = 240
+# Share of the simulated cost spent in detection; the rest goes to the descriptor.
+DETECT_SHARE = 0.6
+# Width in pixels of the green outline drawn around the face box.
+BORDER = 3
+
+
+def busy_wait(seconds):
+    """Spins the CPU rather than sleeping, so simulated work competes for cores like real inference."""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def face_rect(width, height):
+    """The fixed face box of a fake frame: the middle half of the image."""
+    return dlib.rectangle(width // 4, height // 4, width * 3 // 4 - 1, height * 3 // 4 - 1)
+
+
+def fake_descriptor(identity):
+    """The unit descriptor the fake network returns for `identity`."""
+    encoding = np.random.default_rng(1_000_003 + identity).standard_normal(128).astype(np.float32)
+    return encoding / np.linalg.norm(encoding)
+
+
+def fake_frame(identity, width=FRAME_WIDTH, height=FRAME_HEIGHT, quality=85):
+    """Draws a JPEG frame whose single face is `identity`."""
+    image = np.full((height, width, 3), 40, dtype=np.uint8)
+    rect = face_rect(width, height)
+    image[rect.top() - BORDER:rect.bottom() + 1 + BORDER, rect.left() - BORDER:rect.right() + 1 + BORDER] = (0, 200, 0)
+    stripe = (rect.bottom() - rect.top() + 1) // IDENTITY_DIGITS
+    for position in range(IDENTITY_DIGITS):
+        digit = (identity >> (4 * position)) & 0xF
+        top = rect.top() + position * stripe
+        image[top:top + stripe, rect.left():rect.right() + 1] = 16 * digit + 8
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+
+def find_face(rgb_frame):
+    """Returns the box inside the green outline drawn by fake_frame(), or None if no outline is visible."""
+    red, green, blue = (rgb_frame[:, :, channel].astype(np.int16) for channel in range(3))
+    outline = (green - red > 60) & (green - blue > 60)
+    rows = np.flatnonzero(outline.any(axis=1))
+    cols = np.flatnonzero(outline.any(axis=0))
+    if len(rows) == 0 or len(cols) == 0:
+        return None
+    left, top, right, bottom = cols[0] + BORDER, rows[0] + BORDER, cols[-1] - BORDER, rows[-1] - BORDER
+    if right - left < 8 or bottom - top < 8:
+        return None
+    return dlib.rectangle(int(left), int(top), int(right), int(bottom))
+
+
+def read_identity(rgb_frame, rect):
+    """Reads the identity painted by fake_frame() into `rect`."""
+    stripe = (rect.bottom() - rect.top() + 1) // IDENTITY_DIGITS
+    if stripe < 2:
+        return 0
+    identity = 0
+    centre_x = (rect.left() + rect.right()) // 2
+    for position in range(IDENTITY_DIGITS):
+        centre_y = rect.top() + position * stripe + stripe // 2
+        patch = rgb_frame[max(centre_y - 1, 0):centre_y + 2, max(centre_x - 2, 0):centre_x + 3]
+        digit = int(round((float(patch.mean()) - 8) / 16)) if patch.size else 0
+        identity |= min(max(digit, 0), 15) << (4 * position)
+    return identity
+
+
+class FakeDetector:
+    def __init__(self, cost):
+        self.cost = cost
+
+    def __call__(self, rgb_frame, upsample_num_times=0):
+        busy_wait(self.cost * DETECT_SHARE)
+        faces = dlib.rectangles()
+        rect = find_face(rgb_frame)
+        if rect is not None:
+            faces.append(rect)
+        return faces
+
+    def run(self, rgb_frame, upsample_num_times=0, adjust_threshold=0.0):
+        faces = self(rgb_frame, upsample_num_times)
+        return faces, [1.0] * len(faces), [0] * len(faces)
+
+
+class FakeShapePredictor:
+    def __call__(self, rgb_frame, rect):
+        centre = rect.center()
+        return dlib.full_object_detection(rect, [centre] * 68)
+
+
+class FakeFaceRecognizer:
+    def __init__(self, cost):
+        self.cost = cost
+
+    def compute_face_descriptor(self, images, shapes=None, *args, **kwargs):
+        """Accepts the forms recognition.py uses: a chip, chips, an image and its shape(s), or a batch."""
+        if shapes is None:
+            if isinstance(images, np.ndarray) and images.ndim == 3:
+                return self._describe_chip(images)
+            return [self._describe_chip(chip) for chip in images]
+        if isinstance(images, np.ndarray):
+            if isinstance(shapes, dlib.full_object_detection):
+                return self._describe(images, shapes)
+            return [self._describe(images, shape) for shape in shapes]
+        return [[self._describe(image, shape) for shape in image_shapes] for image, image_shapes in zip(images, shapes)]
+
+    def _describe(self, rgb_frame, shape):
+        busy_wait(self.cost * (1 - DETECT_SHARE))
+        return dlib.vector(fake_descriptor(read_identity(rgb_frame, shape.rect)).tolist())
+
+    def _describe_chip(self, chip):
+        busy_wait(self.cost * (1 - DETECT_SHARE))
+        return dlib.vector(fake_descriptor(int(chip.sum()) % (16 ** IDENTITY_DIGITS)).tolist())
+
+
+def load_fake_models(models_class):
+    """Builds the fake models as a recognition.FaceModels."""
+    cost = float(os.getenv('FACE_FAKE_MODEL_COST_MS', '0')) / 1000
+    return models_class(
+        face_detector=FakeDetector(cost),
+        shape_predictor=FakeShapePredictor(),
+        face_recognizer=FakeFaceRecognizer(cost),
+    )
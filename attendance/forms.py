@@ -1,5 +1,5 @@
 from django import forms
-from .models import Course, Student
+from .models import Course, EnrollmentJob, Student
 from django.utils import timezone
 import datetime
 from django.contrib.auth.models import User
@@ -36,6 +36,8 @@ class RegistrationForm(forms.Form):
         email = self.cleaned_data.get('email')
         if User.objects.filter(email__iexact=email).exists():
             raise forms.ValidationError("An account with this email address already exists.")
+        if EnrollmentJob.objects.filter(email__iexact=email, status__in=EnrollmentJob.ACTIVE_STATUSES).exists():
+            raise forms.ValidationError("A registration with this email address is already being processed.")
         return email
 
     def clean_matric_number(self):
@@ -43,6 +45,8 @@ class RegistrationForm(forms.Form):
         matric_number = self.cleaned_data.get('matric_number')
         if Student.objects.filter(matric_number__iexact=matric_number).exists():
             raise forms.ValidationError("A student with this Matriculation Number is already registered.")
+        if EnrollmentJob.objects.filter(matric_number__iexact=matric_number, status__in=EnrollmentJob.ACTIVE_STATUSES).exists():
+            raise forms.ValidationError("A registration with this Matriculation Number is already being processed.")
         return matric_number
 
     def clean(self):
@@ -0,0 +1,440 @@
+"""
+Per-worker cache of enrolled face encodings.
+
+Every stored dlib descriptor is kept in one pre-stacked float32 matrix with a
+parallel array mapping each row to its student id, so process_frame no longer
+has to query every student's embeddings on every frame.
+
+Student saves and deletes are logged to GalleryChange by the signal handlers in
+signals.py. The newest log id acts as a version stamp: before each use a worker
+asks for entries newer than the version its copy was built at (a single primary
+key range query) and reloads only the students listed there.
+
+Ids are handed out when a change is inserted but become visible when it
+commits, so on PostgreSQL a lower id can appear after a higher one was read.
+Each snapshot therefore remembers the ids missing below its version and asks
+for them again on every refresh for LATE_COMMIT_SECONDS, after which a missing
+id is taken to belong to a rolled-back transaction. ``manage.py
+prune_gallery_changes`` deletes old entries; a snapshot older than the oldest
+entry left is rebuilt rather than patched.
+
+Attendance is matched against per-course galleries built from
+Course.enrolled_students. They are kept in a least-recently-used cache bounded
+by settings.FACE_GALLERY_CACHE_BYTES, and enrollment changes are logged to
+GalleryChange like any other student change. A course nobody is enrolled in
+is matched against the global gallery of every student, which also serves
+walk-ins (settings.FACE_GALLERY_WALK_IN_FALLBACK) and tooling.
+
+Each snapshot also carries the name and matriculation number of its students,
+so a recognised face can be reported without querying the Student table.
+
+The global gallery searches through the index backend chosen in settings (see
+index.py), which is updated incrementally alongside the matrix. If
+settings.FACE_INDEX_PATH points at an index written by ``manage.py
+build_face_index`` it is loaded instead of being rebuilt, then caught up with
+the change log. Course galleries are small enough to always search exactly.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Min, Q
+
+from .index import ExactIndex, create_index, load_index
+from .models import ENCODING_DIM, FACE_MODEL_VERSION, Course, FaceEmbedding, GalleryChange, Student
+
+logger = logging.getLogger(__name__)
+
+# Past this many pending changes a full reload is cheaper than patching rows.
+MAX_INCREMENTAL_CHANGES = 500
+
+# How long an id missing from the change log is looked for again, in case its transaction commits late.
+LATE_COMMIT_SECONDS = 60
+# How far below the version a fresh snapshot looks for ids that have not committed yet.
+LATE_COMMIT_WINDOW = 100
+
+# What a recognition result reports about a student.
+StudentDetails = namedtuple('StudentDetails', ['name', 'matric_number'])
+
+
+class Gallery:
+    """
+    An immutable snapshot of face encodings.
+
+    Attributes:
+        matrix (np.ndarray): float32 array of shape (N, 128), one row per stored encoding.
+            Rows belonging to the same student are contiguous.
+        student_ids (np.ndarray): int64 array of shape (N,) with the student id of each row.
+        version (int): Id of the newest GalleryChange reflected in this snapshot.
+        course_id (int): The course whose enrolled students this snapshot holds, or None for every student.
+        students (dict): StudentDetails of every student in scope, by student id.
+        missing (dict): Ids at or below `version` not seen in the change log yet, with the
+            time.monotonic() at which each was first missed.
+    """
+
+    def __init__(self, matrix, student_ids, version=0, index=None, course_id=None, students=None, missing=None):
+        self.matrix = matrix
+        self.student_ids = student_ids
+        self.version = version
+        self.course_id = course_id
+        self.students = students if students is not None else {}
+        self.missing = missing if missing is not None else {}
+        self._index = index
+
+    @classmethod
+    def empty(cls, version=0, course_id=None):
+        return cls(np.empty((0, ENCODING_DIM), dtype=np.float32), np.empty(0, dtype=np.int64), version, course_id=course_id)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def is_empty(self):
+        return len(self) == 0
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.student_ids.nbytes
+
+    def replace_students(self, student_ids, matrix, row_student_ids, version, students=None, missing=None):
+        """
+        Returns a new snapshot with the rows of `student_ids` replaced by the given rows.
+
+        Students listed in `student_ids` but absent from `row_student_ids` are dropped,
+        which is how deletions are applied. `students` holds the new details of the
+        changed students that are still in scope, and `missing` the ids still looked for.
+        """
+        keep = ~np.isin(self.student_ids, np.fromiter(student_ids, dtype=np.int64))
+
+        index = None
+        if self._index is not None:
+            index = self._index.copy()
+            index.remove(student_ids)
+            index.add(matrix, row_student_ids)
+            index.version = version
+
+        details = {student_id: info for student_id, info in self.students.items() if student_id not in student_ids}
+        details.update(students or {})
+        return Gallery(
+            np.concatenate([self.matrix[keep], matrix]),
+            np.concatenate([self.student_ids[keep], row_student_ids]),
+            version,
+            index,
+            self.course_id,
+            details,
+            missing,
+        )
+
+    def with_missing(self, missing):
+        """Returns this snapshot with a different set of missing ids, sharing everything else."""
+        return Gallery(self.matrix, self.student_ids, self.version, self._index, self.course_id, self.students, missing)
+
+    @property
+    def index(self):
+        """The search index over this snapshot, built on first use."""
+        if self._index is None:
+            # Only the global gallery is large enough for the configured backend to matter.
+            index = create_index() if self.course_id is None else create_index(ExactIndex.backend)
+            index = index.build(self.matrix, self.student_ids)
+            index.version = self.version
+            self._index = index
+        return self._index
+
+    def match(self, encoding, tolerance=0.5):
+        """
+        Finds the closest stored encoding to `encoding`.
+
+        Returns:
+            A tuple (student_id, distance), or (None, None) if nothing is within `tolerance`.
+        """
+        return self.index.match(encoding, tolerance)[0]
+
+    def match_many(self, encodings, tolerance=0.5):
+        """Batch form of match(): one (student_id, distance) tuple per encoding."""
+        return self.index.match(encodings, tolerance)
+
+
+def latest_version():
+    """Returns the id of the newest GalleryChange, or 0 if nothing has been logged."""
+    return GalleryChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def missing_ids(seen_ids, low, high, now, missing=None):
+    """
+    Adds the ids in (low, high] absent from `seen_ids` to `missing`, first missed at `now`.
+
+    Keeps at most MAX_INCREMENTAL_CHANGES of the highest ids, so a large rolled-back
+    batch cannot make every refresh query unbounded.
+    """
+    missing = dict(missing or {})
+    seen_ids = set(seen_ids)
+    for change_id in range(max(low, high - MAX_INCREMENTAL_CHANGES) + 1, high + 1):
+        if change_id not in seen_ids:
+            missing.setdefault(change_id, now)
+    if len(missing) > MAX_INCREMENTAL_CHANGES:
+        missing = dict(sorted(missing.items())[-MAX_INCREMENTAL_CHANGES:])
+    return missing
+
+
+def load_rows(queryset):
+    """
+    Reads the current-model embeddings of every student in `queryset`.
+
+    Returns:
+        A tuple (matrix, student_ids) in the layout used by Gallery.
+    """
+    return embeddings_matrix(FaceEmbedding.objects.filter(student__in=queryset))
+
+
+def load_student_details(queryset):
+    """Reads the StudentDetails of every student in `queryset` with one query."""
+    rows = queryset.values_list('id', 'user__first_name', 'user__last_name', 'matric_number')
+    # Matches User.get_full_name(), which the responses used before.
+    return {
+        student_id: StudentDetails(f"{first_name} {last_name}".strip(), matric_number)
+        for student_id, first_name, last_name, matric_number in rows
+    }
+
+
+def embeddings_matrix(embeddings):
+    """
+    Turns a FaceEmbedding queryset into one float32 matrix.
+
+    The packed vectors are joined into a single buffer and reinterpreted with
+    np.frombuffer, so no Python object is created per float.
+
+    Returns:
+        A tuple (matrix, student_ids); rows of the same student are contiguous.
+    """
+    rows = list(
+        embeddings.filter(model_version=FACE_MODEL_VERSION)
+        .order_by('student_id', 'id')
+        .values_list('student_id', 'vector')
+    )
+    if not rows:
+        return np.empty((0, ENCODING_DIM), dtype=np.float32), np.empty(0, dtype=np.int64)
+
+    student_ids = np.fromiter((student_id for student_id, _ in rows), dtype=np.int64, count=len(rows))
+    buffer = b''.join(vector for _, vector in rows)
+    matrix = np.frombuffer(buffer, dtype='<f4').reshape(len(rows), ENCODING_DIM).astype(np.float32, copy=False)
+    return matrix, student_ids
+
+
+def gallery_students(course_id=None):
+    """Returns the students a gallery for `course_id` covers: the enrolled students, or everyone for None."""
+    if course_id is None:
+        return Student.objects.all()
+    return Student.objects.filter(courses=course_id)
+
+
+def build_gallery(course_id=None):
+    """Loads a fresh snapshot of the encodings of every student in scope from the database."""
+    # Read the version first so a change committed during the load is replayed next time.
+    version = latest_version()
+    # Ids just below it that are not visible yet may still commit.
+    low = max(version - LATE_COMMIT_WINDOW, 0)
+    recent = GalleryChange.objects.filter(id__gt=low, id__lte=version).values_list('id', flat=True)
+    missing = missing_ids(recent, low, version, time.monotonic())
+    students = gallery_students(course_id)
+    matrix, student_ids = load_rows(students)
+    details = load_student_details(students)
+    if course_id is not None:
+        return Gallery(matrix, student_ids, version, course_id=course_id, students=details, missing=missing)
+    index = load_saved_index(matrix, student_ids, version)
+    return Gallery(matrix, student_ids, version, index, students=details, missing=missing)
+
+
+def load_saved_index(matrix, student_ids, version):
+    """
+    Loads the index at settings.FACE_INDEX_PATH and applies the changes logged since it was saved.
+
+    Returns:
+        The index, or None if no usable file is configured.
+    """
+    path = settings.FACE_INDEX_PATH
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        index = load_index(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable face index at {path}: {e}")
+        return None
+
+    if index.version > version:
+        # Written against a newer database state than the one just loaded (or another database).
+        return None
+    if index.version < oldest_change() - 1:
+        # The changes made since it was saved have been pruned.
+        return None
+    if index.version < version:
+        changed_ids = set(GalleryChange.objects.filter(id__gt=index.version, id__lte=version).values_list('student_id', flat=True))
+        rows = np.isin(student_ids, np.fromiter(changed_ids, dtype=np.int64))
+        index.remove(changed_ids)
+        index.add(matrix[rows], student_ids[rows])
+        index.version = version
+    return index
+
+
+def oldest_change():
+    """Returns the id of the oldest GalleryChange left after pruning, or 0 if nothing has been logged."""
+    return GalleryChange.objects.aggregate(oldest=Min('id'))['oldest'] or 0
+
+
+def refresh_gallery(gallery):
+    """
+    Brings `gallery` up to date with the change log, including changes that
+    committed late with an id below its version.
+
+    Returns:
+        `gallery` itself if nothing changed, otherwise a new snapshot.
+    """
+    now = time.monotonic()
+    missing = {change_id: since for change_id, since in gallery.missing.items() if now - since < LATE_COMMIT_SECONDS}
+    query = Q(id__gt=gallery.version)
+    if missing:
+        query |= Q(id__in=list(missing))
+    changes = list(GalleryChange.objects.filter(query).values_list('id', 'student_id'))
+    if not changes:
+        return gallery if len(missing) == len(gallery.missing) else gallery.with_missing(missing)
+    if len(changes) > MAX_INCREMENTAL_CHANGES or gallery.version < oldest_change() - 1:
+        # Too many to patch, or the changes since this snapshot were pruned.
+        return build_gallery(gallery.course_id)
+
+    change_ids = [change_id for change_id, _ in changes]
+    version = max(gallery.version, *change_ids)
+    for change_id in change_ids:
+        missing.pop(change_id, None)
+    missing = missing_ids(change_ids, gallery.version, version, now, missing)
+    changed_ids = {student_id for _, student_id in changes}
+    # Students no longer in scope (deleted or unenrolled) come back with no rows and are dropped.
+    changed = gallery_students(gallery.course_id).filter(id__in=changed_ids)
+    matrix, row_ids = load_rows(changed)
+    return gallery.replace_students(changed_ids, matrix, row_ids, version, load_student_details(changed), missing)
+
+
+def prune_changes(before):
+    """
+    Deletes the GalleryChange entries logged before `before`, always keeping the newest
+    one so the version never goes backwards, and any a saved index still needs.
+
+    Workers whose snapshots are older than what is left rebuild them on their next refresh.
+
+    Returns:
+        int: The number of entries deleted.
+    """
+    keep_from = latest_version()
+    path = settings.FACE_INDEX_PATH
+    if path and os.path.exists(path):
+        try:
+            keep_from = min(keep_from, load_index(path).version + 1)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable face index at {path} while pruning: {e}")
+    deleted, _ = GalleryChange.objects.filter(created_at__lt=before, id__lt=keep_from).delete()
+    return deleted
+
+
+class CourseGalleryCache:
+    """
+    Least-recently-used course galleries, bounded by the bytes their encodings take.
+
+    Args:
+        max_bytes (int): Galleries are evicted, oldest use first, until the total fits.
+            The gallery just requested is never evicted, even if it alone is larger.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._galleries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, course_id):
+        """Returns the gallery for `course_id`, loading or refreshing it first if it is stale."""
+        with self._lock:
+            gallery = self._galleries.pop(course_id, None)
+            if gallery is None:
+                gallery = build_gallery(course_id)
+                logger.info(f"Loaded face gallery for course {course_id}: {len(gallery)} encodings, {gallery.nbytes} bytes.")
+            else:
+                gallery = refresh_gallery(gallery)
+            self._galleries[course_id] = gallery
+            self._evict()
+            return gallery
+
+    def _evict(self):
+        while len(self._galleries) > 1 and self.nbytes > self.max_bytes:
+            course_id, _ = self._galleries.popitem(last=False)
+            logger.info(f"Evicted face gallery for course {course_id}.")
+
+    @property
+    def nbytes(self):
+        return sum(gallery.nbytes for gallery in self._galleries.values())
+
+    def __len__(self):
+        return len(self._galleries)
+
+    def items(self):
+        with self._lock:
+            return list(self._galleries.items())
+
+    def clear(self):
+        with self._lock:
+            self._galleries.clear()
+
+
+_gallery = None
+_gallery_lock = threading.Lock()
+_course_galleries = CourseGalleryCache(settings.FACE_GALLERY_CACHE_BYTES)
+
+
+def get_gallery():
+    """Returns this worker's gallery of every student, loading or refreshing it first if it is stale."""
+    global _gallery
+    with _gallery_lock:
+        if _gallery is None:
+            _gallery = build_gallery()
+            logger.info(f"Loaded face gallery: {len(_gallery)} encodings, {_gallery.nbytes} bytes.")
+        else:
+            _gallery = refresh_gallery(_gallery)
+        return _gallery
+
+
+def get_course_gallery(course_id):
+    """
+    Returns this worker's gallery of the students enrolled in `course_id`, or the gallery
+    of every student while nobody is enrolled in the course.
+    """
+    gallery = _course_galleries.get(course_id)
+    if gallery.is_empty and not Course.enrolled_students.through.objects.filter(course_id=course_id).exists():
+        return get_gallery()
+    return gallery
+
+
+def prefetch_course_gallery(course_id):
+    """
+    Loads the gallery for `course_id` ahead of its first frame.
+
+    Called when a session opens so the terminal's first recognition does not pay the load.
+    """
+    gallery = get_course_gallery(course_id)
+    if settings.FACE_GALLERY_WALK_IN_FALLBACK:
+        get_gallery()
+    return gallery
+
+
+def loaded_galleries():
+    """Returns (label, gallery) pairs for the galleries this worker holds, without loading or refreshing any."""
+    galleries = [('global', _gallery)] if _gallery is not None else []
+    galleries.extend((f'course:{course_id}', gallery) for course_id, gallery in _course_galleries.items())
+    return galleries
+
+
+def clear_gallery():
+    """Drops this worker's cached galleries so the next lookups reload them."""
+    global _gallery
+    with _gallery_lock:
+        _gallery = None
+    _course_galleries.clear()
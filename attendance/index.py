@@ -0,0 +1,363 @@
+"""
+Pluggable search indexes over stored face encodings.
+
+Two backends share one interface (build/add/remove/search/match/save/load):
+
+* ``exact`` wraps FaceMatcher and scans every stored encoding.
+* ``ivf`` is an inverted-file index: encodings are partitioned around k-means
+  centroids and a query only scans the ``n_probe`` partitions whose centroids
+  are closest to it. Recall drops slightly in exchange for touching a fraction
+  of the gallery; see ``manage.py bench_index`` for the trade-off.
+
+The global gallery picks its backend from settings.FACE_INDEX_BACKEND and
+settings.FACE_INDEX_OPTIONS.
+"""
+import copy
+from abc import ABC, abstractmethod
+
+import numpy as np
+from django.conf import settings
+
+from .matching import FaceMatcher
+
+ENCODING_DIM = 128
+
+
+class BaseIndex(ABC):
+    """Interface shared by every index backend; a backend missing any abstract method cannot be created."""
+
+    backend = None
+    # Id of the newest GalleryChange reflected in the index; stored by save() and read back by load_index().
+    version = 0
+
+    @abstractmethod
+    def build(self, matrix, row_ids):
+        """Replaces the index contents with `matrix` (N x 128) and its per-row student ids. Returns self."""
+
+    @abstractmethod
+    def add(self, matrix, row_ids):
+        """Adds encodings without rebuilding the index."""
+
+    @abstractmethod
+    def remove(self, student_ids):
+        """Drops every encoding that belongs to one of `student_ids`."""
+
+    @abstractmethod
+    def search(self, queries):
+        """
+        Finds the nearest stored encoding for each query.
+
+        Returns:
+            A tuple (row_student_ids, distances) of arrays of shape (Q,). Queries against an
+            empty index get a student id of -1 and an infinite distance.
+        """
+
+    @abstractmethod
+    def _state(self):
+        """Returns the arrays save() writes, by name."""
+
+    @classmethod
+    @abstractmethod
+    def _from_state(cls, state):
+        """Rebuilds an index from the arrays _state() returned."""
+
+    @abstractmethod
+    def __len__(self):
+        """The number of stored encodings."""
+
+    @property
+    @abstractmethod
+    def nbytes(self):
+        """Bytes taken by the index's arrays."""
+
+    def copy(self):
+        """
+        Returns a copy that can be changed with add()/remove() while readers keep using this one.
+
+        Backends never modify arrays in place, so sharing them between copies is safe.
+        """
+        return copy.copy(self)
+
+    def match(self, queries, tolerance=0.5):
+        """
+        Finds the best student for each query encoding.
+
+        Returns:
+            A list with one (student_id, distance) tuple per query, or (None, None) for
+            queries with no stored encoding within `tolerance`.
+        """
+        student_ids, distances = self.search(queries)
+        return [
+            (int(student_id), float(distance)) if distance <= tolerance else (None, None)
+            for student_id, distance in zip(student_ids, distances)
+        ]
+
+    def save(self, path):
+        """Writes the index to `path` as a NumPy .npz archive."""
+        with open(path, 'wb') as f:
+            np.savez(f, backend=np.array(self.backend), version=np.array(self.version), **self._state())
+
+
+class ExactIndex(BaseIndex):
+    """Brute-force search over every stored encoding."""
+
+    backend = 'exact'
+
+    def __init__(self):
+        self._matcher = FaceMatcher(np.empty((0, ENCODING_DIM), dtype=np.float32), np.empty(0, dtype=np.int64))
+
+    def build(self, matrix, row_ids):
+        self._matcher = FaceMatcher(matrix, row_ids)
+        return self
+
+    def add(self, matrix, row_ids):
+        self._matcher = FaceMatcher(
+            np.concatenate([self._matcher.matrix, np.asarray(matrix, dtype=np.float32).reshape(-1, ENCODING_DIM)]),
+            np.concatenate([self._matcher.row_ids, np.asarray(row_ids, dtype=np.int64)]),
+        )
+
+    def remove(self, student_ids):
+        keep = ~np.isin(self._matcher.row_ids, np.asarray(list(student_ids), dtype=np.int64))
+        self._matcher = FaceMatcher(self._matcher.matrix[keep], self._matcher.row_ids[keep])
+
+    def search(self, queries):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if len(self) == 0:
+            return np.full(len(queries), -1, dtype=np.int64), np.full(len(queries), np.inf, dtype=np.float32)
+        distances = self._matcher.distances(queries)
+        best_rows = np.argmin(distances, axis=1)
+        return self._matcher.row_ids[best_rows], distances[np.arange(len(queries)), best_rows]
+
+    def match(self, queries, tolerance=0.5):
+        return self._matcher.match(queries, tolerance)
+
+    def __len__(self):
+        return len(self._matcher)
+
+    @property
+    def nbytes(self):
+        return self._matcher.matrix.nbytes + self._matcher.row_ids.nbytes + self._matcher.squared_norms.nbytes
+
+    def _state(self):
+        return {'matrix': self._matcher.matrix, 'row_ids': self._matcher.row_ids}
+
+    @classmethod
+    def _from_state(cls, state):
+        return cls().build(state['matrix'], state['row_ids'])
+
+
+class IVFIndex(BaseIndex):
+    """
+    Inverted-file index over k-means partitions.
+
+    Args:
+        n_lists (int): Number of partitions. Defaults to roughly sqrt(N) at build time.
+        n_probe (int): Partitions scanned per query. Higher is slower but closer to exact.
+        iterations (int): k-means iterations used by build().
+        seed (int): Seed for the k-means initialisation.
+    """
+
+    backend = 'ivf'
+
+    def __init__(self, n_lists=None, n_probe=8, iterations=20, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        self._lists = []
+        self._list_ids = []
+        self._list_norms = []
+
+    def build(self, matrix, row_ids):
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(matrix))))
+        n_lists = min(n_lists, max(1, len(matrix)))
+
+        self.centroids = kmeans(matrix, n_lists, iterations=self.iterations, seed=self.seed) if len(matrix) else self.centroids
+        self._lists = [np.empty((0, ENCODING_DIM), dtype=np.float32) for _ in range(len(self.centroids))]
+        self._list_ids = [np.empty(0, dtype=np.int64) for _ in range(len(self.centroids))]
+        self._list_norms = [np.empty(0, dtype=np.float32) for _ in range(len(self.centroids))]
+        self.add(matrix, row_ids)
+        return self
+
+    def copy(self):
+        clone = super().copy()
+        clone._lists = list(self._lists)
+        clone._list_ids = list(self._list_ids)
+        clone._list_norms = list(self._list_norms)
+        return clone
+
+    def add(self, matrix, row_ids):
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        if len(matrix) == 0:
+            return
+        if len(self.centroids) == 0:
+            # Nothing to partition around yet; the first batch seeds the centroids.
+            self.build(matrix, row_ids)
+            return
+
+        assignments = nearest_centroid(matrix, self.centroids)
+        for list_no in np.unique(assignments):
+            rows = assignments == list_no
+            self._set_list(
+                list_no,
+                np.concatenate([self._lists[list_no], matrix[rows]]),
+                np.concatenate([self._list_ids[list_no], row_ids[rows]]),
+            )
+
+    def remove(self, student_ids):
+        student_ids = np.asarray(list(student_ids), dtype=np.int64)
+        for list_no, ids in enumerate(self._list_ids):
+            keep = ~np.isin(ids, student_ids)
+            if not keep.all():
+                self._set_list(list_no, self._lists[list_no][keep], ids[keep])
+
+    def _set_list(self, list_no, matrix, row_ids):
+        self._lists[list_no] = matrix
+        self._list_ids[list_no] = row_ids
+        self._list_norms[list_no] = np.einsum('ij,ij->i', matrix, matrix)
+
+    def search(self, queries):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        best_ids = np.full(len(queries), -1, dtype=np.int64)
+        best_distances = np.full(len(queries), np.inf, dtype=np.float32)
+        if len(self.centroids) == 0:
+            return best_ids, best_distances
+
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = np.argpartition(squared_distances(queries, self.centroids), n_probe - 1, axis=1)[:, :n_probe]
+
+        for query_no, query in enumerate(queries):
+            query_norm = float(query @ query)
+            for list_no in probes[query_no]:
+                if len(self._list_ids[list_no]) == 0:
+                    continue
+                squared = query_norm + self._list_norms[list_no] - 2.0 * (self._lists[list_no] @ query)
+                row = int(np.argmin(squared))
+                distance = np.sqrt(max(float(squared[row]), 0.0))
+                if distance < best_distances[query_no]:
+                    best_distances[query_no] = distance
+                    best_ids[query_no] = self._list_ids[list_no][row]
+        return best_ids, best_distances
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._list_ids)
+
+    @property
+    def nbytes(self):
+        return self.centroids.nbytes + sum(
+            matrix.nbytes + ids.nbytes + norms.nbytes
+            for matrix, ids, norms in zip(self._lists, self._list_ids, self._list_norms)
+        )
+
+    def _state(self):
+        sizes = np.array([len(ids) for ids in self._list_ids], dtype=np.int64)
+        return {
+            'centroids': self.centroids,
+            'list_sizes': sizes,
+            'matrix': np.concatenate(self._lists) if self._lists else np.empty((0, ENCODING_DIM), dtype=np.float32),
+            'row_ids': np.concatenate(self._list_ids) if self._list_ids else np.empty(0, dtype=np.int64),
+            'n_probe': np.array(self.n_probe),
+            'n_lists': np.array(len(self.centroids)),
+        }
+
+    @classmethod
+    def _from_state(cls, state):
+        index = cls(n_lists=int(state['n_lists']), n_probe=int(state['n_probe']))
+        index.centroids = state['centroids']
+        bounds = np.cumsum(np.r_[0, state['list_sizes']])
+        index._lists = [None] * len(index.centroids)
+        index._list_ids = [None] * len(index.centroids)
+        index._list_norms = [None] * len(index.centroids)
+        for list_no in range(len(index.centroids)):
+            start, end = bounds[list_no], bounds[list_no + 1]
+            index._set_list(list_no, state['matrix'][start:end], state['row_ids'][start:end])
+        return index
+
+
+BACKENDS = {
+    ExactIndex.backend: ExactIndex,
+    IVFIndex.backend: IVFIndex,
+}
+
+
+def create_index(backend=None, **options):
+    """
+    Creates an empty index.
+
+    Args:
+        backend (str): One of BACKENDS. Defaults to settings.FACE_INDEX_BACKEND.
+        **options: Backend constructor arguments. Defaults to settings.FACE_INDEX_OPTIONS
+            when `backend` is also taken from settings.
+
+    Raises:
+        ValueError: If the backend name is unknown.
+    """
+    if backend is None:
+        backend = settings.FACE_INDEX_BACKEND
+        options = {**settings.FACE_INDEX_OPTIONS, **options}
+    try:
+        index_class = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown face index backend '{backend}'. Choose one of: {', '.join(BACKENDS)}.")
+    return index_class(**options)
+
+
+def load_index(path):
+    """Reads an index written by BaseIndex.save()."""
+    with np.load(path) as archive:
+        state = {key: archive[key] for key in archive.files}
+    backend = str(state.pop('backend'))
+    version = int(state.pop('version'))
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown face index backend '{backend}' in {path}.")
+    index = BACKENDS[backend]._from_state(state)
+    index.version = version
+    return index
+
+
+def squared_distances(points, centroids):
+    """Returns the (P, C) matrix of squared Euclidean distances."""
+    squared = np.einsum('ij,ij->i', points, points)[:, None] + np.einsum('ij,ij->i', centroids, centroids)[None, :]
+    squared -= 2.0 * (points @ centroids.T)
+    return squared
+
+
+def nearest_centroid(points, centroids, chunk_size=8192):
+    """Returns the index of the closest centroid for every point, in chunks to bound memory."""
+    assignments = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmin(squared_distances(chunk, centroids), axis=1)
+    return assignments
+
+
+def kmeans(points, n_clusters, iterations=20, seed=0, max_sample=50000):
+    """
+    Lloyd's k-means on at most `max_sample` points.
+
+    Returns:
+        A float32 array of shape (n_clusters, 128).
+    """
+    rng = np.random.default_rng(seed)
+    points = np.asarray(points, dtype=np.float32)
+    if len(points) > max_sample:
+        points = points[rng.choice(len(points), max_sample, replace=False)]
+    n_clusters = min(n_clusters, len(points))
+
+    centroids = points[rng.choice(len(points), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroid(points, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, points)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            # Re-seed empty clusters on random points so every partition stays in use.
+            centroids[empty] = points[rng.choice(len(points), int(empty.sum()), replace=False)]
+    return centroids
@@ -0,0 +1,283 @@
+"""
+Out-of-process pool for face detection and embedding.
+
+dlib detection and compute_face_descriptor are CPU-bound and hold a web worker
+for the whole time they run. With settings.FACE_INFERENCE_WORKERS above zero,
+they run instead in a pool of worker processes. Each worker imports
+recognition.py, and so loads the dlib models, exactly once. Web workers only
+decode the request, submit a job and wait for its result, so web and inference
+capacity can be sized independently.
+
+The pool accepts at most FACE_INFERENCE_WORKERS + FACE_INFERENCE_QUEUE_SIZE jobs
+at a time. Past that, submit() raises InferenceBusy straight away instead of
+letting the queue (and every terminal's latency) grow. A caller that waits longer
+than FACE_INFERENCE_TIMEOUT seconds gets InferenceTimeout. With zero workers,
+jobs run inline in the calling thread and are still counted in stats(); map()
+then spreads its items over FACE_INLINE_MAP_THREADS threads. Whether threads
+help depends on how much of each job runs without the GIL on the machine at
+hand, so it stays at one thread unless bench_enrollment shows a gain.
+
+A worker process that dies (killed for memory, or crashed inside dlib) breaks
+the whole executor. run() and map_jobs() then discard the pool, start a new one
+and retry the job once.
+"""
+import atexit
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceBusy(Exception):
+    """Raised when the pool already holds as many jobs as it accepts."""
+
+
+class InferenceTimeout(Exception):
+    """Raised when a job does not finish within the configured timeout."""
+
+
+def _load_models():
+    # Runs once in each worker process so the models are loaded before the first job arrives.
+    from .recognition import warm_up
+    warm_up()
+
+
+class InferencePool:
+    """
+    A bounded pool of inference worker processes.
+
+    Args:
+        workers (int): Number of worker processes.
+        queue_size (int): Jobs that may wait for a free worker on top of those running.
+        timeout (float): Seconds a caller waits for a result.
+    """
+
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.timeout = timeout
+        # spawn rather than fork: the web process has open database connections and threads.
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_load_models,
+        )
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'timed_out': 0, 'rejected': 0}
+        self._peak_in_flight = 0
+        self._busy_seconds = 0.0
+
+    def _admit(self):
+        """Takes a slot for a new job and returns its start time, or raises InferenceBusy."""
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            logger.warning(f"Inference pool full ({self.capacity} jobs in flight); rejecting job.")
+            raise InferenceBusy()
+
+        with self._lock:
+            self._counters['submitted'] += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        return time.perf_counter()
+
+    def submit(self, func, *args):
+        """
+        Runs `func(*args)` in a worker process and returns its result.
+
+        `func` must be a module-level function and its arguments and result picklable.
+
+        Raises:
+            InferenceBusy: If the pool is full.
+            InferenceTimeout: If the result does not arrive within the timeout. The job
+                itself keeps its worker until it finishes.
+        """
+        started_at = self._admit()
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._finish(started_at, 'failed')
+            raise
+        # The slot is held until the worker is done, even if the caller has given up waiting.
+        future.add_done_callback(lambda f: self._finish(started_at, 'failed' if f.cancelled() or f.exception() else 'completed'))
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self._count('timed_out')
+            raise InferenceTimeout()
+
+    def map(self, func, items):
+        """
+        Runs `func` over `items` spread across every worker and returns the results in order.
+
+        The whole map counts as one job: it takes one slot, and the timeout covers all of it.
+
+        Raises:
+            InferenceBusy: If the pool is full.
+            InferenceTimeout: If the results do not all arrive within the timeout.
+        """
+        items = list(items)
+        started_at = self._admit()
+        outcome = 'failed'
+        try:
+            chunksize = max(1, -(-len(items) // self.workers))
+            results = list(self._executor.map(func, items, timeout=self.timeout, chunksize=chunksize))
+            outcome = 'completed'
+            return results
+        except FutureTimeoutError:
+            self._count('timed_out')
+            raise InferenceTimeout()
+        finally:
+            self._finish(started_at, outcome)
+
+    def _finish(self, started_at, outcome):
+        with self._lock:
+            self._in_flight -= 1
+            self._counters[outcome] += 1
+            self._busy_seconds += time.perf_counter() - started_at
+        self._slots.release()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        """Returns the pool size, current queue depth and job counters as a dict."""
+        with self._lock:
+            finished = self._counters['completed'] + self._counters['failed']
+            return {
+                'workers': self.workers,
+                'capacity': self.capacity,
+                'in_flight': self._in_flight,
+                'queued': max(self._in_flight - self.workers, 0),
+                'peak_in_flight': self._peak_in_flight,
+                **self._counters,
+                'mean_job_ms': round(self._busy_seconds * 1000 / finished, 1) if finished else None,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class InlineRunner:
+    """
+    Stand-in for InferencePool that runs jobs in the calling thread.
+
+    Args:
+        map_threads (int): Threads map() spreads its items over; 1 maps in the calling thread.
+    """
+
+    workers = 0
+
+    def __init__(self, map_threads=1):
+        self.map_threads = map_threads
+        self._lock = threading.Lock()
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0}
+        self._busy_seconds = 0.0
+        self._threads = None
+
+    def submit(self, func, *args):
+        started_at = time.perf_counter()
+        outcome = 'failed'
+        try:
+            result = func(*args)
+            outcome = 'completed'
+            return result
+        finally:
+            with self._lock:
+                self._counters['submitted'] += 1
+                self._counters[outcome] += 1
+                self._busy_seconds += time.perf_counter() - started_at
+
+    def map(self, func, items):
+        items = list(items)
+        if self.map_threads < 2 or len(items) < 2:
+            return self.submit(lambda: [func(item) for item in items])
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.map_threads, thread_name_prefix='inference-map')
+        return self.submit(lambda: list(self._threads.map(func, items)))
+
+    def stats(self):
+        with self._lock:
+            submitted = self._counters['submitted']
+            return {
+                'workers': 0,
+                'map_threads': self.map_threads,
+                **self._counters,
+                'mean_job_ms': round(self._busy_seconds * 1000 / submitted, 1) if submitted else None,
+            }
+
+    def shutdown(self):
+        if self._threads is not None:
+            self._threads.shutdown(wait=False)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """Returns this process's pool, starting it on first use according to settings."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            workers = settings.FACE_INFERENCE_WORKERS
+            if workers > 0:
+                _runner = InferencePool(workers, settings.FACE_INFERENCE_QUEUE_SIZE, settings.FACE_INFERENCE_TIMEOUT)
+                atexit.register(_runner.shutdown)
+                logger.info(f"Started face inference pool with {workers} worker processes.")
+            else:
+                _runner = InlineRunner(settings.FACE_INLINE_MAP_THREADS)
+                atexit.register(_runner.shutdown)
+        return _runner
+
+
+def discard_runner(runner):
+    """Drops `runner` so the next get_runner() starts a new pool, unless another thread already replaced it."""
+    global _runner
+    with _runner_lock:
+        if _runner is runner:
+            _runner = None
+    runner.shutdown()
+
+
+def parallelism():
+    """How many jobs this process's runner works on at once: its workers, or its map threads inline."""
+    runner = get_runner()
+    return runner.workers or getattr(runner, 'map_threads', 1)
+
+
+def run(func, *args):
+    """Runs an inference job from recognition.py through this process's pool. See InferencePool.submit."""
+    runner = get_runner()
+    try:
+        return runner.submit(func, *args)
+    except BrokenExecutor as e:
+        logger.error(f"Face inference pool is broken ({e}); restarting it and retrying the job.")
+        discard_runner(runner)
+        return get_runner().submit(func, *args)
+
+
+def map_jobs(func, items):
+    """Runs `func` over `items` in parallel through this process's pool. See InferencePool.map."""
+    items = list(items)
+    runner = get_runner()
+    try:
+        return runner.map(func, items)
+    except BrokenExecutor as e:
+        logger.error(f"Face inference pool is broken ({e}); restarting it and retrying the job.")
+        discard_runner(runner)
+        return get_runner().map(func, items)
+
+
+def stats():
+    return get_runner().stats()
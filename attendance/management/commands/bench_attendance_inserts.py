@@ -0,0 +1,131 @@
+import json
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from attendance.models import AttendanceRecord, AttendanceSession, Course, Student
+from attendance.stats import insert_records
+from attendance.writebehind import AttendanceBuffer
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1] if len(values) > 1 else values[0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures attendance insert throughput on the configured database (SQLite or PostgreSQL via DATABASE_URL) '
+        'when a class arrives at once: one transaction per mark, as without write-behind, against the '
+        'journaled write-behind buffer. Creates a throwaway course, session and students and deletes them afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=300, help='Students marked per run.')
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent marking threads (terminals).')
+        parser.add_argument('--interval-ms', type=int, default=200, help='Write-behind flush interval.')
+        parser.add_argument('--batch', type=int, default=100, help='Write-behind early-flush threshold.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        self.stdout.write(f"Database: {connection.vendor}, {options['students']} students, {options['threads']} threads.")
+        lecturer = User.objects.create(username=f'bench-lecturer-{tag}')
+        try:
+            course = Course.objects.create(course_name='Insert benchmark', course_code=f'BENCH-{tag}', lecturer=lecturer)
+            users = User.objects.bulk_create(
+                [User(username=f'bench-student-{tag}-{i}') for i in range(options['students'])]
+            )
+            students = Student.objects.bulk_create(
+                [Student(user=user, matric_number=f'BENCH/{tag}/{i}') for i, user in enumerate(users)]
+            )
+            student_ids = [student.id for student in students]
+
+            results = [
+                self.run('per-record transactions', course, student_ids, options, self.direct_marker),
+                self.run('write-behind', course, student_ids, options, self.buffered_marker),
+            ]
+        finally:
+            Student.objects.filter(matric_number__startswith=f'BENCH/{tag}/').delete()
+            User.objects.filter(username__startswith=f'bench-student-{tag}-').delete()
+            lecturer.delete()  # Cascades to the course, session and records.
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'mode':<25} {'records/s':>10} {'ack p50 ms':>11} {'ack p95 ms':>11} {'errors':>7} {'rows':>6}")
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:<25} {row['records_per_second']:>10.1f} {row['ack_p50_ms']:>11.2f} "
+                f"{row['ack_p95_ms']:>11.2f} {row['errors']:>7} {row['rows']:>6}"
+            )
+
+    def direct_marker(self, options):
+        def mark(record):
+            insert_records([record])
+        return mark, lambda: None
+
+    def buffered_marker(self, options):
+        journal_dir = tempfile.mkdtemp(prefix='attendance-journal-')
+        buffer = AttendanceBuffer(journal_dir, options['interval_ms'] / 1000, options['batch']).start()
+
+        def mark(record):
+            buffer.submit([record])
+
+        def drain():
+            buffer.stop()
+            shutil.rmtree(journal_dir)
+        return mark, drain
+
+    def run(self, mode, course, student_ids, options, make_marker):
+        """Marks every student once from a pool of threads and times it until all records are in the database."""
+        session = AttendanceSession.objects.create(course=course, start_time=timezone.now())
+        mark, drain = make_marker(options)
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def mark_one(student_id):
+            record = AttendanceRecord(session=session, student_id=student_id, status='on_time')
+            start = time.perf_counter()
+            try:
+                mark(record)
+                with lock:
+                    latencies.append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+            finally:
+                close_old_connections()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            list(pool.map(mark_one, student_ids))
+        drain()
+        elapsed = time.perf_counter() - start
+
+        rows = AttendanceRecord.objects.filter(session=session).count()
+        if errors:
+            self.stderr.write(f'{mode}: {len(errors)} marks failed, e.g. {errors[0]}')
+        return {
+            'mode': mode,
+            'database': connection.vendor,
+            'students': len(student_ids),
+            'threads': options['threads'],
+            'seconds': round(elapsed, 3),
+            'records_per_second': round(rows / elapsed, 1),
+            'ack_p50_ms': round(percentile(latencies, 50), 2),
+            'ack_p95_ms': round(percentile(latencies, 95), 2),
+            'errors': len(errors),
+            'rows': rows,
+        }
@@ -0,0 +1,104 @@
+import base64
+import json
+import time
+
+import cv2
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+
+from attendance import recognition
+from attendance.inference import InferencePool
+
+
+def legacy_train(face_samples_b64):
+    """The sequential per-sample encoding loop used before batching, kept as the benchmark baseline."""
+    models = recognition.get_models()
+    encodings = []
+    for b64_img in face_samples_b64:
+        _format, img_str = b64_img.split(';base64,')
+        img = cv2.imdecode(np.frombuffer(base64.b64decode(img_str), np.uint8), cv2.IMREAD_COLOR)
+        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        detected_faces, _, _ = models.face_detector.run(rgb_img, 1)
+        if len(detected_faces) != 1:
+            continue
+        shape = models.shape_predictor(rgb_img, detected_faces[0])
+        encodings.append(models.face_recognizer.compute_face_descriptor(rgb_img, shape))
+    return np.asarray(encodings, dtype=np.float32)
+
+
+def make_samples(image_path, count, seed=0):
+    """Builds `count` data-URL samples from one photo, varying brightness and contrast like a live capture."""
+    img = cv2.imread(image_path)
+    if img is None:
+        raise CommandError(f'Could not read {image_path}.')
+    rng = np.random.default_rng(seed)
+    samples = []
+    for _ in range(count):
+        variant = cv2.convertScaleAbs(img, alpha=rng.uniform(0.85, 1.15), beta=rng.uniform(-15, 15))
+        ok, buffer = cv2.imencode('.jpg', variant, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        samples.append('data:image/jpeg;base64,' + base64.b64encode(buffer.tobytes()).decode())
+    return samples
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = (
+        'Times enrollment encoding for different sample counts: the legacy sequential loop, the batched '
+        'path inline and on a process pool, and a full student_registration POST (rolled back).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('image', help='Path to a photo with exactly one face, used to build the samples.')
+        parser.add_argument('--sizes', type=int, nargs='+', default=[5, 20, 50], help='Sample counts to time.')
+        parser.add_argument('--workers', type=int, default=4, help='Process pool size for the parallel run (0 to skip it).')
+
+    def handle(self, *args, **options):
+        pool = None
+        if options['workers'] > 0:
+            pool = InferencePool(options['workers'], queue_size=0, timeout=600)
+            # Start the workers and load their models before timing anything.
+            pool.map(recognition.encode_chunk, [[sample] for sample in make_samples(options['image'], options['workers'])])
+
+        self.stdout.write(f"{'samples':>8} {'legacy s':>9} {'batched s':>10} {'pool s':>8} {'register s':>11}")
+        try:
+            for size in options['sizes']:
+                samples = make_samples(options['image'], size)
+                legacy = timed(legacy_train, samples)
+                batched = timed(recognition.train_dlib_model_from_samples, samples)
+                parallel = timed(recognition.train_dlib_model_from_samples, samples, pool.map, options['workers']) if pool else None
+                register = self.time_registration(samples, size)
+                self.stdout.write(
+                    f"{size:>8} {legacy:>9.2f} {batched:>10.2f} "
+                    f"{parallel if parallel is not None else float('nan'):>8.2f} {register:>11.2f}"
+                )
+        finally:
+            if pool:
+                pool.shutdown()
+
+    def time_registration(self, samples, size):
+        """Posts a registration with `samples` through the real view, using the configured inference pool."""
+        data = {
+            'first_name': 'Bench',
+            'last_name': 'Student',
+            'email': f'bench-enrollment-{size}@example.com',
+            'matric_number': f'BENCH/{size}',
+            'password': 'bench-password',
+            'confirm_password': 'bench-password',
+            'face_samples': json.dumps(samples),
+        }
+        with transaction.atomic():
+            start = time.perf_counter()
+            response = Client().post(reverse('student_registration'), data)
+            elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        if response.status_code != 302:
+            raise CommandError(f'Registration with {size} samples did not succeed.')
+        return elapsed
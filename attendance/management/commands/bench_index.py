@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.gallery import load_rows
+from attendance.index import ExactIndex, IVFIndex, load_index
+from attendance.models import Student
+
+
+def synthetic_gallery(rng, students, per_student, sample_spread=0.3, identity_spread=0.6):
+    """
+    Clustered stand-in for dlib descriptors.
+
+    Identity vectors are scattered around a shared direction so different students sit
+    roughly 0.7-0.8 apart, and each sample lies about `sample_spread` from its identity,
+    which is close to how real 128-d dlib encodings are distributed.
+
+    Returns:
+        A tuple (matrix, row_ids, centers).
+    """
+    base = rng.standard_normal(128).astype(np.float32)
+    base /= np.linalg.norm(base)
+    offsets = rng.standard_normal((students, 128)).astype(np.float32)
+    offsets *= identity_spread / np.linalg.norm(offsets, axis=1, keepdims=True)
+    centers = base + offsets
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    row_ids = np.repeat(np.arange(students, dtype=np.int64), per_student)
+    matrix = centers[row_ids] + noisy_offsets(rng, len(row_ids), sample_spread)
+    return matrix, row_ids, centers
+
+
+def noisy_offsets(rng, count, spread):
+    """Random float32 offsets whose norm is about `spread`."""
+    return ((spread / np.sqrt(128)) * rng.standard_normal((count, 128))).astype(np.float32)
+
+
+class Command(BaseCommand):
+    help = 'Reports recall and latency of the approximate face index against the exact matcher'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=5000, help='Synthetic students to generate.')
+        parser.add_argument('--per-student', type=int, default=20, help='Synthetic encodings per student.')
+        parser.add_argument('--from-db', action='store_true', help='Benchmark the encodings stored in the database instead.')
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--n-lists', type=int, default=None)
+        parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        if options['from_db']:
+            matrix, row_ids = load_rows(Student.objects.all())
+            if not len(matrix):
+                raise CommandError('No face encodings are stored; enroll students or drop --from-db.')
+            picks = rng.integers(0, len(matrix), options['queries'])
+            queries = matrix[picks] + noisy_offsets(rng, len(picks), 0.1)
+        else:
+            matrix, row_ids, centers = synthetic_gallery(rng, options['students'], options['per_student'])
+            truth = rng.integers(0, len(centers), options['queries'])
+            queries = centers[truth] + noisy_offsets(rng, len(truth), 0.3)
+
+        exact = ExactIndex().build(matrix, row_ids)
+        start = time.perf_counter()
+        expected_ids = np.array([exact.search(query)[0][0] for query in queries])
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        start = time.perf_counter()
+        ivf = IVFIndex(n_lists=options['n_lists']).build(matrix, row_ids)
+        build_seconds = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.npz')
+            start = time.perf_counter()
+            ivf.save(path)
+            save_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            ivf = load_index(path)
+            load_seconds = time.perf_counter() - start
+
+        report = {
+            'encodings': int(len(matrix)),
+            'students': int(len(np.unique(row_ids))),
+            'queries': int(len(queries)),
+            'n_lists': int(len(ivf.centroids)),
+            'build_seconds': round(build_seconds, 3),
+            'save_seconds': round(save_seconds, 3),
+            'load_seconds': round(load_seconds, 3),
+            'exact_ms_per_query': round(exact_ms, 4),
+            'ivf': [],
+        }
+        for n_probe in options['n_probe']:
+            ivf.n_probe = n_probe
+            start = time.perf_counter()
+            found_ids = np.array([ivf.search(query)[0][0] for query in queries])
+            ivf_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            report['ivf'].append({
+                'n_probe': n_probe,
+                'recall_at_1': round(float(np.mean(found_ids == expected_ids)), 4),
+                'ms_per_query': round(ivf_ms, 4),
+                'speedup': round(exact_ms / ivf_ms, 2),
+            })
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f"{report['encodings']} encodings, {report['students']} students, {report['n_lists']} lists; "
+            f"build {report['build_seconds']}s, save {report['save_seconds']}s, load {report['load_seconds']}s"
+        )
+        self.stdout.write(f"exact: {report['exact_ms_per_query']:.3f} ms/query")
+        self.stdout.write(f"{'n_probe':>8} {'recall@1':>9} {'ms/query':>9} {'speedup':>8}")
+        for row in report['ivf']:
+            self.stdout.write(f"{row['n_probe']:>8} {row['recall_at_1']:>9.4f} {row['ms_per_query']:>9.3f} {row['speedup']:>7.2f}x")
@@ -0,0 +1,84 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from attendance.matching import FaceMatcher
+
+
+def legacy_find_best_match(known_encodings_data, unknown_encoding, tolerance=0.5):
+    """The per-student loop find_best_match used before FaceMatcher, kept as the benchmark baseline."""
+    best_match_student_id = None
+    min_distance = float('inf')
+    unknown_encoding_np = np.array(unknown_encoding)
+
+    for student_id, encodings_list in known_encodings_data.items():
+        known_encodings_np = np.array(encodings_list)
+        distances = np.linalg.norm(known_encodings_np - unknown_encoding_np, axis=1)
+        current_min_distance = np.min(distances)
+        if current_min_distance < min_distance:
+            min_distance = current_min_distance
+            best_match_student_id = student_id
+
+    if min_distance <= tolerance:
+        return best_match_student_id, min_distance
+    return None, None
+
+
+def random_unit_encodings(rng, count):
+    encodings = rng.standard_normal((count, 128)).astype(np.float32)
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    return encodings
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks FaceMatcher against the legacy per-student find_best_match loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Total number of stored encodings to benchmark.')
+        parser.add_argument('--per-student', type=int, default=20,
+                            help='Encodings stored per student.')
+        parser.add_argument('--queries', type=int, default=20,
+                            help='Query encodings per measurement.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        per_student = options['per_student']
+
+        self.stdout.write(f"{'encodings':>10} {'students':>9} {'legacy ms/q':>12} {'matcher ms/q':>13} {'batched ms/q':>13} {'speedup':>8}")
+        for size in options['sizes']:
+            matrix = random_unit_encodings(rng, size)
+            row_ids = np.arange(size, dtype=np.int64) // per_student
+            known_encodings_data = {
+                int(student_id): matrix[start:start + per_student].tolist()
+                for student_id, start in zip(row_ids[::per_student], range(0, size, per_student))
+            }
+
+            # Queries are noisy copies of stored rows so every lookup has a true answer.
+            picks = rng.integers(0, size, options['queries'])
+            queries = matrix[picks] + 0.01 * random_unit_encodings(rng, len(picks))
+            expected = row_ids[picks]
+
+            start = time.perf_counter()
+            legacy = [legacy_find_best_match(known_encodings_data, query) for query in queries]
+            legacy_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+            matcher = FaceMatcher(matrix, row_ids)
+            start = time.perf_counter()
+            single = [matcher.best_match(query) for query in queries]
+            single_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+            start = time.perf_counter()
+            batched = matcher.match(queries)
+            batched_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+            for results in (legacy, single, batched):
+                if [student_id for student_id, _ in results] != expected.tolist():
+                    self.stdout.write(self.style.ERROR(f'Mismatched results at {size} encodings.'))
+
+            self.stdout.write(
+                f"{size:>10} {size // per_student:>9} {legacy_ms:>12.3f} {single_ms:>13.3f} "
+                f"{batched_ms:>13.3f} {legacy_ms / single_ms:>7.1f}x"
+            )
@@ -0,0 +1,235 @@
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.gallery import Gallery
+from attendance.index import BACKENDS, create_index
+from attendance.metrics import FrameSpans
+
+# Version of the report layout; bump it when keys change so old baselines are not compared blindly.
+REPORT_FORMAT = 1
+STAGES = ('imdecode', 'detect', 'landmarks', 'descriptor', 'match', 'total')
+# The latency --compare checks for every stage, next to frames per second.
+COMPARED_PERCENTILE = 'p95_ms'
+
+
+def random_unit_encodings(rng, count):
+    encodings = rng.standard_normal((count, 128)).astype(np.float32)
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    return encodings
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far (ru_maxrss is in KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def stage_summary(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        'count': len(samples),
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Replays a directory of JPEG frames through the decode/detect/embed/match path process_frame uses, '
+        'against a synthetic gallery of random unit descriptors plus the real descriptors of the frames, and '
+        'reports per-stage p50/p95/p99, frames per second and peak memory as JSON. Without the dlib models '
+        'only the match stage is measured, on synthetic queries. Nothing is written to the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('frames_dir', nargs='?', help='Directory of .jpg/.jpeg frames, one face each.')
+        parser.add_argument('--gallery-size', type=int, default=10000, help='Synthetic encodings in the gallery.')
+        parser.add_argument('--per-student', type=int, default=5, help='Synthetic encodings per student.')
+        parser.add_argument('--index', choices=list(BACKENDS), help='Gallery index backend (default: FACE_INDEX_BACKEND).')
+        parser.add_argument('--repeat', type=int, default=3, help='Passes over the frames (or synthetic queries).')
+        parser.add_argument('--warmup', type=int, default=2, help='Frames processed before timing starts.')
+        parser.add_argument('--queries', type=int, default=200, help='Synthetic queries per pass without the models.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the report to this file.')
+        parser.add_argument('--compare', help='A previous report; fail if a stage p95 or the frame rate regressed.')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Allowed relative regression for --compare (0.2 = 20%%).')
+
+    def handle(self, *args, **options):
+        from attendance import recognition
+
+        rng = np.random.default_rng(options['seed'])
+        models_available = recognition.warm_up()
+        frames = self.load_frames(options['frames_dir']) if options['frames_dir'] else []
+        if frames and not models_available:
+            self.stderr.write('The dlib models are not available; measuring the match stage on synthetic queries only.')
+
+        rss_before = peak_rss_mb()
+        matrix, student_ids = self.synthetic_gallery(rng, options['gallery_size'], options['per_student'])
+        real = {}
+        if frames and models_available:
+            real = self.real_encodings(recognition, frames)
+            if not real:
+                raise CommandError('No frame in the directory holds exactly one detectable face.')
+            # Each described frame becomes its own identity, after the synthetic students.
+            first_real_id = int(student_ids[-1]) + 1 if len(student_ids) else 0
+            real_ids = {name: first_real_id + i for i, name in enumerate(real)}
+            matrix = np.concatenate([matrix, np.stack(list(real.values()))])
+            student_ids = np.concatenate([student_ids, np.fromiter(real_ids.values(), dtype=np.int64)])
+        index = create_index(options['index'])
+        gallery = Gallery(matrix, student_ids, index=index.build(matrix, student_ids))
+
+        if real:
+            samples, matched, elapsed = self.replay(recognition, gallery, frames, real_ids, options)
+            mode = 'frames'
+        else:
+            samples, matched, elapsed = self.replay_synthetic(rng, gallery, matrix, student_ids, options)
+            mode = 'synthetic'
+
+        timed = len(samples['total'])
+        report = {
+            'format': REPORT_FORMAT,
+            'mode': mode,
+            'commit': git_commit(),
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'cpu_count': os.cpu_count(),
+            },
+            'gallery': {
+                'backend': index.backend,
+                'synthetic_encodings': options['gallery_size'],
+                'real_encodings': len(real),
+                'encodings': len(gallery),
+                'bytes': gallery.nbytes,
+            },
+            'frames': len(frames) if real else 0,
+            'timed': timed,
+            'matched': matched,
+            'frames_per_second': round(timed / elapsed, 2) if elapsed > 0 else None,
+            'stages': {stage: stage_summary(values) for stage, values in samples.items() if values},
+            'memory': {'rss_before_mb': rss_before, 'peak_rss_mb': peak_rss_mb()},
+        }
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        if options['compare']:
+            self.compare(report, options['compare'], options['max_regression'])
+
+    def load_frames(self, frames_dir):
+        if not os.path.isdir(frames_dir):
+            raise CommandError(f'{frames_dir} is not a directory.')
+        names = sorted(name for name in os.listdir(frames_dir) if name.lower().endswith(('.jpg', '.jpeg')))
+        if not names:
+            raise CommandError(f'No .jpg or .jpeg files in {frames_dir}.')
+        frames = []
+        for name in names:
+            with open(os.path.join(frames_dir, name), 'rb') as f:
+                frames.append((name, f.read()))
+        return frames
+
+    def synthetic_gallery(self, rng, size, per_student):
+        matrix = random_unit_encodings(rng, size)
+        return matrix, np.arange(size, dtype=np.int64) // max(per_student, 1)
+
+    def real_encodings(self, recognition, frames):
+        """Describes every frame once; frames without exactly one face are left out of the gallery."""
+        real = {}
+        for name, image_bytes in frames:
+            analysis = recognition.analyze_frame(image_bytes)
+            if len(analysis.encodings) == 1:
+                real[name] = analysis.encodings[0]
+            else:
+                self.stderr.write(f'Skipping {name}: {analysis.error or f"{len(analysis.faces)} faces"}.')
+        return real
+
+    def replay(self, recognition, gallery, frames, real_ids, options):
+        """Runs the frames through analyze_frame and Gallery.match, as recognise_frame does, timing each stage."""
+        frames = [(name, image_bytes) for name, image_bytes in frames if name in real_ids]
+        for name, image_bytes in frames[:options['warmup']]:
+            gallery.match(recognition.analyze_frame(image_bytes).encodings[0])
+
+        samples = {stage: [] for stage in STAGES}
+        matched = 0
+        started = time.perf_counter()
+        for _ in range(options['repeat']):
+            for name, image_bytes in frames:
+                frame_started = time.perf_counter()
+                spans = FrameSpans()
+                analysis = recognition.analyze_frame(image_bytes)
+                spans.update(analysis.timings)
+                student_id = None
+                if len(analysis.encodings) == 1:
+                    with spans.time('match'):
+                        student_id, _ = gallery.match(analysis.encodings[0])
+                matched += int(student_id == real_ids[name])
+                for stage, seconds in spans.stages.items():
+                    samples[stage].append(seconds * 1000)
+                samples['total'].append((time.perf_counter() - frame_started) * 1000)
+        return samples, matched, time.perf_counter() - started
+
+    def replay_synthetic(self, rng, gallery, matrix, student_ids, options):
+        """Times Gallery.match alone on noisy copies of stored rows, for machines without the dlib models."""
+        picks = rng.integers(0, len(matrix), options['queries'])
+        queries = matrix[picks] + 0.01 * random_unit_encodings(rng, len(picks))
+        for query in queries[:options['warmup']]:
+            gallery.match(query)
+
+        samples = {stage: [] for stage in STAGES}
+        matched = 0
+        started = time.perf_counter()
+        for _ in range(options['repeat']):
+            for query, expected in zip(queries, student_ids[picks]):
+                match_started = time.perf_counter()
+                student_id, _ = gallery.match(query)
+                elapsed_ms = (time.perf_counter() - match_started) * 1000
+                samples['match'].append(elapsed_ms)
+                samples['total'].append(elapsed_ms)
+                matched += int(student_id == expected)
+        return samples, matched, time.perf_counter() - started
+
+    def compare(self, report, baseline_path, max_regression):
+        """Fails if any stage's p95 or the frame rate is more than `max_regression` worse than the baseline."""
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline.get('format') != report['format'] or baseline.get('mode') != report['mode']:
+            raise CommandError(f'{baseline_path} was produced with a different report format or mode.')
+        if baseline.get('gallery') != report['gallery']:
+            raise CommandError(f'{baseline_path} used a different gallery: {baseline.get("gallery")}.')
+
+        regressions = []
+        for stage, summary in report['stages'].items():
+            before = baseline['stages'].get(stage, {}).get(COMPARED_PERCENTILE)
+            after = summary[COMPARED_PERCENTILE]
+            if before and after > before * (1 + max_regression):
+                regressions.append(f'{stage} {COMPARED_PERCENTILE}: {before} -> {after}')
+        before_fps, after_fps = baseline.get('frames_per_second'), report['frames_per_second']
+        if before_fps and after_fps is not None and after_fps < before_fps * (1 - max_regression):
+            regressions.append(f'frames_per_second: {before_fps} -> {after_fps}')
+
+        if regressions:
+            raise CommandError('Regressed against ' + baseline_path + ':\n  ' + '\n  '.join(regressions))
+        self.stderr.write(self.style.SUCCESS(f'No regression beyond {max_regression:.0%} against {baseline_path}.'))
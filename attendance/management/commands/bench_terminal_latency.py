@@ -0,0 +1,109 @@
+import json
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from attendance.models import AttendanceSession
+
+
+def summarise(name, latencies_ms):
+    latencies = np.asarray(latencies_ms)
+    return {
+        'path': name,
+        'frames': len(latencies),
+        'mean_ms': round(float(latencies.mean()), 2),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures in-process round-trip latency of the terminal frame paths: the HTTP endpoints '
+        'versus the WebSocket channel. Frames are really processed, so attendance is marked on the session.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('session_id', type=int, help='An open AttendanceSession to send frames to.')
+        parser.add_argument('image', help='Path to a JPEG frame to send repeatedly.')
+        parser.add_argument('--frames', type=int, default=20, help='Frames to send over each path.')
+        parser.add_argument('--face-box', help='Optional "left,top,right,bottom" hint sent with every frame, '
+                                               'so detection is cheap and transport overhead stands out.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        session = AttendanceSession.objects.select_related('course__lecturer').filter(id=options['session_id']).first()
+        if session is None or not session.is_active:
+            raise CommandError(f"No open session with id {options['session_id']}.")
+        with open(options['image'], 'rb') as f:
+            image_bytes = f.read()
+
+        client = Client()
+        client.force_login(session.course.lecturer)
+        frames = options['frames']
+        frame_options = {'face_box': options['face_box']} if options['face_box'] else {}
+
+        results = [
+            summarise('http process-frame', self.http_latencies(client, 'process_frame_api', session.id, image_bytes, frame_options, frames)),
+            summarise('http process-frame-async', self.http_latencies(client, 'process_frame_async_api', session.id, image_bytes, frame_options, frames)),
+            summarise('websocket', async_to_sync(self.websocket_latencies)(client, session.id, image_bytes, frame_options, frames)),
+        ]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'path':<26} {'frames':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for row in results:
+            self.stdout.write(f"{row['path']:<26} {row['frames']:>6} {row['mean_ms']:>9.2f} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f}")
+
+    def http_latencies(self, client, url_name, session_id, image_bytes, frame_options, frames):
+        url = reverse(url_name, args=[session_id])
+        latencies = []
+        for _ in range(frames):
+            query = urlencode({**frame_options, 'captured_at': int(time.time() * 1000)})
+            start = time.perf_counter()
+            response = client.post(f'{url}?{query}', image_bytes, content_type='image/jpeg')
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 500:
+                raise CommandError(f'{url} failed: {response.content[:200]!r}')
+        return latencies
+
+    async def websocket_latencies(self, client, session_id, image_bytes, frame_options, frames):
+        from core.asgi import application
+
+        cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        scope = {
+            'type': 'websocket',
+            'path': f'/ws/terminal/{session_id}/',
+            'query_string': b'',
+            'headers': [(b'cookie', cookie.encode())],
+            'subprotocols': [],
+        }
+        communicator = ApplicationCommunicator(application, scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        accepted = await communicator.receive_output(timeout=30)
+        if accepted['type'] != 'websocket.accept':
+            raise CommandError(f'WebSocket handshake refused: {accepted}')
+        await communicator.receive_output(timeout=30)  # ready event
+
+        latencies = []
+        for seq in range(frames):
+            header = json.dumps({**frame_options, 'seq': seq, 'captured_at': int(time.time() * 1000)}).encode()
+            message = len(header).to_bytes(4, 'big') + header + image_bytes
+            start = time.perf_counter()
+            await communicator.send_input({'type': 'websocket.receive', 'bytes': message})
+            result = json.loads((await communicator.receive_output(timeout=30))['text'])
+            latencies.append((time.perf_counter() - start) * 1000)
+            if result.get('code', 200) >= 500:
+                raise CommandError(f'WebSocket frame failed: {result}')
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=30)
+        return latencies
@@ -0,0 +1,120 @@
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+WORKER_READY = re.compile(r'Worker (\d+) ready')
+
+
+def memory_kb(pid):
+    """Reads RSS, PSS and USS (private clean + private dirty) of a process from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss_kb': fields.get('Rss', 0),
+        'pss_kb': fields.get('Pss', 0),
+        'uss_kb': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Starts gunicorn with gunicorn.conf.py with preload on and then off, waits until every worker has '
+        'loaded the face models and galleries, and reports per-worker unique (USS) and proportional (PSS) memory. '
+        'Linux only.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Gunicorn workers per run.')
+        parser.add_argument('--timeout', type=float, default=300, help='Seconds to wait for the workers to be ready.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/smaps_rollup'):
+            raise CommandError('This benchmark reads /proc/<pid>/smaps_rollup and only runs on Linux.')
+
+        results = [self.measure(preload, options['workers'], options['timeout']) for preload in (True, False)]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'preload':>8} {'workers':>8} {'worker USS MB':>14} {'worker RSS MB':>14} "
+                          f"{'master USS MB':>14} {'total PSS MB':>13}")
+        for row in results:
+            self.stdout.write(
+                f"{str(row['preload']):>8} {row['workers']:>8} {row['mean_worker_uss_kb'] / 1024:>14.1f} "
+                f"{row['mean_worker_rss_kb'] / 1024:>14.1f} {row['master']['uss_kb'] / 1024:>14.1f} "
+                f"{row['total_pss_kb'] / 1024:>13.1f}"
+            )
+
+    def measure(self, preload, workers, timeout):
+        """Runs one gunicorn instance and measures its master and workers once they are all ready."""
+        env = {
+            **os.environ,
+            'GUNICORN_PRELOAD': str(preload),
+            'GUNICORN_WORKERS': str(workers),
+            'GUNICORN_BIND': f'127.0.0.1:{free_port()}',
+            'GUNICORN_ACCESSLOG': '',
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings'),
+        }
+        config = os.path.join(settings.BASE_DIR, 'gunicorn.conf.py')
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', config],
+            cwd=settings.BASE_DIR, env=env, stderr=subprocess.PIPE, text=True,
+        )
+        ready = set()
+        log_tail = []
+        done_waiting = threading.Event()
+
+        def read_log():
+            for line in process.stderr:
+                log_tail[:] = log_tail[-19:] + [line]
+                match = WORKER_READY.search(line)
+                if match:
+                    ready.add(int(match.group(1)))
+                    if len(ready) >= workers:
+                        done_waiting.set()
+            done_waiting.set()  # gunicorn exited
+
+        threading.Thread(target=read_log, daemon=True).start()
+        try:
+            done_waiting.wait(timeout)
+            if len(ready) < workers:
+                raise CommandError(
+                    f'Only {len(ready)} of {workers} gunicorn workers became ready (preload={preload}). '
+                    f'Last log lines:\n{"".join(log_tail)}'
+                )
+            time.sleep(1)  # Let the workers settle into their request loops.
+            master = memory_kb(process.pid)
+            worker_memory = [memory_kb(pid) for pid in sorted(ready)]
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=30)
+
+        return {
+            'preload': preload,
+            'workers': workers,
+            'master': master,
+            'worker_memory': worker_memory,
+            'mean_worker_uss_kb': sum(m['uss_kb'] for m in worker_memory) // workers,
+            'mean_worker_rss_kb': sum(m['rss_kb'] for m in worker_memory) // workers,
+            'total_pss_kb': master['pss_kb'] + sum(m['pss_kb'] for m in worker_memory),
+        }
@@ -0,0 +1,50 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.gallery import latest_version, load_rows
+from attendance.index import create_index
+from attendance.models import Student
+
+
+class Command(BaseCommand):
+    help = 'Builds the face search index from the database and saves it to disk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.FACE_INDEX_PATH,
+                            help='Where to write the index. Defaults to settings.FACE_INDEX_PATH.')
+        parser.add_argument('--backend', default=None,
+                            help='Index backend. Defaults to settings.FACE_INDEX_BACKEND.')
+        parser.add_argument('--n-lists', type=int, default=None, help='IVF partitions (ivf backend only).')
+        parser.add_argument('--n-probe', type=int, default=None, help='IVF partitions scanned per query (ivf backend only).')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        if not output:
+            raise CommandError('Pass --output or set FACE_INDEX_PATH.')
+
+        index_options = {key: options[key] for key in ('n_lists', 'n_probe') if options[key] is not None}
+        try:
+            index = create_index(options['backend'], **index_options)
+        except (ValueError, TypeError) as e:
+            raise CommandError(str(e))
+
+        version = latest_version()
+        matrix, student_ids = load_rows(Student.objects.all())
+
+        start = time.perf_counter()
+        index.build(matrix, student_ids)
+        index.version = version
+        build_seconds = time.perf_counter() - start
+
+        # Write beside the target and rename so running workers never read a half-written file.
+        temp_path = f'{output}.tmp'
+        index.save(temp_path)
+        os.replace(temp_path, output)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Saved {index.backend} index of {len(index)} encodings at version {version} to {output} '
+            f'(built in {build_seconds:.2f}s).'
+        ))
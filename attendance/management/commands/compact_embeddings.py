@@ -0,0 +1,105 @@
+import json
+from itertools import groupby
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from attendance.compaction import METHODS, compact_encodings, evaluate_compaction
+from attendance.models import FACE_MODEL_VERSION, FaceEmbedding, GalleryChange
+
+
+class Command(BaseCommand):
+    help = (
+        "Prunes outlier descriptors and keeps FACE_COMPACTION_K representatives for every registered "
+        "student, optionally evaluating recognition on the stored descriptors first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, nargs='+', help='Only compact these student ids.')
+        parser.add_argument('--k', type=int, help='Representatives per student (default: FACE_COMPACTION_K).')
+        parser.add_argument('--method', choices=METHODS, help='Default: FACE_COMPACTION_METHOD.')
+        parser.add_argument('--outlier-distance', type=float, help='Default: FACE_COMPACTION_OUTLIER_DISTANCE.')
+        parser.add_argument('--evaluate', action='store_true',
+                            help='Compare recognition with the full and compacted descriptors before compacting.')
+        parser.add_argument('--report', help='Write the evaluation and compaction summary to this JSON file.')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing.')
+        parser.add_argument('--batch-size', type=int, default=200, help='Students rewritten per transaction.')
+
+    def handle(self, *args, **options):
+        compaction_options = {
+            'k': options['k'],
+            'method': options['method'],
+            'outlier_distance': options['outlier_distance'],
+        }
+        students = self.load_students(options['students'])
+        if not students:
+            raise CommandError('No students with stored face embeddings.')
+
+        summary = {'options': compaction_options, 'dry_run': options['dry_run']}
+        if options['evaluate']:
+            summary['evaluation'] = evaluate_compaction(
+                {student_id: rows['encodings'] for student_id, rows in students.items()}, **compaction_options
+            )
+            self.stdout.write(json.dumps(summary['evaluation'], indent=2))
+
+        compacted = {}
+        for student_id, rows in students.items():
+            encodings, qualities = compact_encodings(rows['encodings'], rows['qualities'], **compaction_options)
+            if len(encodings) < len(rows['ids']):
+                compacted[student_id] = (encodings, qualities)
+
+        rows_before = sum(len(rows['ids']) for rows in students.values())
+        rows_after = sum(
+            len(compacted[student_id][0]) if student_id in compacted else len(rows['ids'])
+            for student_id, rows in students.items()
+        )
+        summary['compaction'] = {
+            'students': len(students),
+            'students_compacted': len(compacted),
+            'rows_before': rows_before,
+            'rows_after': rows_after,
+            'bytes_before': rows_before * 128 * 4,
+            'bytes_after': rows_after * 128 * 4,
+        }
+        if not options['dry_run']:
+            self.rewrite(students, compacted, options['batch_size'])
+
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump(summary, f, indent=2)
+        verb = 'Would compact' if options['dry_run'] else 'Compacted'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {len(compacted)} of {len(students)} students: {rows_before} -> {rows_after} embeddings."
+        ))
+
+    def load_students(self, student_ids):
+        """Reads the current-model embeddings, grouped as {student_id: {'ids', 'encodings', 'qualities'}}."""
+        embeddings = FaceEmbedding.objects.filter(model_version=FACE_MODEL_VERSION)
+        if student_ids:
+            embeddings = embeddings.filter(student_id__in=student_ids)
+        rows = embeddings.order_by('student_id', 'id').values_list('student_id', 'id', 'vector', 'quality').iterator()
+
+        students = {}
+        for student_id, group in groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            students[student_id] = {
+                'ids': [row[1] for row in group],
+                'encodings': np.frombuffer(b''.join(row[2] for row in group), dtype='<f4').reshape(len(group), 128),
+                'qualities': [row[3] for row in group],
+            }
+        return students
+
+    def rewrite(self, students, compacted, batch_size):
+        """Replaces each compacted student's embeddings; bulk writes send no signals, so the gallery log is written here."""
+        student_ids = list(compacted)
+        for start in range(0, len(student_ids), batch_size):
+            batch = student_ids[start:start + batch_size]
+            with transaction.atomic():
+                FaceEmbedding.objects.filter(id__in=[row_id for student_id in batch for row_id in students[student_id]['ids']]).delete()
+                FaceEmbedding.objects.bulk_create([
+                    FaceEmbedding(student_id=student_id, vector=FaceEmbedding.pack(encoding), quality=quality)
+                    for student_id in batch
+                    for encoding, quality in zip(*compacted[student_id])
+                ])
+                GalleryChange.log(batch)
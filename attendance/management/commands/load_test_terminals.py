@@ -0,0 +1,323 @@
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import quote
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.urls import reverse
+
+from attendance.models import AttendanceSession, Course, FaceEmbedding, Student
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def database_url(db_settings):
+    """A DATABASE_URL for dj_database_url pointing at `db_settings`, so a server subprocess uses the scratch database."""
+    engine = db_settings['ENGINE']
+    if engine.endswith('sqlite3'):
+        return f"sqlite:///{db_settings['NAME']}"
+    if 'postgresql' in engine:
+        credentials = quote(db_settings.get('USER') or '')
+        if db_settings.get('PASSWORD'):
+            credentials += ':' + quote(db_settings['PASSWORD'])
+        host = db_settings.get('HOST') or 'localhost'
+        port = f":{db_settings['PORT']}" if db_settings.get('PORT') else ''
+        return f"postgres://{credentials}@{host}{port}/{db_settings['NAME']}"
+    raise CommandError(f'--target server does not support the {engine} database backend.')
+
+
+def summarise(level, latencies_ms, statuses, elapsed, terminals, fps):
+    latencies = np.asarray(latencies_ms) if latencies_ms else np.zeros(1)
+    requests = len(latencies_ms)
+    return {
+        'terminals': terminals,
+        'target_fps_per_terminal': fps,
+        'requests': requests,
+        'throughput_rps': round(requests / elapsed, 2),
+        'achieved_fps_per_terminal': round(requests / elapsed / terminals, 2),
+        'mean_ms': round(float(latencies.mean()), 1),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 1),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 1),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 1),
+        'statuses': dict(sorted(statuses.items())),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests the terminal API: creates lecturers, courses, enrolled students and active sessions in a '
+        'scratch database, then drives process_frame from simulated terminals at increasing concurrency and '
+        'reports latency and throughput per level. Uses the fake face models (see attendance/fake_models.py) '
+        'unless --model dlib is given with a directory of real face frames; the fake models need DEBUG on, '
+        'which the command turns on in its own environment and in the server it starts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                            help='Simultaneous terminals at each level.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds each level runs.')
+        parser.add_argument('--fps', type=float, default=2, help='Frames per second each terminal tries to send.')
+        parser.add_argument('--students', type=int, default=40, help='Students enrolled in each course.')
+        parser.add_argument('--lecturers', type=int, default=4, help='Lecturers the courses are spread over.')
+        parser.add_argument('--target', choices=['client', 'server'], default='client',
+                            help='Drive an in-process test client, or a gunicorn server started on the scratch database.')
+        parser.add_argument('--server-workers', type=int, default=2, help='Gunicorn workers for --target server.')
+        parser.add_argument('--model', choices=['fake', 'dlib'], default='fake', help='Face models to recognise with.')
+        parser.add_argument('--model-cost-ms', type=float, default=50,
+                            help='CPU time the fake models spend per frame, standing in for dlib.')
+        parser.add_argument('--frames-dir', help='With --model dlib: one real face frame per student.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the results as JSON to this file.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        from attendance import recognition
+
+        if options['model'] == 'fake':
+            os.environ['FACE_MODEL_BACKEND'] = 'fake'
+            os.environ['DEBUG'] = 'True'  # get_models() refuses the fake models otherwise.
+            os.environ['FACE_FAKE_MODEL_COST_MS'] = str(options['model_cost_ms'])
+        elif not options['frames_dir']:
+            raise CommandError('--model dlib needs --frames-dir with one real face frame per student.')
+        if recognition._models is not None and options['model'] == 'fake':
+            raise CommandError('The dlib models were loaded before the command started; unset FACE_MODELS_WARM_UP.')
+        if not recognition.warm_up():
+            raise CommandError('The face models could not be loaded.')
+
+        random.seed(options['seed'])
+        scratch_dir = tempfile.mkdtemp(prefix='attendance-load-test-')
+        if connection.vendor == 'sqlite':
+            # A file rather than the in-memory default, so a server subprocess can open it too.
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(scratch_dir, 'load_test.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        server = None
+        try:
+            identities = self.identities(recognition, options)
+            courses = self.populate(identities, options)
+            host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h not in ('*', '')), 'localhost')
+            if options['target'] == 'server':
+                server, port = self.start_server(options)
+                send = self.server_sender(host, port)
+            else:
+                send = self.client_sender(host)
+
+            results = []
+            for level in options['concurrency']:
+                self.stderr.write(f"Running {level} terminal(s) for {options['duration']:.0f} s...")
+                results.append(self.run_level(level, courses, identities, send, options))
+        finally:
+            if server is not None:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=30)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+        report = {
+            'target': options['target'],
+            'model': options['model'],
+            'model_cost_ms': options['model_cost_ms'] if options['model'] == 'fake' else None,
+            'database': connection.vendor,
+            'levels': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{'terminals':>9} {'req/s':>8} {'fps/term':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+        for row in results:
+            self.stdout.write(
+                f"{row['terminals']:>9} {row['throughput_rps']:>8.1f} {row['achieved_fps_per_terminal']:>9.2f} "
+                f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f}  {row['statuses']}"
+            )
+
+    def identities(self, recognition, options):
+        """Returns one (frame bytes, descriptor) pair per student to enroll."""
+        if options['model'] == 'fake':
+            from attendance.fake_models import fake_descriptor, fake_frame
+
+            return [(fake_frame(i), fake_descriptor(i)) for i in range(options['students'])]
+
+        identities = []
+        for name in sorted(os.listdir(options['frames_dir'])):
+            if not name.lower().endswith(('.jpg', '.jpeg')):
+                continue
+            with open(os.path.join(options['frames_dir'], name), 'rb') as f:
+                image_bytes = f.read()
+            analysis = recognition.analyze_frame(image_bytes)
+            if len(analysis.encodings) == 1:
+                identities.append((image_bytes, analysis.encodings[0]))
+        if not identities:
+            raise CommandError(f"No frame in {options['frames_dir']} holds exactly one detectable face.")
+        return identities[:options['students']]
+
+    def populate(self, identities, options):
+        """
+        Creates the lecturers, and one course per terminal of the largest level with every
+        identity enrolled as a student. Returns the courses.
+        """
+        lecturers = [
+            User.objects.create_user(username=f'load-lecturer-{i}', password=None, is_staff=True)
+            for i in range(options['lecturers'])
+        ]
+        students = []
+        for i, (_, encoding) in enumerate(identities):
+            user = User.objects.create_user(username=f'load-student-{i}', password=None, first_name='Student', last_name=str(i))
+            student = Student.objects.create(user=user, matric_number=f'LOAD/{i}')
+            FaceEmbedding.objects.create(student=student, vector=FaceEmbedding.pack(encoding))
+            students.append(student)
+
+        courses = []
+        for i in range(max(options['concurrency'])):
+            course = Course.objects.create(
+                course_code=f'LOAD{i}', course_name=f'Load test course {i}', lecturer=lecturers[i % len(lecturers)],
+            )
+            course.enrolled_students.add(*students)
+            courses.append(course)
+        return courses
+
+    def client_sender(self, host):
+        """Sends frames through Django's test client in this process; one client per lecturer."""
+        clients = {}
+        lock = threading.Lock()
+
+        def send(session, image_bytes, terminal_id):
+            with lock:
+                client = clients.get(session.course.lecturer_id)
+                if client is None:
+                    client = clients[session.course.lecturer_id] = Client(HTTP_HOST=host)
+                    client.force_login(session.course.lecturer)
+            url = reverse('process_frame_api', args=[session.id]) + f'?terminal_id={terminal_id}'
+            response = client.post(url, image_bytes, content_type='image/jpeg')
+            close_old_connections()
+            try:
+                return json.loads(response.content).get('status') or str(response.status_code)
+            except ValueError:
+                return str(response.status_code)
+        return send
+
+    def server_sender(self, host, port):
+        """Sends frames over HTTP to the local server, with a keep-alive connection per terminal thread."""
+        cookies = {}
+        lock = threading.Lock()
+        local = threading.local()
+
+        def session_cookie(lecturer):
+            with lock:
+                if lecturer.id not in cookies:
+                    client = Client()
+                    client.force_login(lecturer)  # Stores the session in the scratch database the server reads.
+                    cookies[lecturer.id] = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+                return cookies[lecturer.id]
+
+        def send(session, image_bytes, terminal_id):
+            if getattr(local, 'connection', None) is None:
+                local.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            url = reverse('process_frame_api', args=[session.id]) + f'?terminal_id={terminal_id}'
+            headers = {'Host': host, 'Content-Type': 'image/jpeg', 'Cookie': session_cookie(session.course.lecturer)}
+            try:
+                local.connection.request('POST', url, body=image_bytes, headers=headers)
+                response = local.connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                local.connection.close()
+                local.connection = None
+                return 'connection_error'
+            try:
+                return json.loads(body).get('status') or str(response.status)
+            except ValueError:
+                return str(response.status)
+        return send
+
+    def start_server(self, options):
+        """Starts gunicorn with gunicorn.conf.py on the scratch database and waits until it answers."""
+        port = free_port()
+        env = {
+            **os.environ,
+            'DATABASE_URL': database_url(connection.settings_dict),
+            'GUNICORN_BIND': f'127.0.0.1:{port}',
+            'GUNICORN_WORKERS': str(options['server_workers']),
+            'GUNICORN_ACCESSLOG': '',
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings'),
+        }
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', os.path.join(settings.BASE_DIR, 'gunicorn.conf.py')],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'gunicorn exited with status {server.returncode}.')
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=1):
+                    return server, port
+            except OSError:
+                time.sleep(0.5)
+        server.kill()
+        raise CommandError('gunicorn did not start listening within 120 s.')
+
+    def run_level(self, terminals, courses, identities, send, options):
+        """Runs `terminals` simulated terminals, each on its own course's fresh session, for the level's duration."""
+        sessions = [
+            AttendanceSession.objects.select_related('course__lecturer').get(
+                id=AttendanceSession.objects.create(course=course).id,
+            )
+            for course in courses[:terminals]
+        ]
+        interval = 1 / options['fps']
+        latencies = []
+        statuses = {}
+        lock = threading.Lock()
+        stop_at = time.monotonic() + options['duration']
+
+        def terminal(session):
+            # A student stands at the terminal for a few frames, then the next one steps up. Each
+            # student gets a fresh terminal id, so the face tracker never carries one student's
+            # identity over to the next and every student's first frame is really recognised.
+            frames_left, image_bytes, terminal_id = 0, None, None
+            next_frame_at = time.monotonic()
+            while time.monotonic() < stop_at:
+                if frames_left == 0:
+                    image_bytes = random.choice(identities)[0]
+                    frames_left = random.randint(2, 6)
+                    terminal_id = uuid.uuid4().hex
+                frames_left -= 1
+                started = time.perf_counter()
+                status = send(session, image_bytes, terminal_id)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed_ms)
+                    statuses[status] = statuses.get(status, 0) + 1
+                next_frame_at += interval
+                time.sleep(max(next_frame_at - time.monotonic(), 0))
+                next_frame_at = max(next_frame_at, time.monotonic())
+
+        threads = [threading.Thread(target=terminal, args=(session,)) for session in sessions]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        AttendanceSession.objects.filter(id__in=[session.id for session in sessions]).update(is_active=False)
+        return summarise(terminals, latencies, statuses, elapsed, terminals, options['fps'])
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from attendance.gallery import prune_changes
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes old entries from the face gallery change log. Workers still holding a gallery older '
+        'than the entries left rebuild it on their next refresh, so this only costs them a reload.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help='Keep the entries logged in the last this many days.')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days cannot be negative.')
+        deleted = prune_changes(timezone.now() - timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} gallery change log entries.'))
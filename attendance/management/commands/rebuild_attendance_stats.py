@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from attendance.models import CourseStats, LecturerStats, StudentMonthlyAttendance
+from attendance.stats import rebuild
+
+
+def monthly_rows():
+    return set(StudentMonthlyAttendance.objects.values_list(
+        'student_id', 'course_id', 'year', 'month', 'record_count', 'on_time_count', 'late_count', 'attended_days'))
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the course and lecturer attendance counters shown on the lecturer dashboard, and the '
+        'monthly summaries shown on the student dashboard, from the sessions and records, in one transaction. Run it after changing attendance rows outside the ORM '
+        'or moving a course to another lecturer.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Report the courses, lecturers and students whose counters are wrong without changing them.')
+
+    def handle(self, *args, **options):
+        before_courses = {row[0]: row[1:] for row in CourseStats.objects.values_list(
+            'course_id', 'session_count', 'record_count', 'student_count')}
+        before_lecturers = dict(LecturerStats.objects.values_list('lecturer_id', 'student_count'))
+        before_months = monthly_rows()
+
+        with transaction.atomic():
+            start = time.perf_counter()
+            courses, lecturers, months = rebuild()
+            elapsed = time.perf_counter() - start
+
+            drifted_courses = [
+                course_id for course_id, *counts in CourseStats.objects.values_list(
+                    'course_id', 'session_count', 'record_count', 'student_count')
+                if before_courses.get(course_id, (0, 0, 0)) != tuple(counts)
+            ]
+            drifted_lecturers = [
+                lecturer_id for lecturer_id, student_count in LecturerStats.objects.values_list('lecturer_id', 'student_count')
+                if before_lecturers.get(lecturer_id, 0) != student_count
+            ]
+            after_months = monthly_rows()
+            drifted_students = sorted({row[0] for row in before_months ^ after_months})
+            if options['check']:
+                transaction.set_rollback(True)
+
+        if options['check']:
+            for course_id in drifted_courses:
+                self.stdout.write(f'Course {course_id}: sessions, records, students {before_courses.get(course_id)} are wrong.')
+            for lecturer_id in drifted_lecturers:
+                self.stdout.write(f'Lecturer {lecturer_id}: {before_lecturers.get(lecturer_id)} students is wrong.')
+            for student_id in drifted_students:
+                self.stdout.write(f'Student {student_id}: monthly summaries are wrong.')
+            self.stdout.write(
+                f'{len(drifted_courses)} courses, {len(drifted_lecturers)} lecturers and '
+                f'{len(drifted_students)} students have drifted.'
+            )
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the counters of {courses} courses and {lecturers} lecturers, and {months} monthly summaries, '
+            f'in {elapsed:.2f} s; {len(drifted_courses)} courses, {len(drifted_lecturers)} lecturers and '
+            f'{len(drifted_students)} students had drifted.'
+        ))
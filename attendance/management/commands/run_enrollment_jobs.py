@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from attendance.enrollment import claim_next_job, requeue_stale_jobs, run_job
+from attendance.models import EnrollmentJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Processes queued student registrations (EnrollmentJob rows) when ENROLLMENT_BACKGROUND_JOBS is on. '
+        'Several runners can share the queue; face samples are prepared on the configured inference pool.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when no job is ready instead of waiting for more.')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--max-jobs', type=int, default=0, help='Exit after this many jobs (0 for no limit).')
+
+    def handle(self, *args, **options):
+        processed = 0
+        try:
+            while not options['max_jobs'] or processed < options['max_jobs']:
+                close_old_connections()
+                recovered = requeue_stale_jobs()
+                if recovered:
+                    self.stdout.write(self.style.WARNING(f'Recovered {recovered} stale job(s).'))
+
+                job = claim_next_job()
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                run_job(job)
+                processed += 1
+                line = f'Job {job.job_id} ({job.email}): {job.status} after {job.attempts} attempt(s).'
+                if job.status == EnrollmentJob.SUCCEEDED:
+                    self.stdout.write(self.style.SUCCESS(line))
+                else:
+                    self.stdout.write(self.style.WARNING(f'{line} {job.last_error}'))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'Processed {processed} job(s).')
@@ -0,0 +1,229 @@
+"""
+Marking recognised students present.
+
+Every worker keeps the set of students already marked in each session it serves,
+seeded from the database once per session (create_session seeds a new session
+as empty, with no query at all). Marking a repeat recognition of a marked student
+is then answered from memory. The frame itself still makes one query, the
+gallery's change-log check in gallery.refresh_gallery().
+
+A student not yet in the set is claimed with cache.add() on a per-session key in
+the default cache before the record is written. cache.add() is atomic, so with a
+cache shared by the workers (see CACHES in settings and checks.py) only one of two terminals
+recognising the same student at once reports a new mark. The record itself is
+inserted by stats.insert_records(), which skips records already on the register,
+so even without a shared cache a race ends in one row, not an IntegrityError.
+
+With ATTENDANCE_WRITE_BEHIND on, new records are journaled and inserted in
+batches by attendance/writebehind.py instead of inside the request.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .gallery import StudentDetails
+from .models import AttendanceRecord, Student
+from .stats import insert_records
+
+logger = logging.getLogger(__name__)
+
+# Sessions whose marked sets one worker keeps; the least recently used are dropped and re-seeded if needed.
+MAX_TRACKED_SESSIONS = 256
+
+
+def attendance_status_for(session):
+    """Returns 'on_time' within the 15-minute grace period after the session starts, otherwise 'late'."""
+    grace_period = session.start_time + timedelta(minutes=15)
+    return 'late' if timezone.now() > grace_period else 'on_time'
+
+
+def marked_key(session_id, student_id):
+    return f'attendance:marked:{session_id}:{student_id}'
+
+
+class MarkedSets:
+    """This worker's marked-student sets, by session id."""
+
+    def __init__(self, max_sessions):
+        self.max_sessions = max_sessions
+        self._sets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seed(self, session_id, student_ids=()):
+        with self._lock:
+            self._sets[session_id] = set(student_ids)
+            self._sets.move_to_end(session_id)
+            while len(self._sets) > self.max_sessions:
+                self._sets.popitem(last=False)
+
+    def get(self, session_id):
+        """Returns the marked set of a session, reading it from the database the first time."""
+        with self._lock:
+            marked = self._sets.get(session_id)
+            if marked is not None:
+                self._sets.move_to_end(session_id)
+                return marked
+        marked_ids = AttendanceRecord.objects.filter(session_id=session_id).values_list('student_id', flat=True)
+        self.seed(session_id, marked_ids)
+        return self.get(session_id)
+
+    def add(self, session_id, student_ids):
+        with self._lock:
+            self._sets.get(session_id, set()).update(student_ids)
+
+    def discard(self, session_id, student_ids):
+        with self._lock:
+            marked = self._sets.get(session_id)
+            if marked is not None:
+                marked.difference_update(student_ids)
+
+    def forget(self, session_id):
+        with self._lock:
+            self._sets.pop(session_id, None)
+
+
+_marked_sets = MarkedSets(MAX_TRACKED_SESSIONS)
+
+
+def seed_session(session):
+    """Starts tracking a session that was just opened and so has no records yet."""
+    _marked_sets.seed(session.id)
+
+
+def forget_session(session):
+    """Stops tracking a closed session in this worker."""
+    _marked_sets.forget(session.id)
+
+
+def is_marked(session_id, student_id):
+    """Whether this worker knows the student to be marked in the session."""
+    return student_id in _marked_sets.get(session_id)
+
+
+def unmark(session_id, student_ids):
+    """Forgets that students were marked, after their records have been deleted."""
+    _marked_sets.discard(session_id, student_ids)
+    try:
+        cache.delete_many([marked_key(session_id, student_id) for student_id in student_ids])
+    except Exception as e:
+        logger.warning(f"Could not release marks for session {session_id} in the cache: {e}")
+
+
+def claim(session_id, student_ids):
+    """
+    Claims students for marking across every worker sharing the cache.
+
+    Returns:
+        The ids this call claimed; the others were already claimed elsewhere. If the
+        cache is unreachable every id is returned and the insert's conflict handling
+        keeps the register correct.
+    """
+    timeout = settings.ATTENDANCE_MARKED_CACHE_TIMEOUT
+    try:
+        return [
+            student_id for student_id in student_ids
+            if cache.add(marked_key(session_id, student_id), True, timeout)
+        ]
+    except Exception as e:
+        logger.warning(f"Could not claim marks for session {session_id} in the cache: {e}")
+        return list(student_ids)
+
+
+def mark_students(session, student_ids):
+    """
+    Marks students present in `session`, skipping any that already are.
+
+    Args:
+        session (AttendanceSession): The session being marked.
+        student_ids (iterable): Recognised student ids; duplicates are ignored.
+
+    Returns:
+        A tuple (marked_ids, status): the ids newly marked by this call, in order, and
+        the attendance status they were given.
+    """
+    status = attendance_status_for(session)
+    marked = _marked_sets.get(session.id)
+    candidates = [student_id for student_id in dict.fromkeys(student_ids) if student_id not in marked]
+    if not candidates:
+        return [], status
+
+    claimed = claim(session.id, candidates)
+    records = [AttendanceRecord(session=session, student_id=student_id, status=status) for student_id in claimed]
+    try:
+        if settings.ATTENDANCE_WRITE_BEHIND:
+            from .writebehind import get_buffer
+
+            get_buffer().submit(records)
+        else:
+            insert_records(records)
+    except Exception:
+        # Release the claims so the next frame can try again.
+        unmark(session.id, claimed)
+        raise
+    _marked_sets.add(session.id, candidates)
+    return claimed, status
+
+
+def student_details(student_ids, *galleries):
+    """
+    Looks up the StudentDetails of recognised students in the galleries they were matched
+    against, falling back to the database for any the galleries do not hold.
+
+    Returns:
+        A dict of StudentDetails by student id.
+    """
+    details = {}
+    missing = []
+    for student_id in dict.fromkeys(student_ids):
+        info = next((gallery.students[student_id] for gallery in galleries if student_id in gallery.students), None)
+        if info is None:
+            missing.append(student_id)
+        else:
+            details[student_id] = info
+    if missing:
+        for student in Student.objects.select_related('user').filter(id__in=missing):
+            details[student.id] = StudentDetails(student.user.get_full_name(), student.matric_number)
+    return details
+
+
+def record_matches(session, matches, *galleries):
+    """
+    Marks every recognised student in `matches` present.
+
+    A student matched more than once (several faces or frames) is only marked the first
+    time; later matches, like students already on the register, report 'already_marked'.
+
+    Args:
+        session (AttendanceSession): The session being marked.
+        matches (list): (student_id, distance, is_walk_in) tuples from match_encodings.
+        galleries: The galleries the matches came from, used for names and matric numbers.
+
+    Returns:
+        A tuple (results, marked_ids, status): one result dict per match, the ids of the
+        students newly marked and the attendance status they were given.
+    """
+    recognised_ids = [student_id for student_id, _, _ in matches if student_id is not None]
+    details = student_details(recognised_ids, *galleries)
+    marked_ids, status = mark_students(session, [student_id for student_id in recognised_ids if student_id in details])
+
+    newly_marked = set(marked_ids)
+    results = []
+    for student_id, distance, is_walk_in in matches:
+        result = {'status': 'not_recognized'}
+        info = details.get(student_id)
+        if info is not None:
+            result.update({
+                'status': 'success' if student_id in newly_marked else 'already_marked',
+                'student_name': info.name,
+                'matric_number': info.matric_number,
+                'distance': round(distance, 4),
+                'walk_in': is_walk_in,
+            })
+            newly_marked.discard(student_id)
+        results.append(result)
+    return results, marked_ids, status
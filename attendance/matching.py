@@ -0,0 +1,113 @@
+"""
+Vectorised face matching over a single contiguous encoding matrix.
+
+Distances for a whole batch of query encodings are computed with one matrix
+product (||q - k||^2 = ||q||^2 + ||k||^2 - 2 q.k), which NumPy hands to BLAS,
+and reduced to one minimum per student with np.minimum.reduceat over the
+contiguous row segments that belong to each student.
+"""
+import numpy as np
+
+
+class FaceMatcher:
+    """
+    Exact nearest-student search.
+
+    Args:
+        matrix (array-like): Encodings of shape (N, 128), one row per stored encoding.
+        row_ids (array-like): Student id of each row, shape (N,).
+    """
+
+    def __init__(self, matrix, row_ids):
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(len(row_ids), 128)
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+
+        starts = _segment_starts(row_ids)
+        if len(starts) != len(np.unique(row_ids)):
+            # A student's rows are split across the matrix; group them so reduceat sees one segment each.
+            order = np.argsort(row_ids, kind='stable')
+            matrix, row_ids = matrix[order], row_ids[order]
+            starts = _segment_starts(row_ids)
+
+        self.matrix = np.ascontiguousarray(matrix)
+        self.row_ids = row_ids
+        self.segment_starts = starts
+        self.student_ids = row_ids[starts]
+        self.squared_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+
+    @classmethod
+    def from_dict(cls, known_encodings_data):
+        """Builds a matcher from a {student_id: [encoding, ...]} mapping."""
+        blocks = []
+        row_ids = []
+        for student_id, encodings_list in known_encodings_data.items():
+            encodings = np.asarray(encodings_list, dtype=np.float32).reshape(-1, 128)
+            blocks.append(encodings)
+            row_ids.append(np.full(len(encodings), student_id, dtype=np.int64))
+        if not blocks:
+            return cls(np.empty((0, 128), dtype=np.float32), np.empty(0, dtype=np.int64))
+        return cls(np.concatenate(blocks), np.concatenate(row_ids))
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def distances(self, queries):
+        """
+        Returns the Euclidean distance from every query to every stored row.
+
+        Args:
+            queries (array-like): A single encoding of shape (128,) or a batch of shape (Q, 128).
+
+        Returns:
+            A float32 array of shape (Q, N).
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        squared = np.einsum('ij,ij->i', queries, queries)[:, None] + self.squared_norms[None, :]
+        squared -= 2.0 * (queries @ self.matrix.T)
+        np.maximum(squared, 0.0, out=squared)
+        return np.sqrt(squared, out=squared)
+
+    def student_distances(self, queries):
+        """
+        Returns the distance from every query to the closest encoding of each student.
+
+        Returns:
+            A float32 array of shape (Q, S) whose columns follow `self.student_ids`.
+        """
+        distances = self.distances(queries)
+        return np.minimum.reduceat(distances, self.segment_starts, axis=1)
+
+    def match(self, queries, tolerance=0.5):
+        """
+        Finds the best student for each query encoding.
+
+        Returns:
+            A list with one (student_id, distance) tuple per query, or (None, None) for
+            queries with no student within `tolerance`.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if len(self) == 0:
+            return [(None, None)] * len(queries)
+
+        per_student = self.student_distances(queries)
+        best = np.argmin(per_student, axis=1)
+        best_distances = per_student[np.arange(len(queries)), best]
+
+        results = []
+        for column, distance in zip(best, best_distances):
+            if distance <= tolerance:
+                results.append((int(self.student_ids[column]), float(distance)))
+            else:
+                results.append((None, None))
+        return results
+
+    def best_match(self, encoding, tolerance=0.5):
+        """Single-query form of match(), returning one (student_id, distance) tuple."""
+        return self.match(encoding, tolerance)[0]
+
+
+def _segment_starts(row_ids):
+    """Returns the index where each run of equal ids begins."""
+    if len(row_ids) == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(np.r_[True, row_ids[1:] != row_ids[:-1]])
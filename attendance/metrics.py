@@ -0,0 +1,341 @@
+"""
+Latency metrics for the recognition pipeline, served as Prometheus text at /metrics.
+
+Every frame endpoint times the stages a frame passes through in a FrameSpans and
+records them with observe_frame() once the response is known:
+
+  request_decode  reading the upload (base64 decoding for JSON bodies)
+  queue           waiting for and talking to the inference pool
+  imdecode        cv2.imdecode and the RGB conversion
+  detect          HOG face detection
+  landmarks       shape_predictor
+  descriptor      compute_face_descriptor
+  match           the gallery search
+  mark            marking attendance (the database writes)
+
+The timings of the inference stages come back from recognition.py with the
+FrameAnalysis, so they are measured wherever the analysis ran. Histograms are
+labelled by session and by the response status ("success", "no_face",
+"already_marked", "tracking", "error", "busy", "stale"). Gauges for gallery size and bytes
+and the worker's resident memory are read when /metrics is scraped.
+
+The registry lives in each process's memory and needs no external service.
+Under gunicorn a scrape is answered by whichever worker takes it, so with
+settings.METRICS_DIR set (gunicorn.conf.py points it at a directory of its own)
+every worker also writes a snapshot of its registry to a file there, at most
+FLUSH_INTERVAL seconds old, and the worker answering a scrape merges them all.
+Histograms are summed over every worker that has run since the server started,
+so they never go backwards when a worker is replaced. Gauges keep a "worker"
+label with the pid and only cover workers whose snapshot is recent. Without
+METRICS_DIR, /metrics reports the one process answering it.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Distinct session labels kept per worker; frames of further sessions are labelled "other".
+MAX_SESSION_LABELS = 200
+# Seconds between the snapshots each worker writes to METRICS_DIR.
+FLUSH_INTERVAL = 5
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class Histogram:
+    """A Prometheus histogram with one series per combination of label values."""
+
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        """Returns every series as a [labelvalues, bucket counts, sum, count] list."""
+        with self._lock:
+            return [[list(labelvalues), list(counts), total, count] for labelvalues, (counts, total, count) in self._series.items()]
+
+    def collect(self, extra_labels, snapshots=None):
+        """Renders this process's series, or with `snapshots` the sum of those snapshot() results."""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        merged = {}
+        for labelvalues, counts, total, count in (self.snapshot() if snapshots is None else
+                                                  (series for snapshot in snapshots for series in snapshot)):
+            current = merged.setdefault(tuple(labelvalues), [[0] * len(counts), 0.0, 0])
+            current[0] = [a + b for a, b in zip(current[0], counts)]
+            current[1] += total
+            current[2] += count
+        for labelvalues, (counts, total, count) in sorted(merged.items()):
+            labels = {**extra_labels, **dict(zip(self.labelnames, labelvalues))}
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{format_labels({**labels, "le": bound})} {cumulative}')
+            lines.append(f'{self.name}_bucket{format_labels({**labels, "le": "+Inf"})} {count}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {total:.6f}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {count}')
+        return lines
+
+
+class Gauge:
+    """A Prometheus gauge whose samples are read from `read()` at scrape time."""
+
+    def __init__(self, name, documentation, read):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def snapshot(self):
+        return [[labels, value] for labels, value in self.read()]
+
+    def collect(self, extra_labels, snapshots=None):
+        """Renders this process's samples, or with `snapshots` the (worker labels, snapshot()) pairs given."""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        for worker_labels, samples in ([(extra_labels, self.snapshot())] if snapshots is None else snapshots):
+            for labels, value in samples:
+                lines.append(f'{self.name}{format_labels({**worker_labels, **labels})} {value}')
+        return lines
+
+
+class FrameSpans:
+    """Time spent in each stage of one frame, in seconds."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def update(self, timings):
+        for stage, seconds in (timings or {}).items():
+            self.add(stage, seconds)
+
+    def add_inference(self, analyses, elapsed):
+        """Adds the stage timings of FrameAnalysis results, and the rest of `elapsed` as "queue"."""
+        measured = 0.0
+        for analysis in analyses:
+            self.update(analysis.timings)
+            measured += sum((analysis.timings or {}).values())
+        self.add('queue', max(elapsed - measured, 0.0))
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+
+frame_seconds = Histogram(
+    'attendance_frame_seconds', 'Time from a frame arriving to its response being ready.', ['session', 'outcome'],
+)
+stage_seconds = Histogram(
+    'attendance_frame_stage_seconds', 'Time a frame spent in each recognition stage.', ['stage', 'session', 'outcome'],
+)
+
+_session_labels = set()
+_session_labels_lock = threading.Lock()
+
+
+def session_label(session_id):
+    with _session_labels_lock:
+        if session_id in _session_labels:
+            return str(session_id)
+        if len(_session_labels) < MAX_SESSION_LABELS:
+            _session_labels.add(session_id)
+            return str(session_id)
+    return 'other'
+
+
+def frame_outcome(response):
+    """The "status" a frame response reports, or "error" if it has none."""
+    try:
+        return json.loads(response.content).get('status') or 'error'
+    except (ValueError, AttributeError):
+        return 'error'
+
+
+def observe_frame(session_id, response, spans, started_at):
+    """
+    Records the stage timings and total latency of one frame request.
+
+    Args:
+        session_id (int): The session the frame was for.
+        response (JsonResponse): The response being returned for the frame.
+        spans (FrameSpans): The stages timed while handling the frame.
+        started_at (float): time.perf_counter() when the request arrived.
+    """
+    get_store()
+    session = session_label(session_id)
+    outcome = frame_outcome(response)
+    frame_seconds.observe(time.perf_counter() - started_at, session, outcome)
+    for stage, seconds in spans.stages.items():
+        stage_seconds.observe(seconds, stage, session, outcome)
+
+
+def gallery_samples(measure):
+    from .gallery import loaded_galleries
+
+    return [({'gallery': label}, measure(gallery)) for label, gallery in loaded_galleries()]
+
+
+def rss_bytes():
+    """Resident memory of this process, from /proc on Linux or the peak from getrusage elsewhere."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+REGISTRY = [
+    frame_seconds,
+    stage_seconds,
+    Gauge('attendance_gallery_encodings', 'Face encodings in each gallery this worker holds.',
+          lambda: gallery_samples(len)),
+    Gauge('attendance_gallery_bytes', 'Bytes taken by the encodings of each gallery this worker holds.',
+          lambda: gallery_samples(lambda gallery: gallery.nbytes)),
+    Gauge('attendance_worker_rss_bytes', 'Resident memory of this worker process.', lambda: [({}, rss_bytes())]),
+]
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists, under another user.
+    return True
+
+
+class MetricsStore:
+    """
+    Writes this process's registry to a file in a directory shared by every worker, and
+    merges the files of all of them.
+
+    Args:
+        directory (str): The shared directory; emptied by the server when it starts.
+        interval (float): Seconds between the snapshots a background thread writes.
+    """
+
+    def __init__(self, directory, interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.pid = os.getpid()
+        # Not the pid alone: a later worker given a reused pid must not overwrite a finished one's counts.
+        self.path = os.path.join(directory, f'{self.pid}-{uuid.uuid4().hex[:8]}.json')
+        self._lock = threading.Lock()
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.write()
+        threading.Thread(target=self._run, name='metrics-snapshot', daemon=True).start()
+        return self
+
+    def write(self):
+        """Replaces this process's file with a snapshot of its registry."""
+        snapshot = {'pid': self.pid, 'metrics': {metric.name: metric.snapshot() for metric in REGISTRY}}
+        with self._lock:
+            temporary = f'{self.path}.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(temporary, self.path)
+
+    def read(self):
+        """Returns (snapshot, seconds since it was written) for the file of every worker."""
+        snapshots = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    snapshots.append((json.load(f), now - os.path.getmtime(path)))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipped unreadable metrics snapshot {path}: {e}")
+        return snapshots
+
+    def render(self):
+        self.write()
+        snapshots = self.read()
+        lines = []
+        for metric in REGISTRY:
+            if isinstance(metric, Histogram):
+                lines.extend(metric.collect({}, [snapshot['metrics'].get(metric.name, []) for snapshot, _ in snapshots]))
+            else:
+                # The gauges of a worker that has exited, or stopped writing, are gone with it.
+                lines.extend(metric.collect({}, [
+                    ({'worker': snapshot['pid']}, snapshot['metrics'].get(metric.name, []))
+                    for snapshot, age in snapshots if age < 3 * self.interval and is_alive(snapshot['pid'])
+                ]))
+        return '\n'.join(lines) + '\n'
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except OSError as e:
+                logger.error(f"Could not write the metrics snapshot {self.path}: {e}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Returns this process's MetricsStore, starting it on first use (and again after a fork), or None without METRICS_DIR."""
+    global _store
+    from django.conf import settings
+
+    if not settings.METRICS_DIR:
+        return None
+    with _store_lock:
+        if _store is None or _store.pid != os.getpid():
+            _store = MetricsStore(settings.METRICS_DIR).start()
+        return _store
+
+
+def render():
+    """Returns every metric in the Prometheus text exposition format, merged over the workers when METRICS_DIR is set."""
+    store = get_store()
+    if store is not None:
+        return store.render()
+    extra_labels = {'worker': os.getpid()}
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect(extra_labels))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-16 22:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0009_gallerychange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaceEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vector', models.BinaryField()),
+                ('model_version', models.CharField(default='dlib_face_recognition_resnet_model_v1', max_length=100)),
+                ('quality', models.FloatField(blank=True, help_text='Face detector confidence for the sample the descriptor was computed from.', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embeddings', to='attendance.student')),
+            ],
+        ),
+    ]
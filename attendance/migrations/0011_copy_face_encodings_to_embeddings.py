@@ -0,0 +1,43 @@
+import json
+
+import numpy as np
+from django.db import migrations
+
+
+def copy_json_encodings(apps, schema_editor):
+    Student = apps.get_model('attendance', 'Student')
+    FaceEmbedding = apps.get_model('attendance', 'FaceEmbedding')
+
+    for student_id, encodings_json in Student.objects.exclude(face_encodings_data=None).values_list('id', 'face_encodings_data').iterator():
+        try:
+            encodings = np.asarray(json.loads(encodings_json), dtype='<f4').reshape(-1, 128)
+        except (ValueError, TypeError):
+            continue
+        FaceEmbedding.objects.bulk_create([
+            FaceEmbedding(student_id=student_id, vector=encoding.tobytes())
+            for encoding in encodings
+        ])
+
+
+def copy_embeddings_to_json(apps, schema_editor):
+    Student = apps.get_model('attendance', 'Student')
+    FaceEmbedding = apps.get_model('attendance', 'FaceEmbedding')
+
+    encodings_by_student = {}
+    for student_id, vector in FaceEmbedding.objects.order_by('student_id', 'id').values_list('student_id', 'vector').iterator():
+        encodings_by_student.setdefault(student_id, []).append(np.frombuffer(vector, dtype='<f4').tolist())
+    for student_id, encodings in encodings_by_student.items():
+        Student.objects.filter(id=student_id).update(face_encodings_data=json.dumps(encodings))
+    # The rows were created by the forward migration; leaving them would duplicate them when it runs again.
+    FaceEmbedding.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0010_faceembedding'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_json_encodings, copy_embeddings_to_json),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0011_copy_face_encodings_to_embeddings'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='student',
+            name='face_encodings_data',
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_months(apps, schema_editor):
+    from attendance.stats import rebuild_months
+
+    rebuild_months(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0015_attendance_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentMonthlyAttendance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('record_count', models.PositiveIntegerField(default=0)),
+                ('on_time_count', models.PositiveIntegerField(default=0)),
+                ('late_count', models.PositiveIntegerField(default=0)),
+                ('attended_days', models.PositiveIntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='attendance.course')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_attendance', to='attendance.student')),
+            ],
+            options={
+                'unique_together': {('student', 'year', 'month', 'course')},
+            },
+        ),
+        migrations.RunPython(fill_months, migrations.RunPython.noop),
+    ]
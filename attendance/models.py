@@ -2,19 +2,73 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 import uuid 
+import numpy as np
+
+# Identifies the network that produced a stored descriptor; descriptors from different models are not comparable.
+FACE_MODEL_VERSION = 'dlib_face_recognition_resnet_model_v1'
+ENCODING_DIM = 128
+
 
 class Student(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     matric_number = models.CharField(max_length=100, unique=True, verbose_name="Matriculation Number")
-    face_encodings_data = models.TextField(
+
+
+    def __str__(self):
+        return self.user.get_full_name()
+
+
+class FaceEmbedding(models.Model):
+    """A single 128-d face descriptor stored as packed little-endian float32 (512 bytes)."""
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='embeddings')
+    vector = models.BinaryField()
+    model_version = models.CharField(max_length=100, default=FACE_MODEL_VERSION)
+    quality = models.FloatField(
         null=True,
         blank=True,
-        help_text="JSON-encoded list of 128-dimensional face encodings from dlib."
+        help_text="Face detector confidence for the sample the descriptor was computed from."
     )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def pack(encoding):
+        """Returns the raw bytes stored in `vector` for a 128-d encoding."""
+        return np.asarray(encoding, dtype='<f4').reshape(ENCODING_DIM).tobytes()
+
+    @classmethod
+    def from_encodings(cls, student, encodings, qualities=None):
+        """Builds unsaved embeddings for `student`, ready for bulk_create."""
+        qualities = qualities if qualities is not None else [None] * len(encodings)
+        return [
+            cls(student=student, vector=cls.pack(encoding), quality=quality)
+            for encoding, quality in zip(encodings, qualities)
+        ]
 
+    def as_array(self):
+        return np.frombuffer(self.vector, dtype='<f4')
 
     def __str__(self):
-        return self.user.get_full_name()
+        return f"Face embedding #{self.id} for {self.student}"
+
+
+class GalleryChange(models.Model):
+    """
+    Append-only log of Student changes that affect the in-memory face gallery.
+
+    The newest id doubles as the gallery version: a worker whose cached copy was
+    built at an older id only needs to reload the students logged after it.
+    """
+    # Not a ForeignKey: the entry must outlive the student when it records a deletion.
+    student_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def log(cls, student_ids):
+        """Records that the face data of every student in `student_ids` may have changed."""
+        cls.objects.bulk_create([cls(student_id=student_id) for student_id in student_ids])
+
+    def __str__(self):
+        return f"Gallery change #{self.id} for student {self.student_id}"
 
 
 class Course(models.Model):
@@ -43,7 +97,8 @@ class AttendanceRecord(models.Model):
     )
     session = models.ForeignKey(AttendanceSession, on_delete=models.CASCADE, related_name='records')
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='records')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # When the student was recognised; set on the instance so write-behind inserts keep it.
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='on_time')
 
     class Meta:
@@ -51,6 +106,77 @@ class AttendanceRecord(models.Model):
 
     def __str__(self):
         return f"{self.student} marked for {self.session.course.course_code} - {self.status}"
+
+
+class CourseStats(models.Model):
+    """
+    Running totals for a course, kept by attendance/stats.py so the lecturer
+    dashboard does not count sessions and records on every visit.
+    """
+    course = models.OneToOneField(Course, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    session_count = models.PositiveIntegerField(default=0)
+    record_count = models.PositiveIntegerField(default=0)
+    # Distinct students with at least one record in the course's sessions.
+    student_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Stats for course {self.course_id}"
+
+
+class CourseAttendee(models.Model):
+    """The number of records a student has in a course; a row exists only while it is above zero."""
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='+')
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='+')
+    record_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('course', 'student')
+
+
+class LecturerStats(models.Model):
+    """Running totals across all of a lecturer's courses, kept by attendance/stats.py."""
+    lecturer = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='lecturer_stats')
+    # Distinct students with at least one record in any of the lecturer's courses.
+    student_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Stats for lecturer {self.lecturer_id}"
+
+
+class LecturerAttendee(models.Model):
+    """The number of a lecturer's courses a student has records in; a row exists only while it is above zero."""
+    lecturer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='+')
+    course_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('lecturer', 'student')
+
+
+class StudentMonthlyAttendance(models.Model):
+    """
+    A student's records in one course in one calendar month (by the session's local
+    date), kept by attendance/stats.py so the student dashboard need not load the
+    student's whole history.
+    """
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='monthly_attendance')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='+')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    record_count = models.PositiveIntegerField(default=0)
+    on_time_count = models.PositiveIntegerField(default=0)
+    late_count = models.PositiveIntegerField(default=0)
+    # Bit n - 1 is set when the student has a record on day n of the month.
+    attended_days = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('student', 'year', 'month', 'course')
+
+    def days(self):
+        return {day for day in range(1, 32) if self.attended_days & (1 << (day - 1))}
+
+    def __str__(self):
+        return f"{self.student_id} in course {self.course_id}, {self.year}-{self.month:02d}"
         
         
 class PasswordReset(models.Model):
@@ -59,4 +185,51 @@ class PasswordReset(models.Model):
     created_when = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Password reset for {self.user.username}"
\ No newline at end of file
+        return f"Password reset for {self.user.username}"
+
+class EnrollmentJob(models.Model):
+    """
+    A student registration waiting for its face samples to be encoded.
+
+    Rows are written by student_registration when ENROLLMENT_BACKGROUND_JOBS is on and
+    processed by `manage.py run_enrollment_jobs`. The password is stored already hashed,
+    and both it and the samples are cleared once the job has finished either way.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+    ACTIVE_STATUSES = (PENDING, RUNNING)
+
+    job_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    first_name = models.CharField(max_length=100)
+    last_name = models.CharField(max_length=100)
+    email = models.EmailField()
+    matric_number = models.CharField(max_length=100)
+    password = models.CharField(max_length=128)
+    face_samples = models.TextField(blank=True, help_text="JSON list of the captured data-URL samples.")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now, help_text="The job is not picked up before this time.")
+    student = models.ForeignKey(Student, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
+    def __str__(self):
+        return f"Enrollment job {self.job_id} for {self.email} ({self.status})"
@@ -0,0 +1,65 @@
+"""
+Loading the state web workers share, ahead of the first request.
+
+With gunicorn's preload_app (see gunicorn.conf.py) the master calls
+preload_for_fork() once before forking its workers. The dlib models and the
+gallery snapshots then live in pages every worker inherits copy-on-write
+instead of each worker loading its own copy. The snapshots are immutable: a
+worker that catches up with the change log builds a new snapshot next to the
+shared one rather than writing to it.
+
+Without preload, each worker calls load_shared_state() after it boots, so
+both modes serve their first frame equally warm.
+"""
+import gc
+import logging
+
+from django.conf import settings
+from django.db import connections
+
+from .gallery import get_course_gallery, get_gallery
+from .models import AttendanceSession
+
+logger = logging.getLogger(__name__)
+
+
+def load_shared_state():
+    """
+    Loads the dlib models, the global gallery with its search index, and the
+    galleries of every course with an open session. With write-behind on, also
+    inserts the attendance records journaled by workers that died before flushing.
+
+    Returns:
+        bool: Whether the face models are available.
+    """
+    from .recognition import warm_up
+
+    if settings.ATTENDANCE_WRITE_BEHIND:
+        from .writebehind import replay_journal
+
+        replay_journal()
+    models_loaded = warm_up()
+    gallery = get_gallery()
+    gallery.index  # Built lazily otherwise; build it now so it is shared too.
+    course_ids = AttendanceSession.objects.filter(is_active=True).values_list('course_id', flat=True).distinct()
+    for course_id in course_ids:
+        get_course_gallery(course_id)
+    logger.info(f"Preloaded face models ({'ok' if models_loaded else 'unavailable'}), {len(gallery)} gallery encodings "
+                f"and {len(course_ids)} course galleries.")
+    return models_loaded
+
+
+def preload_for_fork():
+    """
+    Loads the shared state in a process that is about to fork its workers.
+
+    Database connections are closed so no worker inherits a socket another process
+    also uses. Everything allocated so far is moved out of the garbage collector's
+    reach with gc.freeze(), because a collection in a worker would otherwise write to
+    the headers of every tracked object and copy the pages they live on.
+    """
+    models_loaded = load_shared_state()
+    connections.close_all()
+    gc.collect()
+    gc.freeze()
+    return models_loaded
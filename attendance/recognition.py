@@ -0,0 +1,407 @@
+"""
+Face detection and embedding with dlib.
+
+This module holds the models and everything that turns image bytes into face
+boxes and 128-d descriptors. It deliberately imports nothing from Django so the
+inference worker processes in inference.py can load it on their own; matching
+and marking attendance stay in the web process.
+
+The module itself is only imported when recognition is first needed, and the
+dlib models are loaded on the first call to get_models(), so management
+commands and pages that never recognise a face do not pay for OpenCV, dlib or
+the model files. Call warm_up() at worker start to pay that cost up front.
+
+Setting FACE_MODEL_BACKEND=fake in the environment swaps the dlib models for the
+stand-ins in fake_models.py, for load tests on machines without the model files.
+It is honoured only when DEBUG=True is set in the environment as well, so a
+production worker never accepts painted stripes as identities.
+"""
+import base64
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+import dlib
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHAPE_PREDICTOR_PATH = os.path.join(BASE_DIR, 'dlib_models', 'shape_predictor_68_face_landmarks.dat')
+FACE_REC_MODEL_PATH = os.path.join(BASE_DIR, 'dlib_models', 'dlib_face_recognition_resnet_model_v1.dat')
+
+FaceModels = namedtuple('FaceModels', ['face_detector', 'shape_predictor', 'face_recognizer'])
+
+_models = None
+_models_error = None
+_models_lock = threading.Lock()
+
+
+def get_models():
+    """
+    Returns the dlib models, loading them on first use.
+
+    Loading happens once per process, under a lock, so concurrent first requests do not
+    each load a copy. A failed load is remembered and not retried.
+
+    Raises:
+        ValueError: If the models could not be loaded.
+    """
+    global _models, _models_error
+    if _models is None and _models_error is None:
+        with _models_lock:
+            if _models is None and _models_error is None:
+                fake = os.getenv('FACE_MODEL_BACKEND', 'dlib') == 'fake'
+                if fake and os.getenv('DEBUG', 'False') != 'True':
+                    logger.error("FACE_MODEL_BACKEND=fake is only allowed with DEBUG=True; no face models loaded.")
+                    _models_error = "fake models without DEBUG"
+                    raise ValueError("Dlib models are not loaded. Check server logs for details.")
+                try:
+                    if fake:
+                        from .fake_models import load_fake_models
+
+                        _models = load_fake_models(FaceModels)
+                        logger.warning("Using the fake face models (FACE_MODEL_BACKEND=fake); faces are not really recognised.")
+                    else:
+                        _models = FaceModels(
+                            face_detector=dlib.get_frontal_face_detector(),
+                            shape_predictor=dlib.shape_predictor(SHAPE_PREDICTOR_PATH),
+                            face_recognizer=dlib.face_recognition_model_v1(FACE_REC_MODEL_PATH),
+                        )
+                except RuntimeError as e:
+                    logger.error(f"Failed to load dlib models: {e}. Please check model paths.")
+                    _models_error = str(e)
+    if _models is None:
+        raise ValueError("Dlib models are not loaded. Check server logs for details.")
+    return _models
+
+
+def warm_up():
+    """
+    Loads the models and runs the descriptor network once on a blank face chip, so
+    the first real request does not pay for loading or first-call allocations.
+
+    Returns:
+        bool: Whether the models are available.
+    """
+    try:
+        models = get_models()
+    except ValueError:
+        return False
+    models.face_recognizer.compute_face_descriptor(np.zeros((FACE_CHIP_SIZE, FACE_CHIP_SIZE, 3), dtype=np.uint8))
+    return True
+
+
+# Aligned face crops fed to the descriptor network; these match what
+# compute_face_descriptor(img, shape) extracts internally, so descriptors are identical.
+FACE_CHIP_SIZE = 150
+FACE_CHIP_PADDING = 0.25
+
+
+def prepare_sample(b64_img):
+    """
+    Decodes one registration sample and cuts out its aligned face chip.
+
+    This is the per-sample half of enrollment (decode, detection with upsampling and
+    landmarks); encode_chunk() runs it over its share of the samples.
+
+    Returns:
+        A tuple (chip, quality) with the 150x150 RGB chip and the detector confidence,
+        or None if the sample does not contain exactly one usable face.
+    """
+    try:
+        _format, img_str = b64_img.split(';base64,')
+        image_data = base64.b64decode(img_str)
+        nparr = np.frombuffer(image_data, np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+        # dlib works with RGB images, while OpenCV uses BGR
+        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+        # Detect faces using dlib's detector, keeping its confidence as the sample quality
+        models = get_models()
+        detected_faces, scores, _ = models.face_detector.run(rgb_img, 1)
+
+        if len(detected_faces) != 1:
+            # Skip images that don't have exactly one face
+            logger.info(f"Skipping image: Found {len(detected_faces)} faces.")
+            return None
+
+        # Get the shape (landmarks) for the detected face and align the face with it
+        shape = models.shape_predictor(rgb_img, detected_faces[0])
+        chip = dlib.get_face_chip(rgb_img, shape, size=FACE_CHIP_SIZE, padding=FACE_CHIP_PADDING)
+        return chip, float(scores[0])
+
+    except Exception as e:
+        logger.warning(f"Skipping a problematic image sample. Error: {e}")
+        return None
+
+
+def encode_chunk(face_samples_b64):
+    """
+    Prepares a share of the registration samples and computes the descriptors of their
+    accepted faces in one batched compute_face_descriptor call.
+
+    Runs wherever the inference runner puts it, so with an inference pool only the pool's
+    workers load the descriptor network.
+
+    Returns:
+        A tuple (encodings, qualities): a float32 array of shape (N, 128) and the
+        detector confidence of each face, in sample order.
+    """
+    prepared = [sample for sample in map(prepare_sample, face_samples_b64) if sample is not None]
+    if not prepared:
+        return np.empty((0, 128), dtype=np.float32), []
+    face_encodings = get_models().face_recognizer.compute_face_descriptor([chip for chip, _ in prepared])
+    return np.asarray(face_encodings, dtype=np.float32), [quality for _, quality in prepared]
+
+
+def train_dlib_model_from_samples(face_samples_b64: list, map_samples=map, chunks=1) -> tuple:
+    """
+    Processes a list of base64 encoded images to extract dlib face encodings.
+
+    The samples are split into `chunks` contiguous chunks and encode_chunk() is run
+    over them through `map_samples`, so every chunk is prepared and described in one job.
+
+    Args:
+        face_samples_b64: A list of base64 encoded image strings.
+        map_samples: A map()-like callable used to run encode_chunk over the chunks,
+            e.g. inference.map_jobs to spread them over the inference pool.
+        chunks: How many jobs to split the samples into; usually the runner's parallelism.
+
+    Returns:
+        A tuple (encodings, qualities): a float32 array of shape (N, 128) and the
+        detector confidence of the face each encoding was computed from.
+
+    Raises:
+        ValueError: If dlib models are not loaded or if insufficient valid faces are found.
+    """
+    size = -(-len(face_samples_b64) // max(chunks, 1)) or 1
+    parts = [face_samples_b64[start:start + size] for start in range(0, len(face_samples_b64), size)]
+    results = list(map_samples(encode_chunk, parts))
+    qualities = [quality for _, chunk_qualities in results for quality in chunk_qualities]
+
+    if len(qualities) < 5:  # dlib is robust, so we can require fewer samples
+        raise ValueError(f"Insufficient valid face samples. Found {len(qualities)}, need at least 5.")
+
+    return np.concatenate([encodings for encodings, _ in results]), qualities
+
+
+def decode_frame(image_bytes):
+    """
+    Decodes an encoded image straight from its buffer into an RGB array for dlib.
+
+    Raises:
+        ValueError: If the bytes are not a readable image.
+    """
+    frame = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError('Could not decode the image.')
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+# The crop around a face hint extends this fraction of the hint's size past each edge.
+FACE_HINT_PADDING = 0.5
+# dlib's HOG detector finds faces down to about 80 px; smaller hinted faces are upsampled once.
+FACE_HINT_MIN_SIZE = 100
+
+
+def parse_face_box(value, frame_shape):
+    """
+    Reads a client-side face bounding box hint.
+
+    Args:
+        value: "left,top,right,bottom" in pixels, the same four numbers as a list, or a
+            dict with those keys. Coordinates refer to the submitted image.
+        frame_shape (tuple): Shape of the decoded frame, used to clamp the box.
+
+    Returns:
+        A dlib.rectangle, or None if the hint is missing or unusable.
+    """
+    if not value:
+        return None
+    try:
+        if isinstance(value, str):
+            value = value.split(',')
+        elif isinstance(value, dict):
+            value = [value['left'], value['top'], value['right'], value['bottom']]
+        left, top, right, bottom = (int(round(float(v))) for v in value)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    height, width = frame_shape[:2]
+    left, top = max(left, 0), max(top, 0)
+    right, bottom = min(right, width - 1), min(bottom, height - 1)
+    if right <= left or bottom <= top:
+        return None
+    return dlib.rectangle(left, top, right, bottom)
+
+
+def detect_faces(rgb_frame, face_hint=None):
+    """
+    Runs the face detector over the frame, or only around a client-supplied face box.
+
+    With a hint the detector sees a padded crop instead of the whole upsampled frame,
+    which is the most expensive stage of recognition. The hint is only trusted if the
+    crop holds exactly one face whose centre lies inside the hinted box; otherwise the
+    full frame is searched as before.
+
+    Args:
+        rgb_frame (np.ndarray): The decoded RGB frame.
+        face_hint (dlib.rectangle): Optional face box from parse_face_box().
+
+    Returns:
+        dlib.rectangles in full-frame coordinates.
+    """
+    if face_hint is not None:
+        pad_x = int(face_hint.width() * FACE_HINT_PADDING)
+        pad_y = int(face_hint.height() * FACE_HINT_PADDING)
+        height, width = rgb_frame.shape[:2]
+        x0, y0 = max(face_hint.left() - pad_x, 0), max(face_hint.top() - pad_y, 0)
+        x1, y1 = min(face_hint.right() + pad_x, width), min(face_hint.bottom() + pad_y, height)
+
+        upsample = 0 if min(face_hint.width(), face_hint.height()) >= FACE_HINT_MIN_SIZE else 1
+        crop_faces = get_models().face_detector(np.ascontiguousarray(rgb_frame[y0:y1, x0:x1]), upsample)
+        if len(crop_faces) == 1:
+            face = dlib.translate_rect(crop_faces[0], dlib.point(x0, y0))
+            if face_hint.contains(face.center()):
+                faces = dlib.rectangles()
+                faces.append(face)
+                return faces
+        logger.debug(f"Face hint {face_hint} not confirmed ({len(crop_faces)} faces in crop); searching the full frame.")
+
+    return get_models().face_detector(rgb_frame, 1)
+
+
+# Result of analysing one frame. `faces` holds (left, top, right, bottom) tuples and
+# `encodings` one float32 row per face that was described; `error` is set instead
+# when the image could not be decoded. `tracked` means the single face continued a
+# track (see tracking.py) and was not described. `timings` holds the seconds spent in
+# each stage ("imdecode", "detect", "landmarks", "descriptor") for metrics.py.
+FrameAnalysis = namedtuple('FrameAnalysis', ['faces', 'encodings', 'error', 'tracked', 'timings'], defaults=[False, None])
+
+
+def rect_to_tuple(rect):
+    return rect.left(), rect.top(), rect.right(), rect.bottom()
+
+
+def iou(a, b):
+    """Intersection over union of two (left, top, right, bottom) boxes."""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union
+
+
+def lap(timings, stage, started):
+    """Adds the time since `started` to `stage` in `timings` and returns the current time."""
+    now = time.perf_counter()
+    timings[stage] = timings.get(stage, 0.0) + now - started
+    return now
+
+
+def no_encodings():
+    return np.empty((0, 128), dtype=np.float32)
+
+
+def analyze_frame(image_bytes, classroom=False, face_box=None, track_box=None, min_iou=0.5):
+    """
+    Decodes a frame, finds its faces and computes their descriptors.
+
+    Args:
+        image_bytes (bytes): The encoded image.
+        classroom (bool): Describe every face. Otherwise only a frame with exactly
+            one face is described, and `face_box` may narrow the search.
+        face_box: Optional client hint accepted by parse_face_box().
+        track_box (tuple): Box of the terminal's current track, if its identity may be
+            reused. A single face overlapping it by at least `min_iou` is not described.
+
+    Returns:
+        A FrameAnalysis.
+    """
+    models = get_models()
+    timings = {}
+    started = time.perf_counter()
+    try:
+        rgb_frame = decode_frame(image_bytes)
+    except ValueError as e:
+        lap(timings, 'imdecode', started)
+        return FrameAnalysis([], no_encodings(), str(e), timings=timings)
+    started = lap(timings, 'imdecode', started)
+
+    if classroom:
+        detected_faces = models.face_detector(rgb_frame, 1)
+    else:
+        detected_faces = detect_faces(rgb_frame, parse_face_box(face_box, rgb_frame.shape))
+    started = lap(timings, 'detect', started)
+
+    faces = [rect_to_tuple(face) for face in detected_faces]
+    if not faces or (len(faces) > 1 and not classroom):
+        return FrameAnalysis(faces, no_encodings(), None, timings=timings)
+    if track_box is not None and not classroom and iou(faces[0], track_box) >= min_iou:
+        return FrameAnalysis(faces, no_encodings(), None, tracked=True, timings=timings)
+
+    shapes = dlib.full_object_detections()
+    for face in detected_faces:
+        shapes.append(models.shape_predictor(rgb_frame, face))
+    started = lap(timings, 'landmarks', started)
+    encodings = np.asarray(models.face_recognizer.compute_face_descriptor(rgb_frame, shapes), dtype=np.float32)
+    lap(timings, 'descriptor', started)
+    return FrameAnalysis(faces, encodings, None, timings=timings)
+
+
+def analyze_frames(frames, classroom=False):
+    """
+    Batch form of analyze_frame() for several frames.
+
+    Detection runs per frame, then the descriptors of every face in every frame come
+    from a single batched compute_face_descriptor call.
+
+    Returns:
+        A list with one FrameAnalysis per frame, in order.
+    """
+    models = get_models()
+    results = []
+    batch_images = []
+    batch_shapes = []
+    described = []  # index into results of every frame in the descriptor batch
+    for image_bytes in frames:
+        timings = {}
+        started = time.perf_counter()
+        try:
+            rgb_frame = decode_frame(image_bytes)
+        except ValueError as e:
+            lap(timings, 'imdecode', started)
+            results.append(FrameAnalysis([], no_encodings(), str(e), timings=timings))
+            continue
+        started = lap(timings, 'imdecode', started)
+
+        detected_faces = models.face_detector(rgb_frame, 1)
+        started = lap(timings, 'detect', started)
+        results.append(FrameAnalysis([rect_to_tuple(face) for face in detected_faces], no_encodings(), None, timings=timings))
+        if len(detected_faces) == 0 or (len(detected_faces) > 1 and not classroom):
+            continue
+
+        shapes = dlib.full_object_detections()
+        for face in detected_faces:
+            shapes.append(models.shape_predictor(rgb_frame, face))
+        lap(timings, 'landmarks', started)
+        batch_images.append(rgb_frame)
+        batch_shapes.append(shapes)
+        described.append(len(results) - 1)
+
+    if batch_images:
+        started = time.perf_counter()
+        descriptors = models.face_recognizer.compute_face_descriptor(batch_images, batch_shapes)
+        # The batch is one call; each described frame is charged an equal share of it.
+        share = (time.perf_counter() - started) / len(batch_images)
+        for index, frame_descriptors in zip(described, descriptors):
+            results[index].timings['descriptor'] = share
+            results[index] = results[index]._replace(encodings=np.asarray(frame_descriptors, dtype=np.float32))
+    return results
@@ -0,0 +1,87 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import stats
+from .marking import unmark
+from .models import AttendanceRecord, AttendanceSession, Course, CourseStats, GalleryChange, Student
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def log_gallery_change(sender, instance, **kwargs):
+    """Records that a student's face encodings may have changed so every worker's gallery picks it up."""
+    GalleryChange.log([instance.pk])
+
+
+@receiver(m2m_changed, sender=Course.enrolled_students.through)
+def log_enrollment_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Records enrollment changes so course galleries add or drop the affected students."""
+    if action in ('post_add', 'post_remove'):
+        # With reverse=True the change came from student.courses and pk_set holds course ids.
+        GalleryChange.log([instance.pk] if reverse else pk_set)
+    elif action == 'pre_clear':
+        # The cleared students are only known before the clear; log them once it has happened.
+        instance._gallery_cleared_ids = [instance.pk] if reverse else list(instance.enrolled_students.values_list('id', flat=True))
+    elif action == 'post_clear':
+        GalleryChange.log(getattr(instance, '_gallery_cleared_ids', []))
+
+
+@receiver(post_delete, sender=AttendanceRecord)
+def unmark_deleted_record(sender, instance, **kwargs):
+    """Lets a student whose record was deleted be marked again in the same session."""
+    unmark(instance.session_id, [instance.student_id])
+
+
+@receiver(post_save, sender=Course)
+def create_course_stats(sender, instance, created, **kwargs):
+    if created:
+        CourseStats.objects.get_or_create(course=instance)
+
+
+@receiver(post_save, sender=AttendanceSession)
+def count_session(sender, instance, created, **kwargs):
+    if created:
+        stats.session_added(instance)
+
+
+@receiver(pre_save, sender=AttendanceRecord)
+def remember_status(sender, instance, **kwargs):
+    """Keeps the stored status of an edited record so post_save can tell whether it changed."""
+    if not instance._state.adding:
+        instance._saved_status = AttendanceRecord.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=AttendanceRecord)
+def count_record(sender, instance, created, **kwargs):
+    """Counts records saved one at a time; bulk inserts go through stats.insert_records()."""
+    if created:
+        stats.record_added(instance)
+    elif getattr(instance, '_saved_status', None) is not None:
+        stats.status_changed(instance, instance._saved_status)
+
+
+@receiver(post_delete, sender=AttendanceRecord)
+def uncount_record(sender, instance, **kwargs):
+    stats.record_deleted(instance)
+
+
+@receiver(pre_delete, sender=AttendanceSession)
+def uncount_session(sender, instance, **kwargs):
+    stats.session_deleting(instance)
+
+
+@receiver(pre_delete, sender=Course)
+def uncount_course(sender, instance, **kwargs):
+    stats.course_deleting(instance)
+
+
+@receiver(pre_delete, sender=Student)
+def uncount_student(sender, instance, **kwargs):
+    stats.student_deleting(instance)
+
+
+@receiver(post_delete, sender=AttendanceSession)
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Student)
+def forget_deleted(sender, instance, **kwargs):
+    stats.deleted(instance)
@@ -0,0 +1,463 @@
+"""
+Denormalized attendance counts for the lecturer dashboard.
+
+CourseStats holds each course's session, record and distinct-student counts and
+LecturerStats each lecturer's distinct-student count, so the dashboard reads one
+row per course instead of counting across sessions and records on every visit.
+Distinct students are kept exact with CourseAttendee rows, counting a student's
+records in a course, and LecturerAttendee rows, counting the lecturer's courses
+the student has records in: a student count only moves when such a row appears
+or disappears.
+
+StudentMonthlyAttendance rolls each student's records up by course and calendar
+month, with on-time and late counts and the days attended, for the student
+dashboard. Months are those of the session's date in the current time zone, as
+the dashboard has always dated them.
+
+The counters change in the same transaction as the rows they count:
+
+  - insert_records() inserts AttendanceRecords in bulk and tallies the new ones;
+    marking.py and writebehind.py insert through it.
+  - signals.py tallies sessions as they are created and records saved or deleted
+    one at a time, including a record's status changing.
+  - Deleting a session, course or student takes all its records off in one go
+    before the cascade, and the per-record signal then leaves them alone.
+
+Writers lock the CourseStats rows and then the LecturerStats rows they touch,
+each in id order, so concurrent marks of one course queue instead of counting a
+student twice. Counts drift when rows change behind the ORM's back or a course
+moves to another lecturer; `manage.py rebuild_attendance_stats` recomputes them.
+Deleting a course or student takes its monthly summaries with it in the cascade.
+"""
+import threading
+from collections import Counter, defaultdict
+
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import (
+    AttendanceRecord, AttendanceSession, CourseAttendee, CourseStats, LecturerAttendee, LecturerStats, Student,
+    StudentMonthlyAttendance,
+)
+
+# Sessions and students being deleted in this thread, whose records were already taken off in bulk.
+_deleting = threading.local()
+
+
+def deleting():
+    if not hasattr(_deleting, 'sessions'):
+        _deleting.sessions = set()
+        _deleting.students = set()
+    return _deleting
+
+
+def lock_stats(model, key_field, ids, create=True):
+    """
+    Locks the stats rows of `ids` for the rest of the transaction, in id order, creating
+    any that are missing unless `create` is False.
+
+    The lock is a no-op UPDATE rather than SELECT ... FOR UPDATE, so that on SQLite the
+    transaction takes the write lock, waiting out the busy timeout, before it reads.
+    """
+    def lock(key):
+        return model.objects.filter(**{key_field: key}).update(student_count=F('student_count'))
+
+    missing = [key for key in sorted(set(ids)) if not lock(key)]
+    if missing and create:
+        model.objects.bulk_create([model(**{key_field: key}) for key in missing], ignore_conflicts=True)
+        for key in missing:
+            lock(key)
+
+
+def increment(model, filters, **changes):
+    """Adds `changes` to counter fields of the matching rows, never taking them below zero."""
+    changes = {field: change for field, change in changes.items() if change}
+    if changes:
+        model.objects.filter(**filters).update(**{
+            field: F(field) + change if change > 0 else Greatest(F(field) + change, 0)
+            for field, change in changes.items()
+        })
+
+
+def adjust_attendees(model, owner_field, owner_id, count_field, deltas):
+    """
+    Adds per-student changes to one owner's attendee counters, creating the rows that
+    become positive and deleting the ones that reach zero.
+
+    Args:
+        model: CourseAttendee or LecturerAttendee.
+        owner_field (str): 'course_id' or 'lecturer_id'.
+        owner_id (int): The course or lecturer.
+        count_field (str): The counter column of `model`.
+        deltas (dict): The change of each student's counter, by student id.
+
+    Returns:
+        A tuple (added, removed) of the student ids that gained or lost a row.
+    """
+    deltas = {student_id: delta for student_id, delta in deltas.items() if delta}
+    if not deltas:
+        return [], []
+    rows = model.objects.filter(**{owner_field: owner_id, 'student_id__in': list(deltas)})
+    current = dict(rows.values_list('student_id', count_field))
+    added = [student_id for student_id, delta in deltas.items() if student_id not in current and delta > 0]
+    removed = [student_id for student_id, count in current.items() if count + deltas[student_id] <= 0]
+
+    if added:
+        model.objects.bulk_create([
+            model(**{owner_field: owner_id, 'student_id': student_id, count_field: deltas[student_id]})
+            for student_id in added
+        ])
+    if removed:
+        model.objects.filter(**{owner_field: owner_id, 'student_id__in': removed}).delete()
+    # Most batches change every student by the same amount, so this is usually one UPDATE.
+    by_delta = defaultdict(list)
+    for student_id in current.keys() - set(removed):
+        by_delta[deltas[student_id]].append(student_id)
+    for delta, student_ids in by_delta.items():
+        increment(model, {owner_field: owner_id, 'student_id__in': student_ids}, **{count_field: delta})
+    return added, removed
+
+
+def tally(course_id, lecturer_id, deltas, sessions=0):
+    """
+    Applies changes in the number of records each student has in a course.
+
+    Must run in a transaction that has locked the course's and the lecturer's stats rows.
+
+    Args:
+        course_id (int): The course the records belong to.
+        lecturer_id (int): The course's lecturer.
+        deltas (dict): Records added (positive) or removed (negative), by student id.
+        sessions (int): Sessions added to or removed from the course.
+    """
+    added, removed = adjust_attendees(CourseAttendee, 'course_id', course_id, 'record_count', deltas)
+    increment(
+        CourseStats, {'course_id': course_id},
+        session_count=sessions, record_count=sum(deltas.values()), student_count=len(added) - len(removed),
+    )
+    if added or removed:
+        lecturer_deltas = {**{student_id: 1 for student_id in added}, **{student_id: -1 for student_id in removed}}
+        added, removed = adjust_attendees(LecturerAttendee, 'lecturer_id', lecturer_id, 'course_count', lecturer_deltas)
+        increment(LecturerStats, {'lecturer_id': lecturer_id}, student_count=len(added) - len(removed))
+
+
+def tally_courses(deltas_by_course, lecturers):
+    """Locks and tallies several courses at once; `lecturers` maps each course id to its lecturer."""
+    lock_stats(CourseStats, 'course_id', deltas_by_course)
+    lock_stats(LecturerStats, 'lecturer_id', [lecturers[course_id] for course_id in deltas_by_course])
+    for course_id, deltas in sorted(deltas_by_course.items()):
+        tally(course_id, lecturers[course_id], deltas)
+
+
+# Every day bit of StudentMonthlyAttendance.attended_days.
+ALL_DAYS = (1 << 31) - 1
+
+
+def day_bit(day):
+    return 1 << (day.day - 1)
+
+
+def by_status(statuses):
+    """Groups {student_id: status} into {status: [student_id, ...]}."""
+    grouped = defaultdict(list)
+    for student_id, status in statuses.items():
+        grouped[status].append(student_id)
+    return grouped
+
+
+def add_to_months(course_id, day, statuses):
+    """
+    Adds new records of one session to the monthly summaries.
+
+    Args:
+        course_id (int): The session's course.
+        day (date): The session's local date.
+        statuses (dict): The status of each new record, by student id.
+    """
+    rows = StudentMonthlyAttendance.objects.filter(course_id=course_id, year=day.year, month=day.month)
+    existing = set(rows.filter(student_id__in=list(statuses)).values_list('student_id', flat=True))
+    StudentMonthlyAttendance.objects.bulk_create([
+        StudentMonthlyAttendance(
+            student_id=student_id, course_id=course_id, year=day.year, month=day.month, record_count=1,
+            on_time_count=int(status == 'on_time'), late_count=int(status == 'late'), attended_days=day_bit(day),
+        )
+        for student_id, status in statuses.items() if student_id not in existing
+    ])
+    for status, student_ids in by_status({s: statuses[s] for s in existing}).items():
+        rows.filter(student_id__in=student_ids).update(
+            record_count=F('record_count') + 1,
+            attended_days=F('attended_days').bitor(day_bit(day)),
+            **{f'{status}_count': F(f'{status}_count') + 1},
+        )
+
+
+def remove_from_months(course_id, day, statuses, session_id):
+    """
+    Takes records of one session off the monthly summaries. A day stays marked as
+    attended while the student has a record in another of the course's sessions that day.
+
+    Args:
+        course_id (int): The session's course.
+        day (date): The session's local date.
+        statuses (dict): The status of each removed record, by student id.
+        session_id (int): The session the records belong to.
+    """
+    rows = StudentMonthlyAttendance.objects.filter(course_id=course_id, year=day.year, month=day.month)
+    for status, student_ids in by_status(statuses).items():
+        increment(StudentMonthlyAttendance, {'course_id': course_id, 'year': day.year, 'month': day.month,
+                                             'student_id__in': student_ids}, record_count=-1, **{f'{status}_count': -1})
+    still_attended = set(AttendanceRecord.objects.filter(
+        student_id__in=list(statuses), session__course_id=course_id, session__created_at__date=day,
+    ).exclude(session_id=session_id).values_list('student_id', flat=True))
+    cleared = [student_id for student_id in statuses if student_id not in still_attended]
+    if cleared:
+        rows.filter(student_id__in=cleared).update(attended_days=F('attended_days').bitand(ALL_DAYS ^ day_bit(day)))
+    rows.filter(student_id__in=list(statuses), record_count=0).delete()
+
+
+def insert_records(records):
+    """
+    Inserts attendance records, skipping any already on the register, and adds the
+    new ones to the counters in the same transaction.
+
+    Records of sessions that no longer exist are dropped.
+
+    Returns:
+        list: The records that were inserted.
+    """
+    if not records:
+        return []
+    sessions = {
+        session_id: (course_id, lecturer_id, timezone.localdate(created_at))
+        for session_id, course_id, lecturer_id, created_at in AttendanceSession.objects.filter(
+            id__in={record.session_id for record in records},
+        ).values_list('id', 'course_id', 'course__lecturer_id', 'created_at')
+    }
+    lecturers = {course_id: lecturer_id for course_id, lecturer_id, _ in sessions.values()}
+    with transaction.atomic():
+        # Lock before looking for existing records, so two inserts of one student cannot both count it.
+        lock_stats(CourseStats, 'course_id', lecturers)
+        lock_stats(LecturerStats, 'lecturer_id', lecturers.values())
+        existing = set(AttendanceRecord.objects.filter(
+            session_id__in={record.session_id for record in records},
+            student_id__in={record.student_id for record in records},
+        ).values_list('session_id', 'student_id'))
+        new = []
+        for record in records:
+            key = (record.session_id, record.student_id)
+            if record.session_id in sessions and key not in existing:
+                existing.add(key)
+                new.append(record)
+        AttendanceRecord.objects.bulk_create(new, batch_size=500, ignore_conflicts=True)
+
+        deltas_by_course = defaultdict(Counter)
+        statuses_by_session = defaultdict(dict)
+        for record in new:
+            deltas_by_course[sessions[record.session_id][0]][record.student_id] += 1
+            statuses_by_session[record.session_id][record.student_id] = record.status
+        for course_id, deltas in sorted(deltas_by_course.items()):
+            tally(course_id, lecturers[course_id], deltas)
+        for session_id, statuses in statuses_by_session.items():
+            course_id, _, day = sessions[session_id]
+            add_to_months(course_id, day, statuses)
+    return new
+
+
+def session_row(session_id):
+    """The course, lecturer and local date of a session, or None if it no longer exists."""
+    row = AttendanceSession.objects.filter(id=session_id).values_list(
+        'course_id', 'course__lecturer_id', 'created_at').first()
+    return row and (row[0], row[1], timezone.localdate(row[2]))
+
+
+def record_added(record):
+    """Counts one record saved on its own (outside insert_records)."""
+    course_id, lecturer_id, day = session_row(record.session_id)
+    with transaction.atomic():
+        tally_courses({course_id: {record.student_id: 1}}, {course_id: lecturer_id})
+        add_to_months(course_id, day, {record.student_id: record.status})
+
+
+def record_deleted(record):
+    """Takes a deleted record off the counters, unless its session or student is being deleted whole."""
+    state = deleting()
+    if record.session_id in state.sessions or record.student_id in state.students:
+        return
+    row = session_row(record.session_id)
+    if row is not None:
+        course_id, lecturer_id, day = row
+        with transaction.atomic():
+            tally_courses({course_id: {record.student_id: -1}}, {course_id: lecturer_id})
+            remove_from_months(course_id, day, {record.student_id: record.status}, record.session_id)
+
+
+def status_changed(record, old_status):
+    """Moves a record whose status was edited between the on-time and late counts of its month."""
+    row = session_row(record.session_id)
+    if row is None or old_status == record.status:
+        return
+    course_id, _, day = row
+    increment(
+        StudentMonthlyAttendance,
+        {'student_id': record.student_id, 'course_id': course_id, 'year': day.year, 'month': day.month},
+        **{f'{old_status}_count': -1, f'{record.status}_count': 1},
+    )
+
+
+def session_added(session):
+    with transaction.atomic():
+        lock_stats(CourseStats, 'course_id', [session.course_id])
+        increment(CourseStats, {'course_id': session.course_id}, session_count=1)
+
+
+def session_deleting(session):
+    """Takes a session and all its records off the counters before they are deleted."""
+    state = deleting()
+    if session.id in state.sessions:
+        return  # Its course is being deleted.
+    state.sessions.add(session.id)
+    lecturer_id = session.course.lecturer_id
+    lock_stats(CourseStats, 'course_id', [session.course_id])
+    lock_stats(LecturerStats, 'lecturer_id', [lecturer_id])
+    statuses = dict(AttendanceRecord.objects.filter(session_id=session.id).values_list('student_id', 'status'))
+    tally(session.course_id, lecturer_id, {student_id: -1 for student_id in statuses}, sessions=-1)
+    if statuses:
+        remove_from_months(session.course_id, timezone.localdate(session.created_at), statuses, session.id)
+
+
+def course_deleting(course):
+    """
+    Takes a course's students off its lecturer's counters before the course is deleted.
+    Its own stats and attendee rows go with it in the cascade.
+    """
+    session_ids = set(AttendanceSession.objects.filter(course_id=course.id).values_list('id', flat=True))
+    deleting().sessions.update(session_ids)
+    course._stats_session_ids = session_ids
+    # No row is created here: the lecturer may be the one being deleted.
+    lock_stats(LecturerStats, 'lecturer_id', [course.lecturer_id], create=False)
+    student_ids = CourseAttendee.objects.filter(course_id=course.id).values_list('student_id', flat=True)
+    added, removed = adjust_attendees(
+        LecturerAttendee, 'lecturer_id', course.lecturer_id, 'course_count', {student_id: -1 for student_id in student_ids},
+    )
+    increment(LecturerStats, {'lecturer_id': course.lecturer_id}, student_count=len(added) - len(removed))
+
+
+def student_deleting(student):
+    """Takes all of a student's records off the counters before the student is deleted."""
+    state = deleting()
+    state.students.add(student.id)
+    deltas_by_course = {}
+    lecturers = {}
+    rows = AttendanceRecord.objects.filter(student_id=student.id).exclude(session_id__in=state.sessions).values(
+        'session__course_id', 'session__course__lecturer_id').annotate(records=Count('id')).order_by()
+    for row in rows:
+        course_id = row['session__course_id']
+        deltas_by_course[course_id] = {student.id: -row['records']}
+        lecturers[course_id] = row['session__course__lecturer_id']
+    tally_courses(deltas_by_course, lecturers)
+
+
+def deleted(instance):
+    """Forgets a session, course or student once its deletion is done."""
+    state = deleting()
+    state.sessions.difference_update(getattr(instance, '_stats_session_ids', ()))
+    if isinstance(instance, AttendanceSession):
+        state.sessions.discard(instance.id)
+    elif isinstance(instance, Student):
+        state.students.discard(instance.id)
+
+
+def rebuild_counts(apps=django_apps):
+    """
+    Recomputes the course and lecturer counters from the sessions and records.
+
+    Args:
+        apps: The app registry to take the models from; migrations pass their historical one.
+
+    Returns:
+        A tuple (courses, lecturers) of the stats rows written.
+    """
+    model = lambda name: apps.get_model('attendance', name)  # noqa: E731
+    Course = model('Course')
+    course_stats_model, course_attendee_model = model('CourseStats'), model('CourseAttendee')
+    lecturer_stats_model, lecturer_attendee_model = model('LecturerStats'), model('LecturerAttendee')
+
+    with transaction.atomic():
+        for stats_model in (course_attendee_model, lecturer_attendee_model, course_stats_model, lecturer_stats_model):
+            stats_model.objects.all().delete()
+
+        lecturer_of = dict(Course.objects.values_list('id', 'lecturer_id'))
+        sessions = dict(model('AttendanceSession').objects.values('course_id').annotate(
+            sessions=Count('id')).order_by().values_list('course_id', 'sessions'))
+        course_stats = {
+            course_id: course_stats_model(course_id=course_id, session_count=sessions.get(course_id, 0))
+            for course_id in lecturer_of
+        }
+        lecturer_courses = defaultdict(Counter)
+        attendees = []
+        pairs = model('AttendanceRecord').objects.values('session__course_id', 'student_id').annotate(
+            records=Count('id')).order_by()
+        for row in pairs.iterator():
+            course_id, student_id = row['session__course_id'], row['student_id']
+            attendees.append(course_attendee_model(course_id=course_id, student_id=student_id, record_count=row['records']))
+            course_stats[course_id].record_count += row['records']
+            course_stats[course_id].student_count += 1
+            lecturer_courses[lecturer_of[course_id]][student_id] += 1
+
+        course_attendee_model.objects.bulk_create(attendees, batch_size=1000)
+        course_stats_model.objects.bulk_create(course_stats.values(), batch_size=1000)
+        lecturer_attendee_model.objects.bulk_create([
+            lecturer_attendee_model(lecturer_id=lecturer_id, student_id=student_id, course_count=courses)
+            for lecturer_id, students in lecturer_courses.items()
+            for student_id, courses in students.items()
+        ], batch_size=1000)
+        lecturer_stats = [
+            lecturer_stats_model(lecturer_id=lecturer_id, student_count=len(lecturer_courses.get(lecturer_id, ())))
+            for lecturer_id in set(lecturer_of.values())
+        ]
+        lecturer_stats_model.objects.bulk_create(lecturer_stats, batch_size=1000)
+    return len(course_stats), len(lecturer_stats)
+
+
+def rebuild_months(apps=django_apps):
+    """
+    Recomputes the students' monthly summaries from the records.
+
+    Args:
+        apps: The app registry to take the models from; migrations pass their historical one.
+
+    Returns:
+        int: The summary rows written.
+    """
+    monthly_model = apps.get_model('attendance', 'StudentMonthlyAttendance')
+    records = apps.get_model('attendance', 'AttendanceRecord').objects.values_list(
+        'student_id', 'session__course_id', 'session__created_at', 'status')
+
+    with transaction.atomic():
+        monthly_model.objects.all().delete()
+        months = {}
+        for student_id, course_id, created_at, status in records.iterator():
+            day = timezone.localdate(created_at)
+            key = (student_id, course_id, day.year, day.month)
+            row = months.get(key)
+            if row is None:
+                row = months[key] = monthly_model(student_id=student_id, course_id=course_id, year=day.year, month=day.month)
+            row.record_count += 1
+            setattr(row, f'{status}_count', getattr(row, f'{status}_count') + 1)
+            row.attended_days |= day_bit(day)
+        monthly_model.objects.bulk_create(months.values(), batch_size=1000)
+    return len(months)
+
+
+def rebuild(apps=django_apps):
+    """
+    Recomputes every counter and monthly summary from the sessions and records.
+
+    Returns:
+        A tuple (courses, lecturers, months) of the rows written.
+    """
+    with transaction.atomic():
+        return (*rebuild_counts(apps), rebuild_months(apps))
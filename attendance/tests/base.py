@@ -0,0 +1,43 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from attendance.models import (
+    AttendanceRecord, AttendanceSession, Course, CourseStats, LecturerStats, Student, StudentMonthlyAttendance,
+)
+
+
+class StatsTestCase(TestCase):
+    """Creates a lecturer with two courses and three students, and checks counters against a rebuild."""
+
+    def setUp(self):
+        self.lecturer = User.objects.create_user(username='lecturer', is_staff=True)
+        self.course = Course.objects.create(course_code='CSC101', course_name='Programming', lecturer=self.lecturer)
+        self.other_course = Course.objects.create(course_code='CSC102', course_name='Data', lecturer=self.lecturer)
+        self.students = [
+            Student.objects.create(user=User.objects.create_user(username=f'student{i}'), matric_number=f'M/{i}')
+            for i in range(3)
+        ]
+        self.session = AttendanceSession.objects.create(course=self.course)
+        self.other_session = AttendanceSession.objects.create(course=self.other_course)
+
+    def records(self, session, students, status='on_time'):
+        return [AttendanceRecord(session=session, student=student, status=status) for student in students]
+
+    def course_counts(self, course):
+        stats = CourseStats.objects.get(course=course)
+        return stats.session_count, stats.record_count, stats.student_count
+
+    def lecturer_students(self):
+        return LecturerStats.objects.get(lecturer=self.lecturer).student_count
+
+    def month_counts(self, student, course):
+        row = StudentMonthlyAttendance.objects.get(student=student, course=course)
+        return row.record_count, row.on_time_count, row.late_count
+
+    def assertNoDrift(self):
+        out = StringIO()
+        call_command('rebuild_attendance_stats', '--check', stdout=out)
+        self.assertIn('0 courses, 0 lecturers and 0 students have drifted.', out.getvalue())
@@ -0,0 +1,71 @@
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from attendance.compaction import compact_encodings, prune_outliers
+from attendance.enrollment import encode_samples
+from attendance.management.commands.bench_matching import random_unit_encodings
+
+
+def unit(rows):
+    return (rows / np.linalg.norm(rows, axis=1, keepdims=True)).astype(np.float32)
+
+
+class CompactionTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        centre = random_unit_encodings(rng, 1)[0]
+        # Twelve samples of one face around two poses, and one sample of something else.
+        poses = unit(centre + rng.standard_normal((2, 128)) * 0.012)
+        self.samples = unit(np.repeat(poses, 6, axis=0) + rng.standard_normal((12, 128)) * 0.004)
+        self.outlier = unit(centre + rng.standard_normal((1, 128)) * 0.1)
+        self.encodings = np.concatenate([self.samples, self.outlier])
+        self.qualities = [float(i) for i in range(len(self.encodings))]
+
+    def test_prune_outliers_drops_the_far_sample(self):
+        keep = prune_outliers(self.encodings, max_distance=0.4)
+        self.assertEqual(list(keep), list(range(12)))
+
+    def test_prune_outliers_keeps_at_least_the_closest(self):
+        keep = prune_outliers(self.encodings, max_distance=0.0, keep_at_least=3)
+        self.assertEqual(len(keep), 3)
+        self.assertNotIn(12, keep)
+        self.assertEqual(list(keep), sorted(keep))
+
+    def test_prune_outliers_leaves_two_samples_alone(self):
+        self.assertEqual(list(prune_outliers(self.encodings[-2:], max_distance=0.0)), [0, 1])
+
+    def test_medoids_are_stored_samples(self):
+        encodings, qualities = compact_encodings(self.encodings, self.qualities, k=2, method='medoids', outlier_distance=0.4)
+
+        self.assertEqual(encodings.shape, (2, 128))
+        self.assertEqual(sorted(int(quality) // 6 for quality in qualities), [0, 1])
+        for encoding, quality in zip(encodings, qualities):
+            np.testing.assert_array_equal(encoding, self.encodings[int(quality)])
+
+    def test_centroids_average_their_cluster(self):
+        encodings, qualities = compact_encodings(self.encodings, self.qualities, k=2, method='centroids', outlier_distance=0.4)
+
+        self.assertEqual(sorted(qualities), [2.5, 8.5])
+        expected = self.samples[:6].mean(axis=0) if qualities[0] == 2.5 else self.samples[6:].mean(axis=0)
+        np.testing.assert_allclose(encodings[0], expected, rtol=1e-5)
+
+    def test_k_zero_keeps_every_sample_that_survives_pruning(self):
+        encodings, qualities = compact_encodings(self.encodings, None, k=0, method='medoids', outlier_distance=0.4)
+        np.testing.assert_array_equal(encodings, self.samples)
+        self.assertEqual(qualities, [None] * 12)
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            compact_encodings(self.encodings, k=2, method='pca')
+
+    def test_enrollment_keeps_every_sample_unless_compaction_is_on(self):
+        with mock.patch('attendance.recognition.train_dlib_model_from_samples', return_value=(self.encodings, self.qualities)):
+            encodings, qualities = encode_samples(['sample'], map)
+            with override_settings(FACE_COMPACTION=True, FACE_COMPACTION_K=2):
+                compacted, _ = encode_samples(['sample'], map)
+
+        self.assertIs(encodings, self.encodings)
+        self.assertEqual(qualities, self.qualities)
+        self.assertEqual(len(compacted), 2)
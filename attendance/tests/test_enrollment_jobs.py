@@ -0,0 +1,106 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from attendance import enrollment
+from attendance.models import EnrollmentJob
+
+
+@override_settings(ENROLLMENT_JOB_MAX_ATTEMPTS=3, ENROLLMENT_JOB_RETRY_DELAY=30, ENROLLMENT_JOB_STALE_SECONDS=600)
+class EnrollmentJobQueueTests(TestCase):
+    """Claiming, retrying and recovering queued enrollment jobs."""
+
+    def create_job(self, name, **fields):
+        return EnrollmentJob.objects.create(
+            first_name=name, last_name='Student', email=f'{name}@example.com', matric_number=name,
+            password='hashed', face_samples='["sample"]', **fields,
+        )
+
+    def test_jobs_are_claimed_oldest_first_and_only_once(self):
+        now = timezone.now()
+        newer = self.create_job('newer', run_after=now - timedelta(seconds=1))
+        older = self.create_job('older', run_after=now - timedelta(seconds=2))
+        self.create_job('later', run_after=now + timedelta(minutes=5))
+
+        self.assertEqual(enrollment.claim_next_job(), older)
+        self.assertEqual(enrollment.claim_next_job(), newer)
+        self.assertIsNone(enrollment.claim_next_job())
+
+        newer.refresh_from_db()
+        self.assertEqual((newer.status, newer.attempts), (EnrollmentJob.RUNNING, 1))
+
+    def test_job_taken_by_another_worker_is_skipped(self):
+        first = self.create_job('first', run_after=timezone.now() - timedelta(seconds=2))
+        second = self.create_job('second', run_after=timezone.now() - timedelta(seconds=1))
+        raced = []
+
+        def other_worker_claims_first(name):
+            # Runs after this worker listed its candidates and before its first UPDATE.
+            if not raced:
+                raced.append(EnrollmentJob.objects.filter(pk=first.pk).update(status=EnrollmentJob.RUNNING, attempts=1))
+            return F(name)
+
+        with mock.patch('attendance.enrollment.F', side_effect=other_worker_claims_first):
+            claimed = enrollment.claim_next_job()
+
+        self.assertEqual(raced, [1])
+        self.assertEqual(claimed, second)
+        first.refresh_from_db()
+        self.assertEqual(first.attempts, 1)
+
+    def test_retries_back_off_then_fail(self):
+        job = self.create_job('retry')
+        delays = []
+        for attempt in (1, 2):
+            job = enrollment.claim_next_job()
+            self.assertEqual(job.attempts, attempt)
+            before = timezone.now()
+            self.assertEqual(enrollment.retry_or_fail(job, 'Timeout'), 1)
+            job.refresh_from_db()
+            self.assertEqual(job.status, EnrollmentJob.PENDING)
+            delays.append((job.run_after - before).total_seconds())
+            EnrollmentJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertAlmostEqual(delays[0], 30, delta=1)
+        self.assertAlmostEqual(delays[1], 60, delta=1)
+
+        job = enrollment.claim_next_job()
+        enrollment.retry_or_fail(job, 'Timeout')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), (EnrollmentJob.FAILED, 3, 'Timeout'))
+        self.assertEqual((job.face_samples, job.password), ('', ''))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_finished_jobs_keep_neither_samples_nor_password(self):
+        job = self.create_job('done', status=EnrollmentJob.RUNNING, attempts=1)
+        enrollment.finish_job(job, EnrollmentJob.FAILED, 'No face found.')
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.face_samples, job.password), (EnrollmentJob.FAILED, '', ''))
+
+    def test_stale_running_jobs_are_requeued_or_failed(self):
+        long_ago = timezone.now() - timedelta(seconds=601)
+        stale = self.create_job('stale', status=EnrollmentJob.RUNNING, attempts=1, started_at=long_ago)
+        exhausted = self.create_job('exhausted', status=EnrollmentJob.RUNNING, attempts=3, started_at=long_ago)
+        busy = self.create_job('busy', status=EnrollmentJob.RUNNING, attempts=1, started_at=timezone.now())
+
+        self.assertEqual(enrollment.requeue_stale_jobs(), 2)
+
+        for job in (stale, exhausted, busy):
+            job.refresh_from_db()
+        self.assertEqual(stale.status, EnrollmentJob.PENDING)
+        self.assertEqual(exhausted.status, EnrollmentJob.FAILED)
+        self.assertEqual(exhausted.password, '')
+        self.assertEqual(busy.status, EnrollmentJob.RUNNING)
+        self.assertIn('stopped before it finished', stale.last_error)
+
+    def test_stale_job_finished_meanwhile_is_left_alone(self):
+        long_ago = timezone.now() - timedelta(seconds=601)
+        job = self.create_job('late', status=EnrollmentJob.RUNNING, attempts=1, started_at=long_ago)
+        EnrollmentJob.objects.filter(pk=job.pk).update(status=EnrollmentJob.SUCCEEDED)
+
+        self.assertEqual(enrollment.retry_or_fail(job, 'Worker died.', conditional=True), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, EnrollmentJob.SUCCEEDED)
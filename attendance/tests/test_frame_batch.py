@@ -0,0 +1,91 @@
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from attendance.gallery import clear_gallery
+from attendance.models import AttendanceSession, Course, FaceEmbedding, Student
+from attendance.recognition import FrameAnalysis
+from attendance.views import FRAME_STREAM_CONTENT_TYPE
+
+FRAMES = [b'first frame', b'', b'third frame, a little longer']
+
+
+def frame_stream(frames):
+    return b''.join(len(frame).to_bytes(4, 'big') + frame for frame in frames)
+
+
+def no_faces(_analyze, frames, _classroom_mode):
+    return [FrameAnalysis(faces=[], encodings=np.empty((0, 128), dtype=np.float32), error=None) for _ in frames]
+
+
+class FrameBatchTests(TestCase):
+    """The batch formats process_frames accepts, with the inference job stubbed out."""
+
+    def setUp(self):
+        lecturer = User.objects.create_user(username='lecturer', is_staff=True)
+        course = Course.objects.create(course_code='CSC101', course_name='Programming', lecturer=lecturer)
+        student = Student.objects.create(user=User.objects.create_user(username='student'), matric_number='M/1')
+        FaceEmbedding.objects.create(student=student, vector=FaceEmbedding.pack(np.ones(128, dtype=np.float32)))
+        course.enrolled_students.add(student)
+        self.session = AttendanceSession.objects.create(course=course)
+        self.url = reverse('process_frames_api', args=[self.session.id])
+        self.client.force_login(lecturer)
+        clear_gallery()
+        self.addCleanup(clear_gallery)
+        patcher = mock.patch('attendance.inference.run', side_effect=no_faces)
+        self.run_job = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sent_frames(self):
+        return self.run_job.call_args.args[1]
+
+    def test_length_prefixed_stream(self):
+        response = self.client.post(f'{self.url}?mode=classroom', frame_stream(FRAMES), content_type=FRAME_STREAM_CONTENT_TYPE)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sent_frames(), FRAMES)
+        self.assertTrue(self.run_job.call_args.args[2])
+        self.assertEqual([frame['status'] for frame in response.json()['frames']], ['no_face'] * 3)
+
+    def test_multipart_frames(self):
+        uploads = [SimpleUploadedFile(f'{i}.jpg', frame, content_type='image/jpeg') for i, frame in enumerate(FRAMES[::2])]
+
+        response = self.client.post(self.url, {'frames': uploads})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sent_frames(), FRAMES[::2])
+
+    def test_truncated_streams_are_rejected(self):
+        stream = frame_stream(FRAMES)
+        cases = [
+            (stream[:2], 'Truncated frame length prefix.'),
+            (stream + b'\x00\x00', 'Truncated frame length prefix.'),
+            (stream[:-1], 'Frame 2 is truncated.'),
+            ((100).to_bytes(4, 'big') + b'short', 'Frame 0 is truncated.'),
+        ]
+        for body, message in cases:
+            with self.subTest(message=message, size=len(body)):
+                response = self.client.post(self.url, body, content_type=FRAME_STREAM_CONTENT_TYPE)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['message'], message)
+        self.run_job.assert_not_called()
+
+    @override_settings(FACE_BATCH_MAX_FRAMES=2)
+    def test_too_many_frames(self):
+        response = self.client.post(self.url, frame_stream(FRAMES), content_type=FRAME_STREAM_CONTENT_TYPE)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Too many frames', response.json()['message'])
+
+    def test_other_bodies_are_rejected(self):
+        for body, content_type in [('{"frames": []}', 'application/json'), (b'\xff\xd8', 'image/jpeg')]:
+            with self.subTest(content_type=content_type):
+                response = self.client.post(self.url, body, content_type=content_type)
+                self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url, {'mode': 'classroom'})
+        self.assertEqual(response.json()['message'], 'No frames provided.')
+        self.run_job.assert_not_called()
@@ -0,0 +1,93 @@
+import base64
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import JsonResponse
+from django.test import TestCase
+from django.urls import reverse
+
+from attendance.models import AttendanceSession, Course
+
+IMAGE = b'\xff\xd8\xff\xe0 not really a jpeg'
+
+
+class FrameRequestTests(TestCase):
+    """The upload formats process_frame accepts, with recognition itself stubbed out."""
+
+    def setUp(self):
+        lecturer = User.objects.create_user(username='lecturer', is_staff=True)
+        course = Course.objects.create(course_code='CSC101', course_name='Programming', lecturer=lecturer)
+        self.session = AttendanceSession.objects.create(course=course)
+        self.url = reverse('process_frame_api', args=[self.session.id])
+        self.client.force_login(lecturer)
+        patcher = mock.patch('attendance.views.recognise_frame', return_value=JsonResponse({'status': 'no_face'}))
+        self.recognise_frame = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def received(self):
+        """The image bytes and options recognise_frame was called with."""
+        _session, image_bytes, options, _started_at = self.recognise_frame.call_args.args
+        return bytes(image_bytes), options
+
+    def test_json_body(self):
+        body = {'image': 'data:image/jpeg;base64,' + base64.b64encode(IMAGE).decode(), 'mode': 'classroom'}
+
+        response = self.client.post(self.url, json.dumps(body), content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        image_bytes, options = self.received()
+        self.assertEqual(image_bytes, IMAGE)
+        self.assertEqual(options['mode'], 'classroom')
+
+    def test_raw_body(self):
+        response = self.client.post(f'{self.url}?terminal_id=t1', IMAGE, content_type='image/jpeg')
+
+        self.assertEqual(response.status_code, 200)
+        image_bytes, options = self.received()
+        self.assertEqual(image_bytes, IMAGE)
+        self.assertEqual(options['terminal_id'], 't1')
+
+    def test_multipart_body(self):
+        upload = SimpleUploadedFile('frame.jpg', IMAGE, content_type='image/jpeg')
+
+        response = self.client.post(self.url, {'image': upload, 'face_box': '1,2,3,4'})
+
+        self.assertEqual(response.status_code, 200)
+        image_bytes, options = self.received()
+        self.assertEqual(image_bytes, IMAGE)
+        self.assertEqual(options['face_box'], '1,2,3,4')
+
+    def test_bad_bodies_are_rejected(self):
+        cases = [
+            ('not json', 'application/json', 'Invalid JSON data.'),
+            ('[1, 2]', 'application/json', 'The request body must be a JSON object.'),
+            ('"image"', 'application/json', 'The request body must be a JSON object.'),
+            ('{"image": 5}', 'application/json', 'The image must be a base64 data URL string.'),
+            ('{"image": ["data"]}', 'application/json', 'The image must be a base64 data URL string.'),
+            ('{}', 'application/json', 'No image data provided.'),
+            ('{"image": "no data url"}', 'application/json', None),
+            ('{"image": "data:image/jpeg;base64,!!"}', 'application/json', None),
+        ]
+        for body, content_type, message in cases:
+            with self.subTest(body=body):
+                response = self.client.post(self.url, body, content_type=content_type)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['status'], 'error')
+                if message:
+                    self.assertEqual(response.json()['message'], message)
+        self.recognise_frame.assert_not_called()
+
+    def test_empty_raw_body(self):
+        # The test client only sets a content type for non-empty bodies; terminals always send one.
+        response = self.client.post(self.url, b'', content_type='image/jpeg', CONTENT_TYPE='image/jpeg')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'No image data provided.')
+
+    def test_multipart_without_image(self):
+        response = self.client.post(self.url, {'mode': 'classroom'})
+
+        self.assertEqual(response.status_code, 400)
+        self.recognise_frame.assert_not_called()
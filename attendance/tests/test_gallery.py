@@ -0,0 +1,149 @@
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from attendance import gallery
+from attendance.gallery import build_gallery, prune_changes, refresh_gallery
+from attendance.index import ExactIndex
+from attendance.models import FaceEmbedding, GalleryChange, Student
+
+
+class Clock:
+    """Stands in for time.monotonic() in gallery.py; advanced in seconds."""
+
+    def __init__(self, test):
+        self.now = 1000.0
+        patcher = mock.patch('attendance.gallery.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+@override_settings(FACE_INDEX_PATH='')
+class RefreshGalleryTests(TestCase):
+    """Keeping a worker's snapshot in step with the GalleryChange log."""
+
+    def setUp(self):
+        self.clock = Clock(self)
+        self.first = self.create_student(0)
+
+    def create_student(self, axis):
+        """A student whose single encoding is the unit vector along `axis`; saving it logs a change."""
+        student = Student.objects.create(user=User.objects.create_user(username=f'student{axis}'), matric_number=f'M/{axis}')
+        FaceEmbedding.objects.create(student=student, vector=FaceEmbedding.pack(self.encoding(axis)))
+        return student
+
+    def encoding(self, axis):
+        encoding = np.zeros(128, dtype=np.float32)
+        encoding[axis] = 1
+        return encoding
+
+    def in_flight(self, student):
+        """
+        Hides the student's latest change as if its transaction had not committed yet, and
+        returns a function committing it. A later change must exist so the id is not reused.
+        """
+        change_id = GalleryChange.objects.filter(student_id=student.id).latest('id').id
+        GalleryChange.objects.filter(id=change_id).delete()
+        return lambda: GalleryChange.objects.create(id=change_id, student_id=student.id)
+
+    def test_late_commit_below_the_version_is_picked_up(self):
+        snapshot = build_gallery()
+        late = self.create_student(1)
+        on_time = self.create_student(2)
+        commit = self.in_flight(late)
+
+        snapshot = refresh_gallery(snapshot)
+        self.assertEqual(snapshot.match(self.encoding(2))[0], on_time.id)
+        self.assertEqual(snapshot.match(self.encoding(1)), (None, None))
+        self.assertEqual(len(snapshot.missing), 1)
+
+        commit()
+        self.clock.now += gallery.LATE_COMMIT_SECONDS - 1
+        snapshot = refresh_gallery(snapshot)
+
+        self.assertEqual(snapshot.match(self.encoding(1))[0], late.id)
+        self.assertEqual(snapshot.missing, {})
+        self.assertEqual(snapshot.students[late.id].matric_number, 'M/1')
+
+    def test_missing_id_is_given_up_after_late_commit_seconds(self):
+        snapshot = build_gallery()
+        late = self.create_student(1)
+        self.create_student(2)
+        commit = self.in_flight(late)
+        snapshot = refresh_gallery(snapshot)
+
+        self.clock.now += gallery.LATE_COMMIT_SECONDS
+        commit()
+        snapshot = refresh_gallery(snapshot)
+
+        self.assertEqual(snapshot.missing, {})
+        self.assertEqual(snapshot.match(self.encoding(1)), (None, None))
+        # Nothing left to look for, so the next refresh returns the same snapshot.
+        self.assertIs(refresh_gallery(snapshot), snapshot)
+
+    def test_fresh_snapshot_looks_for_ids_missing_below_its_version(self):
+        late = self.create_student(1)
+        self.create_student(2)
+        commit = self.in_flight(late)
+        snapshot = build_gallery()
+        self.assertEqual(len(snapshot.missing), 1)
+
+        # The student's embedding was read when the snapshot was built; the late change reloads it again.
+        commit()
+        with mock.patch('attendance.gallery.load_rows', wraps=gallery.load_rows) as load_rows:
+            snapshot = refresh_gallery(snapshot)
+        self.assertEqual(list(load_rows.call_args.args[0].values_list('id', flat=True)), [late.id])
+        self.assertEqual(snapshot.missing, {})
+
+    def test_too_many_changes_rebuild_the_snapshot(self):
+        snapshot = build_gallery()
+        GalleryChange.log([self.first.id] * 3)
+
+        with mock.patch('attendance.gallery.MAX_INCREMENTAL_CHANGES', 3), \
+                mock.patch('attendance.gallery.build_gallery', wraps=build_gallery) as rebuild:
+            patched = refresh_gallery(snapshot)
+            rebuild.assert_not_called()
+
+            GalleryChange.log([self.first.id] * 4)
+            rebuilt = refresh_gallery(patched)
+            rebuild.assert_called_once_with(None)
+
+        self.assertEqual(rebuilt.version, GalleryChange.objects.latest('id').id)
+        self.assertEqual(rebuilt.match(self.encoding(0))[0], self.first.id)
+
+    def test_prune_keeps_the_newest_change_and_rebuilds_stale_snapshots(self):
+        stale = build_gallery()
+        second = self.create_student(1)
+        GalleryChange.objects.update(created_at=timezone.now() - timedelta(days=8))
+        self.create_student(2)
+        newest = GalleryChange.objects.latest('id').id
+        GalleryChange.objects.update(created_at=timezone.now() - timedelta(days=8))
+
+        self.assertEqual(prune_changes(timezone.now() - timedelta(days=7)), newest - 1)
+        self.assertEqual(list(GalleryChange.objects.values_list('id', flat=True)), [newest])
+
+        with mock.patch('attendance.gallery.build_gallery', wraps=build_gallery) as rebuild:
+            refreshed = refresh_gallery(stale)
+        rebuild.assert_called_once_with(None)
+        self.assertEqual(refreshed.match(self.encoding(1))[0], second.id)
+
+    def test_prune_keeps_changes_a_saved_index_still_needs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.npz')
+            index = ExactIndex().build(*gallery.load_rows(Student.objects.all()))
+            index.version = gallery.latest_version()
+            index.save(path)
+            self.create_student(1)
+            self.create_student(2)
+            GalleryChange.objects.update(created_at=timezone.now() - timedelta(days=8))
+
+            with self.settings(FACE_INDEX_PATH=path):
+                prune_changes(timezone.now())
+
+        self.assertEqual(gallery.oldest_change(), index.version + 1)
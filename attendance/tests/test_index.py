@@ -0,0 +1,102 @@
+import os
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from attendance.index import ExactIndex, IVFIndex, create_index, load_index
+from attendance.management.commands.bench_index import noisy_offsets, synthetic_gallery
+
+
+class IndexTests(SimpleTestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.matrix, self.row_ids, self.centers = synthetic_gallery(self.rng, 200, 5)
+        self.queries = self.centers[:50] + noisy_offsets(self.rng, 50, 0.3)
+
+    def indexes(self):
+        return [ExactIndex().build(self.matrix, self.row_ids), IVFIndex(n_lists=16, n_probe=4).build(self.matrix, self.row_ids)]
+
+    def save_and_load(self, index):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.npz')
+            index.save(path)
+            return load_index(path)
+
+    def test_add_and_remove(self):
+        extra = self.centers[:1] + noisy_offsets(self.rng, 1, 0.01)
+        for index in self.indexes():
+            with self.subTest(backend=index.backend):
+                index.add(extra, [9999])
+                self.assertEqual(len(index), len(self.matrix) + 1)
+                self.assertEqual(index.match(extra, 0.5)[0][0], 9999)
+
+                index.remove([9999, int(self.row_ids[0])])
+                self.assertEqual(len(index), len(self.matrix) - int((self.row_ids == self.row_ids[0]).sum()))
+                student_ids, _ = index.search(self.matrix)
+                self.assertNotIn(9999, student_ids)
+                self.assertNotIn(int(self.row_ids[0]), student_ids)
+
+    def test_copy_leaves_the_original_unchanged(self):
+        for index in self.indexes():
+            with self.subTest(backend=index.backend):
+                clone = index.copy()
+                clone.remove([int(self.row_ids[0])])
+                self.assertEqual(len(index), len(self.matrix))
+                self.assertLess(len(clone), len(index))
+
+    def test_save_and_load_round_trip(self):
+        for index in self.indexes():
+            with self.subTest(backend=index.backend):
+                index.version = 42
+                loaded = self.save_and_load(index)
+
+                self.assertIs(type(loaded), type(index))
+                self.assertEqual(loaded.version, 42)
+                self.assertEqual(len(loaded), len(index))
+                expected_ids, expected_distances = index.search(self.queries)
+                ids, distances = loaded.search(self.queries)
+                np.testing.assert_array_equal(ids, expected_ids)
+                np.testing.assert_allclose(distances, expected_distances, rtol=1e-5)
+
+    def test_loaded_ivf_keeps_its_partitions(self):
+        index = IVFIndex(n_lists=16, n_probe=3).build(self.matrix, self.row_ids)
+        loaded = self.save_and_load(index)
+
+        self.assertEqual(loaded.n_probe, 3)
+        np.testing.assert_array_equal(loaded.centroids, index.centroids)
+
+    def test_ivf_probing_every_partition_matches_exact(self):
+        exact = ExactIndex().build(self.matrix, self.row_ids)
+        ivf = IVFIndex(n_lists=16, n_probe=16).build(self.matrix, self.row_ids)
+
+        expected_ids, expected_distances = exact.search(self.queries)
+        ids, distances = ivf.search(self.queries)
+
+        np.testing.assert_array_equal(ids, expected_ids)
+        np.testing.assert_allclose(distances, expected_distances, rtol=1e-4, atol=1e-5)
+
+    def test_ivf_recall_with_a_few_probes(self):
+        exact_ids, _ = ExactIndex().build(self.matrix, self.row_ids).search(self.queries)
+        ivf_ids, _ = IVFIndex(n_lists=16, n_probe=4).build(self.matrix, self.row_ids).search(self.queries)
+
+        self.assertGreaterEqual(np.mean(ivf_ids == exact_ids), 0.9)
+
+    def test_empty_indexes_find_nobody(self):
+        for index in (ExactIndex(), IVFIndex()):
+            with self.subTest(backend=index.backend):
+                ids, distances = index.search(self.queries[:2])
+                self.assertEqual(list(ids), [-1, -1])
+                self.assertTrue(np.isinf(distances).all())
+                self.assertEqual(index.match(self.queries[:1]), [(None, None)])
+
+    def test_ivf_seeds_its_partitions_from_the_first_add(self):
+        index = IVFIndex(n_lists=4)
+        index.add(self.matrix, self.row_ids)
+
+        self.assertEqual(len(index.centroids), 4)
+        self.assertEqual(len(index), len(self.matrix))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_index('annoy')
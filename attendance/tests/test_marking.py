@@ -0,0 +1,61 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from attendance import marking
+from attendance.checks import check_marking_cache, warn_if_cache_per_process
+
+from .base import StatsTestCase
+
+
+class MarkStudentsTests(StatsTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        marking.forget_session(self.session)
+
+    def test_marks_each_student_once(self):
+        ids = [student.id for student in self.students[:2]]
+
+        marked, status = marking.mark_students(self.session, ids + ids[:1])
+        again, _ = marking.mark_students(self.session, ids)
+
+        self.assertEqual((marked, status), (ids, 'on_time'))
+        self.assertEqual(again, [])
+        self.assertTrue(marking.is_marked(self.session.id, ids[0]))
+        self.assertEqual(self.session.records.count(), 2)
+        self.assertEqual(self.course_counts(self.course), (1, 2, 2))
+        self.assertNoDrift()
+
+    def test_student_claimed_by_another_worker_is_not_marked_again(self):
+        student_id = self.students[0].id
+        cache.add(marking.marked_key(self.session.id, student_id), True)
+
+        marked, _ = marking.mark_students(self.session, [student_id])
+
+        self.assertEqual(marked, [])
+        self.assertFalse(self.session.records.exists())
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    REDIS = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost'}}
+
+    def test_write_behind_needs_a_shared_cache(self):
+        with self.settings(ATTENDANCE_WRITE_BEHIND=True, CACHES=self.LOCMEM):
+            self.assertEqual([warning.id for warning in check_marking_cache(None)], ['attendance.W001'])
+        with self.settings(ATTENDANCE_WRITE_BEHIND=True, CACHES=self.REDIS):
+            self.assertEqual(check_marking_cache(None), [])
+        with self.settings(ATTENDANCE_WRITE_BEHIND=False, CACHES=self.LOCMEM):
+            self.assertEqual(check_marking_cache(None), [])
+
+    def test_several_workers_need_a_shared_cache(self):
+        log = mock.Mock()
+        with self.settings(CACHES=self.LOCMEM):
+            self.assertFalse(warn_if_cache_per_process(1, log))
+            self.assertTrue(warn_if_cache_per_process(4, log))
+        with self.settings(CACHES=self.REDIS):
+            self.assertFalse(warn_if_cache_per_process(4, log))
+        log.warning.assert_called_once()
+        self.assertIn('4 workers', log.warning.call_args.args[0])
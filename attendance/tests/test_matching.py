@@ -0,0 +1,68 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from attendance.management.commands.bench_matching import legacy_find_best_match, random_unit_encodings
+from attendance.matching import FaceMatcher
+from attendance.views import find_best_match
+
+
+class FaceMatcherTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # Students with one to five encodings each, so reduceat groups segments of every length.
+        self.known = {
+            student_id: random_unit_encodings(rng, 1 + student_id % 5).tolist() for student_id in range(1, 41)
+        }
+        # Queries near stored encodings, near nobody, and exactly on a stored one.
+        self.queries = [
+            np.asarray(self.known[student_id][-1]) + rng.standard_normal(128) * 0.02
+            for student_id in (1, 7, 19, 40)
+        ]
+        self.queries += list(random_unit_encodings(rng, 4))
+        self.queries.append(np.asarray(self.known[23][2]))
+
+    def assertSameMatch(self, actual, expected):
+        self.assertEqual(actual[0], expected[0])
+        if expected[1] is None:
+            self.assertIsNone(actual[1])
+        else:
+            self.assertAlmostEqual(actual[1], float(expected[1]), places=4)
+
+    def test_matches_the_per_student_loop(self):
+        matcher = FaceMatcher.from_dict(self.known)
+        for tolerance in (0.3, 0.5, 2.0):
+            for query in self.queries:
+                with self.subTest(tolerance=tolerance):
+                    expected = legacy_find_best_match(self.known, query, tolerance)
+                    self.assertSameMatch(matcher.best_match(query, tolerance), expected)
+                    self.assertSameMatch(find_best_match(self.known, query, tolerance), expected)
+
+    def test_batch_matches_single_queries(self):
+        matcher = FaceMatcher.from_dict(self.known)
+        for batched, query in zip(matcher.match(self.queries, 0.5), self.queries):
+            self.assertSameMatch(batched, matcher.best_match(query, 0.5))
+
+    def test_student_with_several_encodings_takes_the_closest(self):
+        far, near = random_unit_encodings(np.random.default_rng(1), 2)
+        matcher = FaceMatcher.from_dict({5: [far, near], 6: [-near]})
+
+        student_id, distance = matcher.best_match(near)
+
+        self.assertEqual(student_id, 5)
+        self.assertAlmostEqual(distance, 0.0, places=3)
+
+    def test_rows_of_a_student_split_across_the_matrix_are_grouped(self):
+        a, b, c = random_unit_encodings(np.random.default_rng(2), 3)
+        matcher = FaceMatcher(np.stack([a, b, c]), [1, 2, 1])
+
+        self.assertEqual(list(matcher.student_ids), [1, 2])
+        self.assertEqual(matcher.best_match(c)[0], 1)
+
+    def test_empty_gallery_matches_nobody(self):
+        matcher = FaceMatcher.from_dict({})
+        query = random_unit_encodings(np.random.default_rng(3), 1)[0]
+
+        self.assertEqual(len(matcher), 0)
+        self.assertEqual(matcher.best_match(query), (None, None))
+        self.assertEqual(matcher.match([query, query]), [(None, None), (None, None)])
+        self.assertEqual(legacy_find_best_match({}, query), (None, None))
@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+BEFORE = [('attendance', '0010_faceembedding')]
+AFTER = [('attendance', '0012_remove_student_face_encodings_data')]
+
+
+class FaceEncodingMigrationTests(TransactionTestCase):
+    """The move from the JSON face_encodings_data column to packed FaceEmbedding rows, both ways."""
+
+    def setUp(self):
+        self.latest = MigrationExecutor(connection).loader.graph.leaf_nodes('attendance')
+        self.addCleanup(self.migrate, self.latest)
+        rng = np.random.default_rng(0)
+        self.encodings = {
+            'one': rng.standard_normal((1, 128)).tolist(),
+            'several': rng.standard_normal((3, 128)).tolist(),
+        }
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def create_students(self, apps):
+        User = apps.get_model('auth', 'User')
+        Student = apps.get_model('attendance', 'Student')
+        students = {}
+        for name, encodings in self.encodings.items():
+            user = User.objects.create(username=name)
+            students[name] = Student.objects.create(
+                user=user, matric_number=name, face_encodings_data=json.dumps(encodings),
+            ).id
+        user = User.objects.create(username='none')
+        students['none'] = Student.objects.create(user=user, matric_number='none').id
+        return students
+
+    def stored_vectors(self, apps, student_id):
+        FaceEmbedding = apps.get_model('attendance', 'FaceEmbedding')
+        vectors = FaceEmbedding.objects.filter(student_id=student_id).order_by('id').values_list('vector', flat=True)
+        return [np.frombuffer(vector, dtype='<f4') for vector in vectors]
+
+    def test_encodings_survive_the_migration_and_its_reverse(self):
+        students = self.create_students(self.migrate(BEFORE))
+
+        apps = self.migrate(AFTER)
+        for name, encodings in self.encodings.items():
+            vectors = self.stored_vectors(apps, students[name])
+            self.assertEqual(len(vectors), len(encodings))
+            for vector, encoding in zip(vectors, encodings):
+                np.testing.assert_array_equal(vector, np.asarray(encoding, dtype=np.float32))
+        self.assertEqual(self.stored_vectors(apps, students['none']), [])
+
+        apps = self.migrate(BEFORE)
+        Student = apps.get_model('attendance', 'Student')
+        for name, encodings in self.encodings.items():
+            restored = json.loads(Student.objects.get(id=students[name]).face_encodings_data)
+            np.testing.assert_allclose(restored, encodings, rtol=1e-6)
+        self.assertIsNone(Student.objects.get(id=students['none']).face_encodings_data)
+        self.assertFalse(apps.get_model('attendance', 'FaceEmbedding').objects.exists())
+
+        # Migrating forward again gives the same rows, not a second copy.
+        apps = self.migrate(AFTER)
+        self.assertEqual(len(self.stored_vectors(apps, students['several'])), 3)
@@ -0,0 +1,70 @@
+from attendance.models import AttendanceRecord, AttendanceSession, CourseAttendee, StudentMonthlyAttendance
+from attendance.stats import insert_records
+
+from .base import StatsTestCase
+
+
+class StatsTests(StatsTestCase):
+    def test_insert_records_counts_new_records_once(self):
+        inserted = insert_records(self.records(self.session, self.students[:2]))
+
+        self.assertEqual(len(inserted), 2)
+        self.assertEqual(insert_records(self.records(self.session, self.students[:2])), [])
+        self.assertEqual(self.course_counts(self.course), (1, 2, 2))
+        self.assertEqual(self.lecturer_students(), 2)
+        self.assertEqual(self.month_counts(self.students[0], self.course), (1, 1, 0))
+        self.assertNoDrift()
+
+    def test_lecturer_counts_a_student_of_two_courses_once(self):
+        insert_records(self.records(self.session, self.students[:1]))
+        insert_records(self.records(self.other_session, self.students[:2]))
+
+        self.assertEqual(self.lecturer_students(), 2)
+        self.assertNoDrift()
+
+    def test_status_toggle_moves_the_monthly_counts(self):
+        record = AttendanceRecord.objects.create(session=self.session, student=self.students[0], status='on_time')
+        record.status = 'late'
+        record.save()
+
+        self.assertEqual(self.course_counts(self.course), (1, 1, 1))
+        self.assertEqual(self.month_counts(self.students[0], self.course), (1, 0, 1))
+        self.assertNoDrift()
+
+    def test_record_delete(self):
+        insert_records(self.records(self.session, self.students[:2]))
+        AttendanceRecord.objects.get(session=self.session, student=self.students[0]).delete()
+
+        self.assertEqual(self.course_counts(self.course), (1, 1, 1))
+        self.assertEqual(self.lecturer_students(), 1)
+        self.assertFalse(StudentMonthlyAttendance.objects.filter(student=self.students[0]).exists())
+        self.assertNoDrift()
+
+    def test_session_delete(self):
+        insert_records(self.records(self.session, self.students))
+        later = AttendanceSession.objects.create(course=self.course)
+        insert_records(self.records(later, self.students[:1], status='late'))
+        self.session.delete()
+
+        self.assertEqual(self.course_counts(self.course), (1, 1, 1))
+        self.assertEqual(self.month_counts(self.students[0], self.course), (1, 0, 1))
+        self.assertNoDrift()
+
+    def test_course_delete(self):
+        insert_records(self.records(self.session, self.students[:2]))
+        insert_records(self.records(self.other_session, self.students[1:]))
+        self.course.delete()
+
+        self.assertEqual(self.lecturer_students(), 2)
+        self.assertFalse(CourseAttendee.objects.filter(course_id=self.course.id).exists())
+        self.assertNoDrift()
+
+    def test_student_delete(self):
+        insert_records(self.records(self.session, self.students))
+        insert_records(self.records(self.other_session, self.students[:1]))
+        self.students[0].delete()
+
+        self.assertEqual(self.course_counts(self.course), (1, 2, 2))
+        self.assertEqual(self.course_counts(self.other_course), (1, 0, 0))
+        self.assertEqual(self.lecturer_students(), 2)
+        self.assertNoDrift()
@@ -0,0 +1,188 @@
+import json
+from unittest import mock
+
+import dlib
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from attendance import marking
+from attendance.gallery import clear_gallery
+from attendance.models import AttendanceRecord, AttendanceSession, Course, FaceEmbedding, Student
+from attendance.recognition import FrameAnalysis, analyze_frame, iou, no_encodings
+from attendance.tracking import FaceTracker, reusable, terminal_key
+
+BOX = (100, 100, 200, 200)
+TRACK_SETTINGS = dict(
+    FACE_TRACKING=True, FACE_TRACK_TTL_MS=1500, FACE_TRACK_MIN_IOU=0.5,
+    FACE_TRACK_MAX_DISTANCE=0.45, FACE_TRACK_REVERIFY_MS=500,
+)
+
+
+class Clock:
+    """Stands in for time.monotonic() in tracking.py; advanced in milliseconds."""
+
+    def __init__(self, test):
+        self.now = 1000.0
+        patcher = mock.patch('attendance.tracking.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+    def advance(self, ms):
+        self.now += ms / 1000
+
+
+@override_settings(**TRACK_SETTINGS)
+class FaceTrackerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock(self)
+        self.tracker = FaceTracker(max_terminals=2)
+
+    def test_track_needs_two_verifications_within_the_reverify_budget(self):
+        self.tracker.start('t1', BOX, 7, 0.3, False)
+        self.assertFalse(reusable(self.tracker.get('t1')))
+
+        self.clock.advance(200)
+        self.tracker.start('t1', BOX, 7, 0.3, False)
+        track = self.tracker.get('t1')
+        self.assertEqual(track.verifications, 2)
+        self.assertTrue(reusable(track))
+
+        # Following the face keeps the track alive but does not extend the budget.
+        self.clock.advance(499)
+        self.tracker.follow('t1', (105, 100, 205, 200))
+        self.assertTrue(reusable(self.tracker.get('t1')))
+        self.clock.advance(1)
+        track = self.tracker.get('t1')
+        self.assertEqual(track.box, (105, 100, 205, 200))
+        self.assertFalse(reusable(track))
+
+    def test_another_student_resets_the_verifications(self):
+        self.tracker.start('t1', BOX, 7, 0.3, False)
+        self.tracker.start('t1', BOX, 7, 0.3, False)
+        self.tracker.start('t1', BOX, 8, 0.3, False)
+
+        track = self.tracker.get('t1')
+        self.assertEqual((track.student_id, track.verifications), (8, 1))
+        self.assertFalse(reusable(track))
+
+    def test_unconfident_match_drops_the_track(self):
+        self.tracker.start('t1', BOX, 7, 0.3, False)
+        self.tracker.start('t1', BOX, 7, 0.46, False)
+        self.assertIsNone(self.tracker.get('t1'))
+
+        self.tracker.start('t1', BOX, None, None, False)
+        self.assertIsNone(self.tracker.get('t1'))
+
+    def test_track_expires_after_its_ttl(self):
+        self.tracker.start('t1', BOX, 7, 0.3, False)
+        self.clock.advance(1000)
+        self.tracker.follow('t1', BOX)
+        self.clock.advance(1500)
+        self.assertIsNotNone(self.tracker.get('t1'))
+
+        self.clock.advance(1)
+        self.assertIsNone(self.tracker.get('t1'))
+
+    def test_least_recently_seen_terminal_is_dropped(self):
+        for key in ('t1', 't2'):
+            self.tracker.start(key, BOX, 7, 0.3, False)
+        self.tracker.follow('t1', BOX)
+        self.tracker.start('t3', BOX, 7, 0.3, False)
+
+        self.assertIsNone(self.tracker.get('t2'))
+        self.assertIsNotNone(self.tracker.get('t1'))
+
+    def test_only_single_face_frames_with_a_terminal_id_are_tracked(self):
+        session = mock.Mock(id=3)
+        self.assertEqual(terminal_key(session, {'terminal_id': 'door'}), (3, 'door'))
+        self.assertIsNone(terminal_key(session, {}))
+        self.assertIsNone(terminal_key(session, {'terminal_id': 'door', 'mode': 'classroom'}))
+        with self.settings(FACE_TRACKING=False):
+            self.assertIsNone(terminal_key(session, {'terminal_id': 'door'}))
+
+
+class AnalyzeFrameTrackingTests(SimpleTestCase):
+    """analyze_frame skips the descriptor only for a single face overlapping the track."""
+
+    def analyze(self, faces, track_box, classroom=False):
+        models = mock.Mock()
+        models.face_recognizer.compute_face_descriptor.side_effect = lambda _frame, shapes: [np.zeros(128)] * len(shapes)
+        models.shape_predictor.side_effect = lambda _frame, rect: dlib.full_object_detection(rect, [dlib.point(0, 0)] * 5)
+        rects = [dlib.rectangle(*face) for face in faces]
+        models.face_detector.return_value = rects
+        with mock.patch('attendance.recognition.get_models', return_value=models), \
+                mock.patch('attendance.recognition.decode_frame', return_value=np.zeros((480, 640, 3), np.uint8)), \
+                mock.patch('attendance.recognition.detect_faces', return_value=rects):
+            return analyze_frame(b'frame', classroom, None, track_box, 0.5)
+
+    def test_iou(self):
+        self.assertEqual(iou(BOX, BOX), 1.0)
+        self.assertEqual(iou(BOX, (200, 100, 300, 200)), 0.0)
+        self.assertAlmostEqual(iou(BOX, (150, 100, 250, 200)), 1 / 3)
+
+    def test_overlapping_face_is_not_described(self):
+        analysis = self.analyze([(110, 100, 210, 200)], BOX)
+        self.assertTrue(analysis.tracked)
+        self.assertEqual(len(analysis.encodings), 0)
+
+    def test_face_that_moved_away_is_described(self):
+        for faces, track_box, classroom in [
+            ([(160, 100, 260, 200)], BOX, False),
+            ([(110, 100, 210, 200)], None, False),
+            ([BOX, (300, 100, 400, 200)], BOX, True),
+        ]:
+            with self.subTest(faces=faces, track_box=track_box, classroom=classroom):
+                analysis = self.analyze(faces, track_box, classroom)
+                self.assertFalse(analysis.tracked)
+                self.assertEqual(len(analysis.encodings), len(faces))
+
+
+@override_settings(**TRACK_SETTINGS)
+class TrackedFrameViewTests(TestCase):
+    """A terminal's frames through process_frame, with the inference job stubbed out."""
+
+    def setUp(self):
+        lecturer = User.objects.create_user(username='lecturer', is_staff=True)
+        course = Course.objects.create(course_code='CSC101', course_name='Programming', lecturer=lecturer)
+        self.vector = np.zeros(128, dtype=np.float32)
+        self.vector[0] = 1
+        self.student = Student.objects.create(user=User.objects.create_user(username='student'), matric_number='M/1')
+        FaceEmbedding.objects.create(student=self.student, vector=FaceEmbedding.pack(self.vector))
+        course.enrolled_students.add(self.student)
+        self.session = AttendanceSession.objects.create(course=course)
+        self.url = reverse('process_frame_api', args=[self.session.id]) + '?terminal_id=door'
+        self.client.force_login(lecturer)
+        cache.clear()
+        marking.forget_session(self.session)
+        clear_gallery()
+        self.addCleanup(clear_gallery)
+        self.clock = Clock(self)
+        tracker_patcher = mock.patch('attendance.views.face_tracker', FaceTracker(8))
+        tracker_patcher.start()
+        self.addCleanup(tracker_patcher.stop)
+        patcher = mock.patch('attendance.inference.run', side_effect=self.analyze)
+        self.run_job = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def analyze(self, _analyze, _image_bytes, _classroom, _face_hint, track_box, _min_iou):
+        if track_box is not None:
+            return FrameAnalysis([BOX], no_encodings(), None, tracked=True)
+        return FrameAnalysis([BOX], self.vector[np.newaxis], None)
+
+    def send(self):
+        response = self.client.post(self.url, b'frame', content_type='image/jpeg')
+        return response.json()['status'], self.run_job.call_args.args[4]
+
+    def test_identity_is_reused_only_while_confirmed(self):
+        self.assertEqual(self.send(), ('success', None))
+        self.clock.advance(100)
+        self.assertEqual(self.send(), ('already_marked', None))
+        self.clock.advance(100)
+        self.assertEqual(self.send(), ('tracking', BOX))
+        self.clock.advance(400)
+        # 500 ms after the last described frame the next one is described again.
+        self.assertEqual(self.send(), ('already_marked', None))
+        self.assertEqual(AttendanceRecord.objects.filter(session=self.session).count(), 1)
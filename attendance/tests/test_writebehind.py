@@ -0,0 +1,151 @@
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+
+from attendance import marking, writebehind
+from attendance.models import AttendanceRecord
+
+from .base import StatsTestCase
+
+
+class MarkWriteBehindTests(StatsTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        marking.forget_session(self.session)
+
+    def test_write_behind_inserts_on_flush(self):
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir, ignore_errors=True)
+        # Not started, so the records are only inserted when the test flushes them.
+        writebehind._buffer = writebehind.AttendanceBuffer(journal_dir, 3600, 1000)
+        self.addCleanup(setattr, writebehind, '_buffer', None)
+
+        with override_settings(ATTENDANCE_WRITE_BEHIND=True, ATTENDANCE_JOURNAL_DIR=journal_dir):
+            marked, _ = marking.mark_students(self.session, [self.students[0].id])
+
+            self.assertEqual(marked, [self.students[0].id])
+            self.assertFalse(self.session.records.exists())
+            self.assertTrue(writebehind.journal_holds_session(self.session.id))
+            self.assertEqual(writebehind.flush_pending(), 1)
+            self.assertFalse(writebehind.journal_holds_session(self.session.id))
+
+        self.assertEqual(self.session.records.count(), 1)
+        self.assertNoDrift()
+
+
+class JournalReplayTests(StatsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+
+    def abandon(self, records):
+        """Journals `records` as a worker that dies before flushing them would."""
+        buffer = writebehind.AttendanceBuffer(self.journal_dir, 3600, 1000)
+        buffer.submit(records)
+        buffer._segment.file.close()  # Dropping the lock, as the worker's exit would.
+
+    def test_replay_inserts_abandoned_records_once(self):
+        self.abandon(self.records(self.session, self.students[:2], status='late'))
+        self.abandon(self.records(self.session, self.students[1:]))
+
+        self.assertEqual(writebehind.replay_journal(self.journal_dir), 4)
+        self.assertEqual(writebehind.replay_journal(self.journal_dir), 0)
+        self.assertEqual(self.session.records.count(), 3)
+        self.assertEqual(self.course_counts(self.course), (1, 3, 3))
+        self.assertNoDrift()
+
+    def test_replay_leaves_live_segments(self):
+        buffer = writebehind.AttendanceBuffer(self.journal_dir, 3600, 1000)
+        buffer.submit(self.records(self.session, self.students[:1]))
+
+        self.assertEqual(writebehind.replay_journal(self.journal_dir), 0)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.session.records.count(), 1)
+        self.assertNoDrift()
+
+    def test_replay_drops_records_of_deleted_sessions(self):
+        self.abandon(self.records(self.other_session, self.students[:1]))
+        self.other_session.delete()
+
+        self.assertEqual(writebehind.replay_journal(self.journal_dir), 1)
+        self.assertFalse(AttendanceRecord.objects.exists())
+        self.assertNoDrift()
+
+
+class JournalHoldsSessionTests(StatsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+
+    def holds(self, session):
+        return writebehind.journal_holds_session(session.id, self.journal_dir)
+
+    def test_buffer_counts_its_pending_sessions(self):
+        buffer = writebehind.AttendanceBuffer(self.journal_dir, 3600, 1000)
+        buffer.submit(self.records(self.session, self.students[:2]))
+
+        self.assertTrue(buffer.holds_session(self.session.id))
+        self.assertFalse(buffer.holds_session(self.other_session.id))
+        buffer.flush()
+        self.assertFalse(buffer.holds_session(self.session.id))
+
+    def test_live_buffer_of_another_worker_is_found_from_its_session_list(self):
+        buffer = writebehind.AttendanceBuffer(self.journal_dir, 3600, 1000)
+        buffer.submit(self.records(self.session, self.students[:1]))
+        buffer.submit(self.records(self.session, self.students[1:2]) + self.records(self.other_session, self.students[:1]))
+
+        sessions_files = [name for name in os.listdir(self.journal_dir) if name.endswith('.sessions')]
+        self.assertEqual(len(sessions_files), 1)
+        with open(os.path.join(self.journal_dir, sessions_files[0])) as f:
+            self.assertEqual(sorted(f.read().split()), sorted([str(self.session.id), str(self.other_session.id)]))
+        self.assertTrue(self.holds(self.session))
+
+        buffer.flush()
+        self.assertFalse(self.holds(self.session))
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_abandoned_segment_is_found_until_replayed(self):
+        buffer = writebehind.AttendanceBuffer(self.journal_dir, 3600, 1000)
+        buffer.submit(self.records(self.session, self.students[:1]))
+        buffer._segment.file.close()
+
+        self.assertTrue(self.holds(self.session))
+        self.assertFalse(self.holds(self.other_session))
+        writebehind.replay_journal(self.journal_dir)
+        self.assertFalse(self.holds(self.session))
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_session_list_without_its_segment_is_ignored_and_removed(self):
+        with open(os.path.join(self.journal_dir, '1-dead-0.sessions'), 'w') as f:
+            f.write(f'{self.session.id}\n')
+
+        self.assertFalse(self.holds(self.session))
+        writebehind.replay_journal(self.journal_dir)
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_close_session_flushes_this_worker_and_keeps_sessions_buffered_elsewhere(self):
+        self.client.force_login(self.lecturer)
+        other_worker = writebehind.AttendanceBuffer(self.journal_dir, 3600, 1000)
+        other_worker.submit(self.records(self.other_session, self.students[:1]))
+        writebehind._buffer = writebehind.AttendanceBuffer(self.journal_dir, 3600, 1000)
+        self.addCleanup(setattr, writebehind, '_buffer', None)
+        writebehind._buffer.submit(self.records(self.session, self.students[:1]))
+
+        with override_settings(ATTENDANCE_WRITE_BEHIND=True, ATTENDANCE_JOURNAL_DIR=self.journal_dir):
+            for session in (self.session, self.other_session):
+                self.client.get(reverse('close_session', args=[session.id]))
+
+        self.assertEqual(self.session.records.count(), 1)
+        self.assertFalse(writebehind._buffer.holds_session(self.session.id))
+        self.other_session.refresh_from_db()
+        self.assertFalse(self.other_session.is_active)
+        self.assertFalse(self.other_session.records.exists())
+        other_worker.flush()
+        self.assertNoDrift()
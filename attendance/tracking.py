@@ -0,0 +1,105 @@
+"""
+Following a terminal's face across consecutive frames.
+
+A terminal in single-face mode sends frame after frame of the same student, and
+each used to go through detection, landmarks, the 128-d descriptor and gallery
+matching. FaceTracker remembers, per terminal, the box and identity of the last
+face recognised with a distance of at most FACE_TRACK_MAX_DISTANCE. When the next
+frame arrives within FACE_TRACK_TTL_MS and its face overlaps that box by at least
+FACE_TRACK_MIN_IOU, the identity is reused: landmarks, the descriptor and
+matching are skipped, and the track's box narrows detection when the terminal
+sent no face_box hint.
+
+Box overlap alone cannot tell the next student in a queue from the last one
+standing in the same spot, so a track is only reused once a second described
+frame has confirmed its identity, and never for longer than
+FACE_TRACK_REVERIFY_MS after the last described frame. A tracked frame's
+identity is unconfirmed, so its response does not name anyone: it reports
+"tracking" and the terminal sends its next frame, which is described again as
+soon as the budget runs out.
+
+A track only skips work while its student is marked in the session, so a tracked
+frame never records attendance on its own. Terminals identify themselves with
+the "terminal_id" option; frames without one are never tracked. Tracks live in
+the worker's memory: a WebSocket terminal's frames all reach one worker, while
+HTTP frames spread over several workers are tracked by each separately.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+# Terminals one worker tracks; the least recently seen are dropped first.
+MAX_TRACKED_TERMINALS = 1024
+
+# `box` is (left, top, right, bottom); `verified_at` is when a frame was last described and matched,
+# and `verifications` counts the described frames in a row that matched the same student.
+Track = namedtuple('Track', ['student_id', 'distance', 'is_walk_in', 'box', 'seen_at', 'verified_at', 'verifications'])
+
+
+def reusable(track):
+    """Whether the next frame may reuse `track`'s identity instead of being described."""
+    return (track.verifications >= 2
+            and (time.monotonic() - track.verified_at) * 1000 < settings.FACE_TRACK_REVERIFY_MS)
+
+
+def terminal_key(session, options):
+    """Returns the tracker key for a frame, or None if the frame should not be tracked."""
+    terminal_id = options.get('terminal_id')
+    if not settings.FACE_TRACKING or not terminal_id or options.get('mode') == 'classroom':
+        return None
+    return session.id, str(terminal_id)[:64]
+
+
+class FaceTracker:
+    """The current track of each terminal this worker has seen recently."""
+
+    def __init__(self, max_terminals):
+        self.max_terminals = max_terminals
+        self._tracks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the terminal's track, or None if it has none or it expired."""
+        with self._lock:
+            track = self._tracks.get(key)
+            if track is None:
+                return None
+            if (time.monotonic() - track.seen_at) * 1000 > settings.FACE_TRACK_TTL_MS:
+                del self._tracks[key]
+                return None
+            return track
+
+    def start(self, key, box, student_id, distance, is_walk_in):
+        """
+        Records a face just described and matched: confirms the terminal's track if it
+        is the same student, starts a new one otherwise, and drops the track if the
+        match is not confident.
+        """
+        if distance is None or distance > settings.FACE_TRACK_MAX_DISTANCE:
+            self.drop(key)
+            return
+        now = time.monotonic()
+        with self._lock:
+            track = self._tracks.get(key)
+            verifications = track.verifications + 1 if track and track.student_id == student_id else 1
+            self._tracks[key] = Track(student_id, distance, is_walk_in, tuple(box), now, now, verifications)
+            self._tracks.move_to_end(key)
+            while len(self._tracks) > self.max_terminals:
+                self._tracks.popitem(last=False)
+
+    def follow(self, key, box):
+        """Moves a track to the face found in a frame that reused its identity."""
+        with self._lock:
+            track = self._tracks.get(key)
+            if track is not None:
+                self._tracks[key] = track._replace(box=tuple(box), seen_at=time.monotonic())
+                self._tracks.move_to_end(key)
+
+    def drop(self, key):
+        with self._lock:
+            self._tracks.pop(key, None)
+
+
+face_tracker = FaceTracker(MAX_TRACKED_TERMINALS)
@@ -9,6 +9,7 @@ urlpatterns = [
     
     # Registration URLs
     path('register/student/', views.student_registration, name='student_registration'),
+    path('register/student/status/<uuid:job_id>/', views.enrollment_status, name='enrollment_status'),
     path('register/lecturer/', views.lecturer_registration, name='lecturer_registration'),
     
     # Custom Password Reset URLs
@@ -40,5 +41,10 @@ urlpatterns = [
     
     # API Endpoint for Face Recognition
     path('api/process-frame/<int:session_id>/', views.process_frame, name='process_frame_api'),
+    path('api/process-frame-async/<int:session_id>/', views.process_frame_async, name='process_frame_async_api'),
+    path('api/process-frames/<int:session_id>/', views.process_frames, name='process_frames_api'),
+    path('api/enrollment-status/<uuid:job_id>/', views.enrollment_status_api, name='enrollment_status_api'),
+    path('api/inference-stats/', views.inference_stats, name='inference_stats'),
+    path('metrics', views.metrics_view, name='metrics'),
     path('profile/delete/', views.delete_account, name='delete_account'),
 ]
\ No newline at end of file
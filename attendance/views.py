@@ -1,53 +1,45 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import JsonResponse, FileResponse
-from django.db.models import Count, Q
+from django.http import JsonResponse, FileResponse, HttpResponse
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
 from django.views.decorators.csrf import csrf_exempt
-from django.db import transaction
+from django.db import close_old_connections, transaction
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth.hashers import make_password
 from .models import PasswordReset 
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.urls import reverse_lazy, reverse
 from django.template.loader import render_to_string
 from django.core.mail import EmailMessage
 from django.conf import settings
+import asyncio
+import hmac
 import io
 import base64
 import json
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-import cv2
-import os
-import dlib
 import logging
 import numpy as np
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from .models import Student, Course, AttendanceSession, AttendanceRecord, PasswordReset
+from .models import Student, Course, AttendanceSession, AttendanceRecord, PasswordReset, EnrollmentJob, LecturerStats, StudentMonthlyAttendance
+from .enrollment import EnrollmentConflict, create_student_account, encode_samples, enqueue_enrollment
+from .gallery import get_course_gallery, get_gallery, prefetch_course_gallery
+from .inference import InferenceBusy, InferenceTimeout
+from . import inference, metrics
+from .metrics import FrameSpans, observe_frame
+from .marking import attendance_status_for, forget_session, is_marked, record_matches, seed_session
+from .tracking import face_tracker, reusable, terminal_key
+from .matching import FaceMatcher
 from .forms import LoginForm, RegistrationForm, LecturerRegistrationForm, CourseForm, SessionCreationForm, LecturerProfileUpdateForm, StudentProfileUpdateForm
 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-SHAPE_PREDICTOR_PATH = os.path.join(BASE_DIR, 'dlib_models', 'shape_predictor_68_face_landmarks.dat')
-FACE_REC_MODEL_PATH = os.path.join(BASE_DIR, 'dlib_models', 'dlib_face_recognition_resnet_model_v1.dat')
-
-# Initialize dlib models (loading them once is more efficient)
-try:
-    shape_predictor = dlib.shape_predictor(SHAPE_PREDICTOR_PATH)
-    face_recognizer = dlib.face_recognition_model_v1(FACE_REC_MODEL_PATH)
-    face_detector = dlib.get_frontal_face_detector()
-except RuntimeError as e:
-    logger.error(f"Failed to load dlib models: {e}. Please check model paths.")
-    shape_predictor = None
-    face_recognizer = None
-    face_detector = None
-
-
 logger = logging.getLogger(__name__)
 
 
@@ -58,58 +50,6 @@ def is_student(user):
     return not user.is_staff and hasattr(user, 'student')
 
 
-def train_dlib_model_from_samples(face_samples_b64: list) -> str:
-    """
-    Processes a list of base64 encoded images to extract dlib face encodings.
-
-    Args:
-        face_samples_b64: A list of base64 encoded image strings.
-
-    Returns:
-        A JSON string containing a list of 128-d face encodings.
-
-    Raises:
-        ValueError: If dlib models are not loaded or if insufficient valid faces are found.
-    """
-    if not all([face_detector, shape_predictor, face_recognizer]):
-        raise ValueError("Dlib models are not loaded. Check server logs for details.")
-
-    face_encodings = []
-
-    for b64_img in face_samples_b64:
-        try:
-            _format, img_str = b64_img.split(';base64,')
-            image_data = base64.b64decode(img_str)
-            nparr = np.frombuffer(image_data, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-            # dlib works with RGB images, while OpenCV uses BGR
-            rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-            # Detect faces using dlib's detector
-            detected_faces = face_detector(rgb_img, 1)
-
-            if len(detected_faces) != 1:
-                # Skip images that don't have exactly one face
-                print("Skipping image: Found {} faces.".format(len(detected_faces)))
-                continue
-
-            # Get the shape (landmarks) for the detected face
-            shape = shape_predictor(rgb_img, detected_faces[0])
-
-            # Compute the 128-d face encoding
-            encoding = face_recognizer.compute_face_descriptor(rgb_img, shape)
-            face_encodings.append(list(encoding))
-
-        except Exception as e:
-            print(f"Skipping a problematic image sample. Error: {e}")
-            continue
-
-    if len(face_encodings) < 5:  # dlib is robust, so we can require fewer samples
-        raise ValueError(f"Insufficient valid face samples. Found {len(face_encodings)}, need at least 5.")
-
-    return json.dumps(face_encodings)
-    
 def find_best_match(known_encodings_data, unknown_encoding, tolerance=0.5):
     """
     Finds the best student match for a given face encoding.
@@ -123,32 +63,7 @@ def find_best_match(known_encodings_data, unknown_encoding, tolerance=0.5):
     Returns:
         A tuple (student_id, distance) for the best match, or (None, None) if no match is found.
     """
-    best_match_student_id = None
-    min_distance = float('inf')
-
-    # Convert the unknown encoding to a NumPy array for vectorized operations
-    unknown_encoding_np = np.array(unknown_encoding)
-
-    for student_id, encodings_list in known_encodings_data.items():
-        # Convert list of lists to a NumPy array
-        known_encodings_np = np.array(encodings_list)
-
-        # Calculate Euclidean distances between the unknown encoding and all known encodings for this student
-        distances = np.linalg.norm(known_encodings_np - unknown_encoding_np, axis=1)
-
-        # Find the minimum distance for the current student
-        current_min_distance = np.min(distances)
-
-        # Update the best match if this student is a closer match
-        if current_min_distance < min_distance:
-            min_distance = current_min_distance
-            best_match_student_id = student_id
-
-    # If the closest match is within the tolerance, return the student ID
-    if min_distance <= tolerance:
-        return best_match_student_id, min_distance
-
-    return None, None
+    return FaceMatcher.from_dict(known_encodings_data).best_match(unknown_encoding, tolerance)
 
 
 def home(request):
@@ -159,6 +74,9 @@ def home(request):
 def student_registration(request):
     """
     Handles new student registration, generating and storing dlib face encodings.
+
+    With ENROLLMENT_BACKGROUND_JOBS on, the samples are stored as an EnrollmentJob for
+    `manage.py run_enrollment_jobs` and the student is sent to its status page instead.
     """
     if request.user.is_authenticated:
         return redirect('home')
@@ -166,31 +84,32 @@ def student_registration(request):
     if request.method == 'POST':
         form = RegistrationForm(request.POST)
         if form.is_valid():
+            if settings.ENROLLMENT_BACKGROUND_JOBS:
+                job = enqueue_enrollment(form.cleaned_data)
+                return redirect('enrollment_status', job_id=job.job_id)
             try:
-                with transaction.atomic():
-                    user = User.objects.create_user(
-                        username=form.cleaned_data['email'],
-                        email=form.cleaned_data['email'],
-                        password=form.cleaned_data['password'],
-                        first_name=form.cleaned_data['first_name'],
-                        last_name=form.cleaned_data['last_name']
-                    )
-                    
-                    face_samples_b64 = json.loads(form.cleaned_data['face_samples'])
-                    # Call the new dlib training function
-                    encodings_data = train_dlib_model_from_samples(face_samples_b64)
-                    
-                    Student.objects.create(
-                        user=user,
-                        matric_number=form.cleaned_data['matric_number'],
-                        face_encodings_data=encodings_data  # Save to the new field
-                    )
+                face_samples_b64 = json.loads(form.cleaned_data['face_samples'])
+                # Encode before create_student_account opens its transaction so it only spans the writes.
+                encodings, qualities = encode_samples(face_samples_b64)
+                create_student_account(
+                    form.cleaned_data['first_name'],
+                    form.cleaned_data['last_name'],
+                    form.cleaned_data['email'],
+                    form.cleaned_data['matric_number'],
+                    make_password(form.cleaned_data['password']),
+                    encodings,
+                    qualities,
+                )
                 
                 messages.success(request, 'Student account created successfully! You can now log in.')
                 return redirect('login')
 
             except ValueError as ve:
                 messages.error(request, f"Face recognition setup failed: {ve}. Please try again, ensuring your face is clear and well-lit.")
+            except EnrollmentConflict as e:
+                messages.error(request, str(e))
+            except (InferenceBusy, InferenceTimeout):
+                messages.error(request, 'The server is busy processing other registrations. Please try again in a moment.')
             except Exception as e:
                 logger.error(f"An unexpected error occurred during student registration: {e}")
                 messages.error(request, 'An unexpected server error occurred. Please try again.')
@@ -201,6 +120,32 @@ def student_registration(request):
     return render(request, 'attendance/registration.html', {'form': form})
 
 
+def enrollment_status(request, job_id):
+    """Shows a queued registration while it is processed; the page polls enrollment_status_api."""
+    job = get_object_or_404(EnrollmentJob, job_id=job_id)
+    return render(request, 'attendance/enrollment_status.html', {'job': job})
+
+
+def enrollment_status_api(request, job_id):
+    """
+    Reports the state of a queued registration.
+
+    The unguessable job_id is the only credential, so the response carries no
+    personal details beyond the outcome.
+    """
+    job = get_object_or_404(EnrollmentJob, job_id=job_id)
+    data = {'status': job.status, 'attempts': job.attempts}
+    if job.status == EnrollmentJob.SUCCEEDED:
+        data['message'] = 'Student account created successfully! You can now log in.'
+        data['login_url'] = reverse('login')
+    elif job.status == EnrollmentJob.FAILED:
+        data['message'] = job.last_error or 'Registration failed. Please try again.'
+        data['register_url'] = reverse('student_registration')
+    elif job.last_error:
+        data['message'] = 'Your registration hit a temporary problem and will be retried shortly.'
+    return JsonResponse(data)
+
+
 def login_user(request):
     """Handles user login and redirects based on role (student or lecturer)."""
     if request.user.is_authenticated:
@@ -255,19 +200,26 @@ def student_dashboard(request):
         return redirect('lecturer_dashboard')
 
     student = get_object_or_404(Student, user=request.user)
-    
+
+    # Totals and the calendar come from the monthly summaries kept by attendance/stats.py.
+    today = timezone.localdate()
+    summaries = StudentMonthlyAttendance.objects.filter(student=student)
+    total_attended = summaries.aggregate(total=Sum('record_count'))['total'] or 0
+    this_month = list(summaries.filter(year=today.year, month=today.month))
+    attended_days_set = set().union(*(summary.days() for summary in this_month))
 
     records = AttendanceRecord.objects.filter(student=student).select_related(
         'session__course'
     ).order_by('-session__created_at')
+    paginator = Paginator(records, 20)
+    page_number = request.GET.get('page')
+    try:
+        records = paginator.page(page_number)
+    except PageNotAnInteger:
+        records = paginator.page(1)
+    except EmptyPage:
+        records = paginator.page(paginator.num_pages)
 
-
-    today = timezone.now()
-    attendance_dates_this_month = records.filter(
-        session__created_at__year=today.year,
-        session__created_at__month=today.month
-    ).values_list('session__created_at__day', flat=True)
-    
     import calendar
     cal = calendar.Calendar()
     month_days = cal.itermonthdates(today.year, today.month)
@@ -278,10 +230,11 @@ def student_dashboard(request):
     context = {
         'student': student,
         'records': records,
-        'attendance_this_month': len(attendance_dates_this_month),
-        'attended_days_set': set(attendance_dates_this_month),
+        'total_attended': total_attended,
+        'attendance_this_month': sum(summary.record_count for summary in this_month),
+        'attended_days_set': attended_days_set,
         'month_days': month_days,
-        'today': today.date(),
+        'today': today,
         'day_headers': day_headers,
     }
     
@@ -331,20 +284,17 @@ def add_course(request):
 @login_required
 @user_passes_test(is_lecturer)
 def lecturer_dashboard(request):
-    # Fetch courses with annotations for student and session counts
-    courses = Course.objects.filter(lecturer=request.user).annotate(
-        student_count=Count('attendancesession__records__student', distinct=True),  # Traverse relations: course <- session <- record -> student
-        session_count=Count('attendancesession')  # Direct reverse relation to sessions (distinct not needed here)
-    ).order_by('course_code')
+    # Counts come from the denormalized stats rows kept by attendance/stats.py.
+    courses = list(Course.objects.filter(lecturer=request.user).annotate(
+        student_count=Coalesce('stats__student_count', 0),
+        session_count=Coalesce('stats__session_count', 0),
+    ).order_by('course_code'))
 
     # Aggregate totals
-    total_courses = courses.count()
-    total_sessions = AttendanceSession.objects.filter(course__lecturer=request.user).count()
-    total_students = Student.objects.filter(
-        records__session__course__lecturer=request.user, 
-        user__is_staff=False
-    ).distinct().count()
-
+    total_courses = len(courses)
+    total_sessions = sum(course.session_count for course in courses)
+    lecturer_stats = LecturerStats.objects.filter(lecturer=request.user).first()
+    total_students = lecturer_stats.student_count if lecturer_stats else 0
 
     context = {
         'courses': courses,
@@ -412,6 +362,9 @@ def create_session(request, course_id):
                 end_time=end_time,
                 is_active=True
             )
+            # Load the class's face gallery now so the terminal's first frame doesn't wait for it.
+            prefetch_course_gallery(course.id)
+            seed_session(session)
         
             return redirect('attendance_terminal', session_id=session.id)
     else:
@@ -435,6 +388,8 @@ def attendance_terminal(request, session_id):
         'session': session,
         'course': session.course,
         'session_id': session_id,
+        # Classroom mode scans the whole room and marks every recognised face per frame.
+        'classroom_mode': request.GET.get('mode') == 'classroom',
     }
     return render(request, 'attendance/terminal.html', context)
 
@@ -474,6 +429,12 @@ def session_detail(request, session_id):
 @login_required
 @user_passes_test(is_lecturer)
 def export_session_pdf(request, session_id):
+    # reportlab is only needed here, so it is not imported with the rest of the views.
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+
     session = get_object_or_404(AttendanceSession, id=session_id, course__lecturer=request.user)
     records = AttendanceRecord.objects.filter(session=session).select_related('student__user').order_by('status', 'student__user__last_name')
 
@@ -515,100 +476,585 @@ def export_session_pdf(request, session_id):
     buffer.seek(0)
     return FileResponse(buffer, as_attachment=True, filename=f'attendance_{session.course.course_code}_{session.id}.pdf')
 
+RAW_IMAGE_CONTENT_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'application/octet-stream')
+
+
+def read_frame_request(request):
+    """
+    Extracts the encoded image and recognition options from a frame upload.
+
+    Three request formats are accepted:
+      * A raw image body (Content-Type image/jpeg, image/png, image/webp or
+        application/octet-stream), with options in the query string.
+      * multipart/form-data with the image in an "image" file field and options
+        as form fields.
+      * The original JSON body {"image": "data:image/jpeg;base64,...", ...}.
+
+    Returns:
+        A tuple (image_bytes, options). For raw and multipart uploads image_bytes
+        is the request buffer itself rather than a copy.
+
+    Raises:
+        ValueError: If no image is present, or a JSON body is not an object with an image string.
+        json.JSONDecodeError: If a JSON body cannot be parsed.
+    """
+    content_type = request.content_type
+    if content_type in RAW_IMAGE_CONTENT_TYPES:
+        image_bytes = request.body
+        options = request.GET
+    elif content_type == 'multipart/form-data':
+        upload = request.FILES.get('image')
+        image_bytes = upload.read() if upload else None
+        options = request.POST
+    else:
+        options = json.loads(request.body)
+        if not isinstance(options, dict):
+            raise ValueError('The request body must be a JSON object.')
+        image_b64 = options.get('image')
+        if not image_b64:
+            raise ValueError('No image data provided.')
+        if not isinstance(image_b64, str):
+            raise ValueError('The image must be a base64 data URL string.')
+        _format, img_str = image_b64.split(';base64,')
+        image_bytes = base64.b64decode(img_str)
+
+    if not image_bytes:
+        raise ValueError('No image data provided.')
+    return image_bytes, options
+
+
+def match_encodings(gallery, encodings, walk_in_fallback):
+    """
+    Matches a batch of encodings against a course gallery.
+
+    Returns:
+        A list with one (student_id, distance, is_walk_in) tuple per encoding; unmatched
+        encodings get (None, None, False).
+    """
+    matches = [(student_id, distance, False) for student_id, distance in gallery.match_many(encodings)]
+    unmatched = [i for i, (student_id, _, _) in enumerate(matches) if student_id is None]
+    if unmatched and walk_in_fallback:
+        for i, (student_id, distance) in zip(unmatched, get_gallery().match_many(encodings[unmatched])):
+            matches[i] = (student_id, distance, student_id is not None)
+    return matches
+
+
+def face_box(face):
+    left, top, right, bottom = face
+    return {'left': left, 'top': top, 'right': right, 'bottom': bottom}
+
+
+def process_classroom_frame(session, gallery, analysis, walk_in_fallback, started_at, spans):
+    """
+    Recognises every face in a classroom frame and marks all recognised students at once.
+
+    Descriptors for all faces come from one batched compute_face_descriptor call, they are
+    matched in one vectorised query, and new attendance records go in with one bulk insert.
+    """
+    detected_faces = analysis.faces
+    with spans.time('match'):
+        matches = match_encodings(gallery, analysis.encodings, walk_in_fallback)
+
+    with spans.time('mark'):
+        results, marked_ids, status = record_matches(session, matches, gallery)
+    faces = [{'box': face_box(face), **result} for face, result in zip(detected_faces, results)]
+
+    elapsed = time.perf_counter() - started_at
+    students_per_second = len(marked_ids) / elapsed if elapsed > 0 else 0.0
+    logger.info(
+        f"Classroom frame for session {session.id}: {len(detected_faces)} faces, {len(marked_ids)} marked "
+        f"in {elapsed * 1000:.0f} ms ({students_per_second:.1f} students/s)."
+    )
+
+    recognised = any(face['status'] != 'not_recognized' for face in faces)
+    return JsonResponse({
+        'status': 'success' if recognised else 'error',
+        'mode': 'classroom',
+        'message': f"{len(marked_ids)} student(s) marked as '{status.replace('_', ' ').title()}'." if recognised
+                   else 'Verification failed. No face recognized.',
+        'faces': faces,
+        'faces_detected': len(detected_faces),
+        'marked_count': len(marked_ids),
+        'timestamp': timezone.now().strftime('%I:%M %p'),
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'students_per_second': round(students_per_second, 2),
+    }, status=200 if recognised else 401)
+
+
+def busy_response(status=503):
+    """Tells the terminal to hold still and send another frame shortly."""
+    response = JsonResponse({'status': 'busy', 'message': 'The server is busy. Please hold still.', 'retry_after': 1}, status=status)
+    response['Retry-After'] = '1'
+    return response
+
+
+def inference_unavailable_response(error):
+    """Turns a full or slow inference pool into a response the terminal can retry."""
+    if isinstance(error, InferenceBusy):
+        return busy_response()
+    return JsonResponse({'status': 'error', 'message': 'Face recognition timed out. Please try again.'}, status=504)
+
+
+def recognise_frame(session, image_bytes, options, started_at, gallery=None, spans=None):
+    """
+    Recognises the face(s) in one frame and marks attendance for `session`.
+
+    Shared by process_frame, process_frame_async and the terminal WebSocket.
+
+    Args:
+        session (AttendanceSession): An active session.
+        image_bytes (bytes): The encoded frame.
+        options (dict-like): Request options such as "mode", "face_box" and "terminal_id".
+        started_at (float): time.perf_counter() when the request arrived.
+        gallery (Gallery): The course gallery to match against, if the caller holds one;
+            otherwise this worker's cached course gallery is used.
+        spans (FrameSpans): Collects the time spent in each stage, for metrics.py.
+
+    Returns:
+        The JsonResponse to send.
+    """
+    spans = spans if spans is not None else FrameSpans()
+    try:
+        classroom_mode = options.get('mode') == 'classroom'
+
+        # --- Encodings of the course's enrolled students from this worker's cache ---
+        if gallery is None:
+            gallery = get_course_gallery(session.course_id)
+        walk_in_fallback = settings.FACE_GALLERY_WALK_IN_FALLBACK
+
+        if gallery.is_empty and not (walk_in_fallback and not get_gallery().is_empty):
+             return JsonResponse({'status': 'error', 'message': 'No registered face data for students in this course.'}, status=404)
+
+
+        # --- The terminal's current face track, if its identity can be reused (see tracking.py) ---
+        track_key = terminal_key(session, options)
+        track = face_tracker.get(track_key) if track_key else None
+        track_box = None
+        if track and reusable(track) and is_marked(session.id, track.student_id):
+            track_box = track.box
+        face_hint = options.get('face_box') or (track.box if track else None)
+
+        # --- Image Decoding, Face Detection and Encoding (in the inference pool) ---
+        # Imported here so OpenCV and dlib are only loaded by processes that recognise faces.
+        from .recognition import analyze_frame
+        inference_started = time.perf_counter()
+        analysis = inference.run(
+            analyze_frame, image_bytes, classroom_mode, face_hint, track_box, settings.FACE_TRACK_MIN_IOU,
+        )
+        spans.add_inference([analysis], time.perf_counter() - inference_started)
+        if analysis.error:
+            return JsonResponse({'status': 'error', 'message': analysis.error}, status=400)
+
+        if len(analysis.faces) == 0:
+            if track_key:
+                face_tracker.drop(track_key)
+            return JsonResponse({'status': 'no_face', 'message': 'No face detected.'})
+
+        if classroom_mode:
+            return process_classroom_frame(session, gallery, analysis, walk_in_fallback, started_at, spans)
+        
+        if len(analysis.faces) > 1:
+            if track_key:
+                face_tracker.drop(track_key)
+            return JsonResponse({'status': 'error', 'message': 'Multiple faces detected. Please ensure only one person is in the frame.'}, status=400)
+
+        # --- Face Recognition Logic ---
+        if analysis.tracked:
+            # Same face as the track's last frame, whose student is already marked. The identity
+            # is not re-confirmed, so the response names no one; a later frame is described again.
+            face_tracker.follow(track_key, analysis.faces[0])
+            return JsonResponse({'status': 'tracking', 'message': 'Hold still...'})
+
+        unknown_encoding = analysis.encodings[0]
+
+        with spans.time('match'):
+            student_id, distance = gallery.match(unknown_encoding)
+            is_walk_in = False
+            if student_id is None and walk_in_fallback:
+                # Not enrolled in this course, but a registered student may still attend.
+                student_id, distance = get_gallery().match(unknown_encoding)
+                is_walk_in = student_id is not None
+
+        if track_key:
+            if track and track.student_id != student_id:
+                logger.info(f"Track of terminal {track_key[1]} in session {session.id} changed identity on re-verification.")
+            face_tracker.start(track_key, analysis.faces[0], student_id, distance, is_walk_in)
+
+        if student_id:
+            # Name and matric number come from the gallery; marking a repeat recognition needs no query.
+            with spans.time('mark'):
+                results, marked_ids, status = record_matches(session, [(student_id, distance, is_walk_in)], gallery)
+            result = results[0]
+
+            if result['status'] == 'already_marked':
+                return JsonResponse({
+                    'status': 'already_marked',
+                    'message': 'You have already been marked for this session.',
+                    'student_name': result['student_name'],
+                })
+
+            if result['status'] == 'success':
+                return JsonResponse({
+                    'status': 'success',
+                    'student_name': result['student_name'],
+                    'matric_number': result['matric_number'],
+                    'timestamp': timezone.now().strftime('%I:%M %p'),
+                    'walk_in': is_walk_in,
+                    'message': f"Attendance marked as '{status.replace('_', ' ').title()}'."
+                })
+
+        # No match, or the matched student was deleted since the gallery was loaded.
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Verification failed. Face not recognized.'
+        }, status=401)
+
+    except (InferenceBusy, InferenceTimeout) as e:
+        return inference_unavailable_response(e)
+    except Exception as e:
+        logger.error(f"Error processing frame for session {session.id}: {e}")
+        return JsonResponse({'status': 'error', 'message': f'An internal server error occurred: {e}'}, status=500)
+
+
 @csrf_exempt
 @user_passes_test(is_lecturer)
 def process_frame(request, session_id):
     """
     Processes a video frame for face recognition using dlib and marks attendance.
+
+    By default the frame must contain exactly one face. Posting "mode": "classroom"
+    recognises and marks every face in the frame instead (see process_classroom_frame).
+    The image may be sent raw, as multipart or as base64 JSON (see read_frame_request).
+    An optional "face_box" option hints where the face is (see detect_faces), and an
+    optional "terminal_id" lets consecutive frames of one face skip re-embedding
+    (see tracking.py).
     """
+    started_at = time.perf_counter()
     session = get_object_or_404(AttendanceSession, id=session_id, course__lecturer=request.user)
     if not session.is_active:
         return JsonResponse({'status': 'error', 'message': 'This session is closed.'}, status=400)
 
     if request.method == 'POST':
+        spans = FrameSpans()
         try:
-            data = json.loads(request.body)
-            image_b64 = data.get('image')
-            if not image_b64:
-                return JsonResponse({'status': 'error', 'message': 'No image data provided.'}, status=400)
+            with spans.time('request_decode'):
+                image_bytes, options = read_frame_request(request)
+        except json.JSONDecodeError:
+            response = JsonResponse({'status': 'error', 'message': 'Invalid JSON data.'}, status=400)
+        except ValueError as ve:
+            response = JsonResponse({'status': 'error', 'message': str(ve)}, status=400)
+        else:
+            response = recognise_frame(session, image_bytes, options, started_at, spans=spans)
+        observe_frame(session.id, response, spans, started_at)
+        return response
 
-            # --- Pre-load student encodings (ideally cache this) ---
-            enrolled_students = Student.objects.select_related('user').all()
-            
-            """
-            enrolled_students = session.course.enrolled_students.select_related('user').all()
-            """
-            known_encodings_data = {}
-            for student in enrolled_students:
-                if student.face_encodings_data:
-                    known_encodings_data[student.id] = json.loads(student.face_encodings_data)
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=405)
 
-            if not known_encodings_data:
-                 return JsonResponse({'status': 'error', 'message': 'No registered face data for students in this course.'}, status=404)
 
+# Frames admitted to process_frame_async wait for one of these threads; the semaphore
+# caps how many may be queued or running before new ones are turned away.
+_async_frame_executor = ThreadPoolExecutor(max_workers=settings.FACE_ASYNC_WORKERS, thread_name_prefix='frame')
+_async_frame_slots = threading.BoundedSemaphore(settings.FACE_ASYNC_MAX_IN_FLIGHT)
 
-            # --- Image Decoding and Face Detection ---
-            _format, img_str = image_b64.split(';base64,')
-            image_data = base64.b64decode(img_str)
-            nparr = np.frombuffer(image_data, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
-            detected_faces = face_detector(rgb_frame, 1)
+def frame_age_ms(captured_at, received_at):
+    """
+    Returns how old a frame is, in milliseconds.
 
-            if len(detected_faces) == 0:
-                return JsonResponse({'status': 'no_face', 'message': 'No face detected.'})
-            
-            if len(detected_faces) > 1:
-                return JsonResponse({'status': 'error', 'message': 'Multiple faces detected. Please ensure only one person is in the frame.'}, status=400)
+    Args:
+        captured_at: The terminal's capture time in milliseconds since the epoch, or None.
+            It is only trusted up to the moment the request arrived, so a terminal clock
+            running fast cannot make frames look fresher than the server saw them.
+        received_at (float): time.time() when the request arrived.
+    """
+    captured = received_at
+    if captured_at is not None:
+        try:
+            captured = min(float(captured_at) / 1000, received_at)
+        except (TypeError, ValueError):
+            pass
+    return (time.time() - captured) * 1000
 
-            # --- Face Recognition Logic ---
-            shape = shape_predictor(rgb_frame, detected_faces[0])
-            unknown_encoding = face_recognizer.compute_face_descriptor(rgb_frame, shape)
 
-            student_id, distance = find_best_match(known_encodings_data, unknown_encoding)
+def stale_frame_response(age_ms):
+    return JsonResponse({
+        'status': 'stale',
+        'message': f'Frame dropped after {age_ms:.0f} ms. Please hold still.',
+        'retry_after': 0,
+    })
 
-            if student_id:
-                student = get_object_or_404(Student, id=student_id)
-                
-                # Check if already marked
-                if AttendanceRecord.objects.filter(session=session, student=student).exists():
-                    return JsonResponse({
-                        'status': 'already_marked',
-                        'message': 'You have already been marked for this session.',
-                        'student_name': student.user.get_full_name(),
-                    })
-
-                # Determine attendance status (on_time or late)
-                status = 'on_time'
-                grace_period = session.start_time + timedelta(minutes=15) # 15-minute grace period
-                if timezone.now() > grace_period:
-                    status = 'late'
-                    
-                # Create attendance record
-                AttendanceRecord.objects.create(session=session, student=student, status=status)
-                
-                return JsonResponse({
-                    'status': 'success',
-                    'student_name': student.user.get_full_name(),
-                    'matric_number': student.matric_number,
-                    'timestamp': timezone.now().strftime('%I:%M %p'),
-                    'message': f"Attendance marked as '{status.replace('_', ' ').title()}'."
+
+def run_frame_job(session, image_bytes, options, captured_at, received_at, started_at, gallery=None, spans=None):
+    """Runs recognise_frame in an executor thread, unless the frame went stale while it waited."""
+    age_ms = frame_age_ms(captured_at, received_at)
+    if settings.FACE_FRAME_MAX_AGE_MS and age_ms > settings.FACE_FRAME_MAX_AGE_MS:
+        logger.info(f"Dropped a {age_ms:.0f} ms old frame for session {session.id}.")
+        return stale_frame_response(age_ms)
+
+    # Executor threads live outside Django's request cycle, so manage their connections here.
+    close_old_connections()
+    try:
+        return recognise_frame(session, image_bytes, options, started_at, gallery, spans)
+    finally:
+        close_old_connections()
+
+
+async def admit_frame(session, image_bytes, options, captured_at, received_at, started_at, gallery=None, spans=None):
+    """
+    Recognises a frame on the bounded executor, or turns it away if it is stale or the executor is full.
+
+    Used by process_frame_async and the terminal WebSocket (see websocket.py).
+
+    Returns:
+        The JsonResponse for the frame.
+    """
+    age_ms = frame_age_ms(captured_at, received_at)
+    if settings.FACE_FRAME_MAX_AGE_MS and age_ms > settings.FACE_FRAME_MAX_AGE_MS:
+        return stale_frame_response(age_ms)
+
+    if not _async_frame_slots.acquire(blocking=False):
+        logger.warning(f"Frame for session {session.id} rejected: {settings.FACE_ASYNC_MAX_IN_FLIGHT} frames already in flight.")
+        return busy_response(status=429)
+    try:
+        future = _async_frame_executor.submit(
+            run_frame_job, session, image_bytes, options, captured_at, received_at, started_at, gallery, spans,
+        )
+    except Exception:
+        _async_frame_slots.release()
+        raise
+    # Free the slot when the thread is done, even if the client has disconnected by then.
+    future.add_done_callback(lambda _: _async_frame_slots.release())
+    return await asyncio.wrap_future(future)
+
+
+@csrf_exempt
+@user_passes_test(is_lecturer)
+async def process_frame_async(request, session_id):
+    """
+    Async form of process_frame with admission control, for serving under ASGI.
+
+    Recognition runs in a bounded thread pool (settings.FACE_ASYNC_WORKERS), so the event
+    loop stays free to answer other terminals. Once settings.FACE_ASYNC_MAX_IN_FLIGHT frames
+    are queued or running, further frames get an immediate 429 with Retry-After instead of
+    waiting. Frames older than settings.FACE_FRAME_MAX_AGE_MS, measured from the optional
+    "captured_at" option or X-Capture-Timestamp header (ms since the epoch), are dropped
+    with status "stale" both on arrival and when they reach a worker, so latency stays
+    bounded under overload.
+
+    Accepts the same request formats and options as process_frame.
+    """
+    received_at = time.time()
+    started_at = time.perf_counter()
+    user = await request.auser()
+    session = await aget_object_or_404(AttendanceSession, id=session_id, course__lecturer=user)
+    if not session.is_active:
+        return JsonResponse({'status': 'error', 'message': 'This session is closed.'}, status=400)
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=405)
+
+    spans = FrameSpans()
+    try:
+        with spans.time('request_decode'):
+            image_bytes, options = read_frame_request(request)
+    except json.JSONDecodeError:
+        response = JsonResponse({'status': 'error', 'message': 'Invalid JSON data.'}, status=400)
+    except ValueError as ve:
+        response = JsonResponse({'status': 'error', 'message': str(ve)}, status=400)
+    else:
+        captured_at = options.get('captured_at') or request.headers.get('X-Capture-Timestamp')
+        response = await admit_frame(session, image_bytes, options, captured_at, received_at, started_at, spans=spans)
+    observe_frame(session.id, response, spans, started_at)
+    return response
+
+
+FRAME_STREAM_CONTENT_TYPE = 'application/x-frame-stream'
+FRAME_LENGTH_PREFIX_BYTES = 4
+
+
+def read_frame_batch(request):
+    """
+    Extracts several encoded images and the recognition options from a batch upload.
+
+    Two request formats are accepted:
+      * multipart/form-data with one "frames" file field per image, in capture order,
+        and options as form fields.
+      * A length-prefixed stream (Content-Type application/x-frame-stream): each image
+        preceded by its size as a 4-byte big-endian unsigned integer, with options in
+        the query string.
+
+    Returns:
+        A tuple (frames, options) where frames is a list of bytes-like objects.
+
+    Raises:
+        ValueError: If the body is malformed, empty or has too many frames.
+    """
+    if request.content_type == FRAME_STREAM_CONTENT_TYPE:
+        body = memoryview(request.body)
+        frames = []
+        offset = 0
+        while offset < len(body):
+            if offset + FRAME_LENGTH_PREFIX_BYTES > len(body):
+                raise ValueError('Truncated frame length prefix.')
+            length = int.from_bytes(body[offset:offset + FRAME_LENGTH_PREFIX_BYTES], 'big')
+            offset += FRAME_LENGTH_PREFIX_BYTES
+            if offset + length > len(body):
+                raise ValueError(f'Frame {len(frames)} is truncated.')
+            frames.append(body[offset:offset + length])
+            offset += length
+        options = request.GET
+    elif request.content_type == 'multipart/form-data':
+        frames = [upload.read() for upload in request.FILES.getlist('frames')]
+        options = request.POST
+    else:
+        raise ValueError(f'Send frames as multipart/form-data or {FRAME_STREAM_CONTENT_TYPE}.')
+
+    if not frames:
+        raise ValueError('No frames provided.')
+    if len(frames) > settings.FACE_BATCH_MAX_FRAMES:
+        raise ValueError(f'Too many frames: {len(frames)} sent, at most {settings.FACE_BATCH_MAX_FRAMES} accepted.')
+    return frames, options
+
+
+@csrf_exempt
+@user_passes_test(is_lecturer)
+def process_frames(request, session_id):
+    """
+    Processes a batch of video frames in one request and marks attendance.
+
+    Meant for terminals on unreliable networks that buffer frames and send them together.
+    The batch is one inference job (see recognition.analyze_frames); its descriptors are
+    matched in one query and recorded with one bulk insert.
+    A student seen in several frames is marked once; the later frames report
+    'already_marked'.
+
+    As in process_frame, each frame must contain exactly one face unless "mode" is
+    "classroom", in which case every face in every frame is recognised.
+
+    Returns:
+        JSON with a "frames" list holding one result per submitted frame, in order.
+    """
+    started_at = time.perf_counter()
+    session = get_object_or_404(AttendanceSession, id=session_id, course__lecturer=request.user)
+    if not session.is_active:
+        return JsonResponse({'status': 'error', 'message': 'This session is closed.'}, status=400)
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=405)
+
+    spans = FrameSpans()
+    response = recognise_frame_batch(request, session, started_at, spans)
+    # One observation for the whole batch; its stage times are summed over the frames.
+    observe_frame(session.id, response, spans, started_at)
+    return response
+
+
+def recognise_frame_batch(request, session, started_at, spans):
+    """Does the work of process_frames and returns its response; see process_frames."""
+    try:
+        try:
+            with spans.time('request_decode'):
+                frames, options = read_frame_batch(request)
+        except ValueError as ve:
+            return JsonResponse({'status': 'error', 'message': str(ve)}, status=400)
+        classroom_mode = options.get('mode') == 'classroom'
+
+        gallery = get_course_gallery(session.course_id)
+        walk_in_fallback = settings.FACE_GALLERY_WALK_IN_FALLBACK
+        if gallery.is_empty and not (walk_in_fallback and not get_gallery().is_empty):
+            return JsonResponse({'status': 'error', 'message': 'No registered face data for students in this course.'}, status=404)
+
+        # --- One pool job for the whole batch: detection per frame, one batched descriptor call ---
+        from .recognition import analyze_frames
+        inference_started = time.perf_counter()
+        analyses = inference.run(analyze_frames, [bytes(frame) for frame in frames], classroom_mode)
+        spans.add_inference(analyses, time.perf_counter() - inference_started)
+
+        frame_results = []
+        batch_faces = []  # (frame index, face box) for every described face, in encoding order
+        for index, analysis in enumerate(analyses):
+            if analysis.error:
+                frame_results.append({'index': index, 'status': 'error', 'message': analysis.error})
+            elif len(analysis.faces) == 0:
+                frame_results.append({'index': index, 'status': 'no_face', 'message': 'No face detected.'})
+            elif len(analysis.faces) > 1 and not classroom_mode:
+                frame_results.append({'index': index, 'status': 'error', 'message': 'Multiple faces detected. Please ensure only one person is in the frame.'})
+            else:
+                frame_results.append({'index': index, 'faces_detected': len(analysis.faces)})
+                batch_faces.extend((index, face) for face in analysis.faces)
+
+        # --- One match query and one insert for the whole batch ---
+        results = []
+        marked_ids = []
+        status = attendance_status_for(session)
+        if batch_faces:
+            encodings = np.concatenate([analysis.encodings for analysis in analyses if len(analysis.encodings)])
+            with spans.time('match'):
+                matches = match_encodings(gallery, encodings, walk_in_fallback)
+            with spans.time('mark'):
+                results, marked_ids, status = record_matches(session, matches, gallery)
+
+        faces_by_frame = {}
+        for (index, face), result in zip(batch_faces, results):
+            faces_by_frame.setdefault(index, []).append({'box': face_box(face), **result})
+
+        for frame_result in frame_results:
+            faces = faces_by_frame.get(frame_result['index'])
+            if faces is None:
+                continue
+            if classroom_mode:
+                recognised = any(face['status'] != 'not_recognized' for face in faces)
+                frame_result.update({
+                    'status': 'success' if recognised else 'not_recognized',
+                    'faces': faces,
                 })
             else:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': 'Verification failed. Face not recognized.'
-                }, status=401)
+                frame_result.update(faces[0])
+
+        elapsed = time.perf_counter() - started_at
+        logger.info(
+            f"Frame batch for session {session.id}: {len(frames)} frames, {len(batch_faces)} faces, "
+            f"{len(marked_ids)} marked in {elapsed * 1000:.0f} ms."
+        )
+        return JsonResponse({
+            'status': 'success',
+            'mode': 'classroom' if classroom_mode else 'single',
+            'message': f"{len(marked_ids)} student(s) marked as '{status.replace('_', ' ').title()}'.",
+            'frames': frame_results,
+            'marked_count': len(marked_ids),
+            'timestamp': timezone.now().strftime('%I:%M %p'),
+            'elapsed_ms': round(elapsed * 1000, 1),
+        })
+
+    except (InferenceBusy, InferenceTimeout) as e:
+        return inference_unavailable_response(e)
+    except Exception as e:
+        logger.error(f"Error processing frame batch for session {session.id}: {e}")
+        return JsonResponse({'status': 'error', 'message': f'An internal server error occurred: {e}'}, status=500)
+
+
+@login_required
+@user_passes_test(is_lecturer)
+def inference_stats(request):
+    """Reports this web worker's inference pool size, queue depth and job counters."""
+    return JsonResponse(inference.stats())
+
+
+def metrics_view(request):
+    """
+    Serves the recognition metrics of every worker in the Prometheus text format (see metrics.py).
+
+    Scrapers authenticate with "Authorization: Bearer <settings.METRICS_TOKEN>". Without a
+    token configured, only logged-in lecturers may read the metrics.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        authorized = hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        authorized = is_lecturer(request.user)
+    if not authorized:
+        return HttpResponse('Unauthorized\n', status=401, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-        except json.JSONDecodeError:
-            return JsonResponse({'status': 'error', 'message': 'Invalid JSON data.'}, status=400)
-        except Exception as e:
-            logger.error(f"Error processing frame for session {session_id}: {e}")
-            return JsonResponse({'status': 'error', 'message': f'An internal server error occurred: {e}'}, status=500)
 
-    return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=405)
-        
 @login_required
 @user_passes_test(is_lecturer)
 def update_record_status(request, record_id):
@@ -802,8 +1248,17 @@ def close_session(request, session_id):
     session = get_object_or_404(AttendanceSession, id=session_id, course__lecturer=request.user)
     session.is_active = False
     session.save()
+    forget_session(session)
+    buffered = False
+    if settings.ATTENDANCE_WRITE_BEHIND:
+        # Insert this worker's buffered marks now. Those still buffered in another worker
+        # are not on the register yet.
+        from .writebehind import flush_pending, journal_holds_session
+
+        flush_pending()
+        buffered = journal_holds_session(session.id)
 
-    if not session.records.exists():
+    if not buffered and not session.records.exists():
         session.delete()
         messages.warning(request, f"Session for {session.course.course_name} was closed and deleted because no students attended.")
     else:
@@ -0,0 +1,223 @@
+"""
+WebSocket channel for the attendance terminal, served directly by core/asgi.py.
+
+A terminal connects to /ws/terminal/<session_id>/ once. The connection is
+authenticated from the Django session cookie at the handshake, and the
+AttendanceSession and its course gallery are then held for the life of the
+connection. Frames therefore skip the per-request middleware, cookie and session
+lookups of the HTTP endpoints. Both are re-checked every PIN_REFRESH_SECONDS, so a
+closed session or an enrollment change is still noticed.
+
+Protocol:
+  * Client to server, binary: one frame per message. The message is a 4-byte
+    big-endian header length, a UTF-8 JSON header of that length with the
+    process_frame options ("mode", "face_box", "captured_at", plus an optional "seq"
+    echoed back), then the encoded image. Frames without a "terminal_id" are tracked
+    under one id per connection (see tracking.py).
+  * Client to server, text: {"type": "ping"} is answered with {"type": "pong"}.
+  * Server to client, text JSON: {"type": "ready"} after the handshake; one
+    {"type": "result", "seq": ..., "code": <HTTP-equivalent status>, ...} per frame,
+    carrying the same fields as the process_frame response; and
+    {"type": "closed"} before the socket is closed because the session ended.
+
+Frames go through the same bounded executor, in-flight limit and stale-frame
+dropping as process_frame_async. Each connection handles one frame at a time.
+"""
+import json
+import logging
+import re
+import time
+import uuid
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.http.request import split_domain_port, validate_host
+
+from .gallery import get_course_gallery
+from .metrics import FrameSpans, observe_frame
+from .models import AttendanceSession
+from .views import admit_frame, is_lecturer
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_PATH = re.compile(r'^/ws/terminal/(?P<session_id>\d+)/$')
+FRAME_HEADER_LENGTH_BYTES = 4
+# How often a connection re-reads its session's state and catches its gallery up with the change log.
+PIN_REFRESH_SECONDS = 10
+
+# Close codes sent to the terminal; 4000-4999 are reserved for applications.
+CLOSE_SESSION_ENDED = 4000
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN_ORIGIN = 4403
+CLOSE_NOT_FOUND = 4404
+
+
+def parse_frame_message(data):
+    """
+    Splits a binary frame message into its JSON header and image bytes.
+
+    Raises:
+        ValueError: If the header is truncated or not a JSON object.
+    """
+    if len(data) < FRAME_HEADER_LENGTH_BYTES:
+        raise ValueError('Truncated frame header length.')
+    header_length = int.from_bytes(data[:FRAME_HEADER_LENGTH_BYTES], 'big')
+    header_end = FRAME_HEADER_LENGTH_BYTES + header_length
+    if header_end > len(data):
+        raise ValueError('Truncated frame header.')
+    header = json.loads(data[FRAME_HEADER_LENGTH_BYTES:header_end]) if header_length else {}
+    if not isinstance(header, dict):
+        raise ValueError('The frame header must be a JSON object.')
+    return header, data[header_end:]
+
+
+def origin_allowed(headers):
+    """
+    Applies the CSRF origin rules to the handshake, since browsers send cookies on
+    cross-site WebSocket connections too. Clients that send no Origin are allowed.
+    """
+    origin = headers.get('origin')
+    if not origin:
+        return True
+    if origin in settings.CSRF_TRUSTED_ORIGINS:
+        return True
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not any(allowed_hosts):
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    domain, _port = split_domain_port(urlparse(origin).netloc)
+    return bool(domain) and validate_host(domain, allowed_hosts)
+
+
+async def authenticate(headers):
+    """Returns the user owning the session cookie in the handshake headers (AnonymousUser if none)."""
+    cookies = SimpleCookie()
+    cookies.load(headers.get('cookie', ''))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    engine = import_module(settings.SESSION_ENGINE)
+    request = SimpleNamespace(session=engine.SessionStore(morsel.value if morsel else None))
+    return await aget_user(request)
+
+
+class TerminalSocket:
+    """One terminal's connection, bound to a single AttendanceSession."""
+
+    def __init__(self, scope, receive, send, session_id):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.session_id = session_id
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+        self.session = None
+        self.gallery = None
+        self.pinned_at = 0.0
+        self.terminal_id = f'ws-{uuid.uuid4().hex}'
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        close_code = await self.open()
+        if close_code:
+            await self.send({'type': 'websocket.close', 'code': close_code})
+            return
+
+        await self.send({'type': 'websocket.accept'})
+        await self.send_json({'type': 'ready', 'session_id': self.session.id, 'course': self.session.course.course_code})
+        logger.info(f"Terminal socket opened for session {self.session.id}.")
+
+        while True:
+            message = await self.receive()
+            if message['type'] == 'websocket.disconnect':
+                logger.info(f"Terminal socket for session {self.session.id} closed ({message.get('code')}).")
+                return
+            if message.get('bytes') is not None:
+                if not await self.handle_frame(message['bytes']):
+                    return
+            elif message.get('text') is not None:
+                await self.handle_text(message['text'])
+
+    async def open(self):
+        """Authenticates the handshake and pins the session and gallery. Returns a close code on failure."""
+        if not origin_allowed(self.headers):
+            return CLOSE_FORBIDDEN_ORIGIN
+        user = await authenticate(self.headers)
+        if not user.is_authenticated or not is_lecturer(user):
+            return CLOSE_UNAUTHORIZED
+        self.session = await AttendanceSession.objects.select_related('course').filter(
+            id=self.session_id, course__lecturer=user, is_active=True,
+        ).afirst()
+        if self.session is None:
+            return CLOSE_NOT_FOUND
+        self.gallery = await sync_to_async(get_course_gallery)(self.session.course_id)
+        self.pinned_at = time.monotonic()
+        return None
+
+    async def refresh_pins(self):
+        """Re-reads whether the session is still open and catches the gallery up. Returns False once it has closed."""
+        if time.monotonic() - self.pinned_at < PIN_REFRESH_SECONDS:
+            return True
+        is_active = await AttendanceSession.objects.filter(id=self.session.id, is_active=True).aexists()
+        if not is_active:
+            return False
+        # Looked up again rather than refreshed, in case the course's first students were just enrolled.
+        self.gallery = await sync_to_async(get_course_gallery)(self.session.course_id)
+        self.pinned_at = time.monotonic()
+        return True
+
+    async def handle_frame(self, data):
+        """Recognises one frame and sends its result. Returns False if the socket was closed."""
+        received_at = time.time()
+        started_at = time.perf_counter()
+        spans = FrameSpans()
+        try:
+            with spans.time('request_decode'):
+                header, image_bytes = parse_frame_message(data)
+        except ValueError as e:
+            await self.send_json({'type': 'result', 'status': 'error', 'message': str(e), 'code': 400})
+            return True
+
+        if not await self.refresh_pins():
+            await self.send_json({'type': 'closed', 'message': 'This session is closed.'})
+            await self.send({'type': 'websocket.close', 'code': CLOSE_SESSION_ENDED})
+            return False
+
+        if not image_bytes:
+            response_data, code = {'status': 'error', 'message': 'No image data provided.'}, 400
+        else:
+            header.setdefault('terminal_id', self.terminal_id)
+            response = await admit_frame(
+                self.session, image_bytes, header, header.get('captured_at'), received_at, started_at, self.gallery, spans,
+            )
+            observe_frame(self.session.id, response, spans, started_at)
+            response_data, code = json.loads(response.content), response.status_code
+        await self.send_json({'type': 'result', 'seq': header.get('seq'), 'code': code, **response_data})
+        return True
+
+    async def handle_text(self, text):
+        try:
+            message = json.loads(text)
+        except json.JSONDecodeError:
+            message = {}
+        if isinstance(message, dict) and message.get('type') == 'ping':
+            await self.send_json({'type': 'pong', 'time': time.time()})
+        else:
+            await self.send_json({'type': 'error', 'message': 'Send frames as binary messages.'})
+
+    async def send_json(self, data):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+
+async def terminal_websocket(scope, receive, send):
+    """ASGI application for WebSocket connections; see the module docstring for the protocol."""
+    match = TERMINAL_PATH.match(scope['path'])
+    if match is None:
+        await receive()
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    await TerminalSocket(scope, receive, send, int(match['session_id'])).run()
@@ -0,0 +1,396 @@
+"""
+Write-behind buffering of attendance records.
+
+With ATTENDANCE_WRITE_BEHIND on, mark_students() hands new records to this
+worker's AttendanceBuffer instead of inserting them inside the request. The
+buffer appends them to a journal file and fsyncs it before returning, so a
+mark is acknowledged as soon as it is durable on local disk. A background
+thread then inserts everything buffered with one stats.insert_records() call
+every ATTENDANCE_WRITE_BEHIND_INTERVAL_MS, or as soon as
+ATTENDANCE_WRITE_BEHIND_BATCH records are waiting. A burst of arrivals at
+the start of a lecture becomes a few large inserts instead of one
+transaction per student, which matters most on SQLite where every write
+takes the database lock.
+
+Each buffer writes journal segments named <pid>-<token>-<n>.jsonl in
+ATTENDANCE_JOURNAL_DIR and holds an exclusive flock() on a segment until its
+records are committed and the file is removed. A segment is created and locked
+under a temporary name and only then renamed to .jsonl, so replay never sees
+one before its lock is taken. A segment no process holds a
+lock on was left by a worker that died before flushing: replay_journal()
+inserts its records and deletes it. Buffers replay when they start and then
+every REPLAY_INTERVAL seconds, and load_shared_state() replays when the
+server starts. Replaying twice is harmless because the insert skips records
+that already exist.
+
+Next to each segment, <name>.sessions lists the ids of the sessions it holds
+records of, appended before the records themselves. journal_holds_session()
+reads these short lists rather than every record in the journal, and each
+buffer also counts its own pending records per session.
+
+The register in the database lags recognition by up to one flush interval.
+Records keep the time the student was recognised, not the time of the insert.
+Unix only (fcntl).
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+from itertools import count
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.dateparse import parse_datetime
+
+from . import stats
+from .models import AttendanceRecord, AttendanceSession, Student
+
+logger = logging.getLogger(__name__)
+
+# Seconds between scans of the journal for segments left by dead workers.
+REPLAY_INTERVAL = 60
+
+# An open journal segment: its locked file and path, and its session list as an open file and the ids written to it.
+Segment = namedtuple('Segment', ['file', 'path', 'sessions_file', 'session_ids'])
+
+
+def sessions_path(segment_path):
+    """Returns the path of the session list kept next to a segment."""
+    return os.path.splitext(segment_path)[0] + '.sessions'
+
+
+def serialize(record):
+    return json.dumps({
+        'session_id': record.session_id,
+        'student_id': record.student_id,
+        'status': record.status,
+        'timestamp': record.timestamp.isoformat(),
+    })
+
+
+def deserialize(line):
+    row = json.loads(line)
+    return AttendanceRecord(
+        session_id=row['session_id'],
+        student_id=row['student_id'],
+        status=row['status'],
+        timestamp=parse_datetime(row['timestamp']),
+    )
+
+
+def insert_records(records):
+    """
+    Inserts buffered records, skipping any already on the register.
+
+    Records whose session or student was deleted while they waited are dropped, as
+    their foreign keys would fail the whole batch.
+
+    Returns:
+        int: The number of records handed to the database.
+    """
+    session_ids = set(AttendanceSession.objects.filter(
+        id__in={record.session_id for record in records}).values_list('id', flat=True))
+    student_ids = set(Student.objects.filter(
+        id__in={record.student_id for record in records}).values_list('id', flat=True))
+    valid = [record for record in records if record.session_id in session_ids and record.student_id in student_ids]
+    if len(valid) < len(records):
+        logger.warning(f"Dropped {len(records) - len(valid)} buffered attendance records of deleted sessions or students.")
+    stats.insert_records(valid)
+    return len(valid)
+
+
+def read_segment(f):
+    """Reads the records of a journal segment, ignoring a last line cut short by a crash."""
+    f.seek(0)
+    records = []
+    for line_number, line in enumerate(f, start=1):
+        try:
+            records.append(deserialize(line))
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Skipped unreadable line {line_number} of journal segment {f.name}.")
+    return records
+
+
+def journal_holds_session(session_id, journal_dir=None):
+    """
+    Tells whether any journal segment holds a record of the session, whether a live
+    buffer is still waiting to insert it or a dead worker's segment awaits replay.
+
+    This process's buffer answers from memory; the other segments are looked up in
+    their session lists. Check this before the register: a flush inserts a segment's
+    records before it removes the segment, so a record is always in one of the two.
+    """
+    if _buffer is not None and _buffer.pid == os.getpid() and _buffer.holds_session(session_id):
+        return True
+    journal_dir = journal_dir or settings.ATTENDANCE_JOURNAL_DIR
+    if not os.path.isdir(journal_dir):
+        return False
+    for name in os.listdir(journal_dir):
+        if not name.endswith('.sessions'):
+            continue
+        path = os.path.join(journal_dir, name)
+        try:
+            with open(path, 'r') as f:
+                session_ids = f.read().split()
+        except FileNotFoundError:
+            continue  # Flushed or replayed since the listing.
+        # A list whose segment is gone was left by a worker that died while removing both.
+        if str(session_id) in session_ids and os.path.exists(os.path.splitext(path)[0] + '.jsonl'):
+            return True
+    return False
+
+
+def replay_journal(journal_dir=None):
+    """
+    Inserts the records of journal segments that no live process holds, then deletes them.
+
+    Returns:
+        int: The number of records replayed.
+    """
+    journal_dir = journal_dir or settings.ATTENDANCE_JOURNAL_DIR
+    if not os.path.isdir(journal_dir):
+        return 0
+    replayed = 0
+    for name in sorted(os.listdir(journal_dir)):
+        path = os.path.join(journal_dir, name)
+        if name.endswith('.tmp'):
+            remove_abandoned(path)
+            continue
+        if name.endswith('.sessions'):
+            remove_stale_sessions(path)
+            continue
+        if not name.endswith('.jsonl'):
+            continue
+        try:
+            f = open(path, 'r')
+        except FileNotFoundError:
+            continue  # Replayed by another worker since the listing.
+        with f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # A live buffer's segment.
+            if not os.path.exists(path):
+                continue
+            records = read_segment(f)
+            if records:
+                insert_records(records)
+            os.unlink(path)
+            remove_file(sessions_path(path))
+            replayed += len(records)
+    if replayed:
+        logger.info(f"Replayed {replayed} attendance records from the journal in {journal_dir}.")
+    return replayed
+
+
+def remove_abandoned(path):
+    """Deletes a segment left under its temporary name by a worker that died before renaming it; it holds no records."""
+    try:
+        f = open(path, 'r')
+    except FileNotFoundError:
+        return
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # Being opened by a live buffer.
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass  # Renamed by its buffer after all.
+
+
+def remove_stale_sessions(path):
+    """Deletes a session list whose segment no longer exists, left by a worker that died while removing both."""
+    base = os.path.splitext(path)[0]
+    # A segment only moves from .tmp to .jsonl, so looking in that order cannot miss one being renamed.
+    if not os.path.exists(base + '.tmp') and not os.path.exists(base + '.jsonl'):
+        remove_file(path)
+
+
+def remove_file(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class AttendanceBuffer:
+    """
+    Journals attendance records and inserts them in batches from a background thread.
+
+    Args:
+        journal_dir (str): Where journal segments are written.
+        interval (float): Longest time, in seconds, a record waits before it is inserted.
+        batch_size (int): Number of waiting records that triggers an early flush.
+    """
+
+    def __init__(self, journal_dir, interval, batch_size):
+        self.journal_dir = journal_dir
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pid = os.getpid()
+        # Keeps a buffer from renaming over a segment another buffer left, even under a reused pid.
+        self._token = uuid.uuid4().hex[:8]
+        self._segment_numbers = count()
+        # The open Segment.
+        self._segment = None
+        # Segments whose records failed to insert; kept locked until a flush succeeds.
+        self._failed_segments = []
+        self._pending = []
+        # Pending records per session id, for holds_session().
+        self._sessions = Counter()
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        replay_journal(self.journal_dir)
+        self._thread = threading.Thread(target=self._run, name='attendance-write-behind', daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, records):
+        """Journals `records` and queues them for insertion; returns once they are on disk."""
+        if not records:
+            return
+        data = ''.join(serialize(record) + '\n' for record in records)
+        with self._condition:
+            if self._segment is None:
+                self._segment = self._open_segment()
+            segment = self._segment
+            new_session_ids = {record.session_id for record in records} - segment.session_ids
+            if new_session_ids:
+                # Listed before the records are written. Not fsynced: after a machine crash
+                # every segment is replayed when the server starts, before any session is closed.
+                segment.sessions_file.write(''.join(f'{session_id}\n' for session_id in sorted(new_session_ids)))
+                segment.sessions_file.flush()
+                segment.session_ids.update(new_session_ids)
+            segment.file.write(data)
+            segment.file.flush()
+            os.fsync(segment.file.fileno())
+            self._pending.extend(records)
+            self._sessions.update(record.session_id for record in records)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def flush(self):
+        """
+        Inserts every queued record.
+
+        Returns:
+            int: The number of records inserted; 0 if there were none or the insert failed,
+            in which case they stay queued and journaled for the next flush.
+        """
+        with self._flush_lock:
+            with self._condition:
+                records, self._pending = self._pending, []
+                segment, self._segment = self._segment, None
+            segments = self._failed_segments + ([segment] if segment else [])
+            if not records:
+                self._remove_segments(segments)
+                self._failed_segments = []
+                return 0
+            try:
+                insert_records(records)
+            except Exception as e:
+                logger.error(f"Could not insert {len(records)} buffered attendance records, will retry: {e}")
+                close_old_connections()
+                with self._condition:
+                    self._pending[:0] = records
+                self._failed_segments = segments
+                return 0
+            self._remove_segments(segments)
+            self._failed_segments = []
+            with self._condition:
+                self._sessions -= Counter(record.session_id for record in records)
+            return len(records)
+
+    def stop(self):
+        """Stops the background thread and inserts whatever is still queued."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval + 30)
+        self.flush()
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def holds_session(self, session_id):
+        """Whether records of the session are journaled by this buffer and not inserted yet."""
+        with self._condition:
+            return self._sessions[session_id] > 0
+
+    def _open_segment(self):
+        # Lock under a name replay ignores, then rename: a .jsonl file without a lock is always abandoned.
+        name = f'{self.pid}-{self._token}-{next(self._segment_numbers)}'
+        temporary = os.path.join(self.journal_dir, f'{name}.tmp')
+        path = os.path.join(self.journal_dir, f'{name}.jsonl')
+        f = open(temporary, 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        # Created before the rename, so a segment is never visible without its session list.
+        sessions_file = open(sessions_path(path), 'a')
+        os.rename(temporary, path)
+        return Segment(f, path, sessions_file, set())
+
+    def _remove_segments(self, segments):
+        # Unlink before closing: closing drops the lock, and a replay must not find the file afterwards.
+        # The session list goes last, so a segment that is still there is always listed.
+        for segment in segments:
+            remove_file(segment.path)
+            remove_file(segment.sessions_file.name)
+            segment.file.close()
+            segment.sessions_file.close()
+
+    def _run(self):
+        last_replay = time.monotonic()
+        while True:
+            with self._condition:
+                if not self._stopped and len(self._pending) < self.batch_size:
+                    self._condition.wait(self.interval)
+                stopped = self._stopped
+            if stopped:
+                break
+            try:
+                self.flush()
+                if time.monotonic() - last_replay > REPLAY_INTERVAL:
+                    last_replay = time.monotonic()
+                    replay_journal(self.journal_dir)
+            except Exception as e:
+                logger.error(f"Attendance write-behind flush failed: {e}")
+                close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Returns this process's AttendanceBuffer, starting it on first use (and again after a fork)."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None or _buffer.pid != os.getpid():
+            _buffer = AttendanceBuffer(
+                settings.ATTENDANCE_JOURNAL_DIR,
+                settings.ATTENDANCE_WRITE_BEHIND_INTERVAL_MS / 1000,
+                settings.ATTENDANCE_WRITE_BEHIND_BATCH,
+            ).start()
+            atexit.register(_buffer.stop)
+        return _buffer
+
+
+def flush_pending():
+    """Inserts the records this process has buffered, if it has a buffer."""
+    if _buffer is not None and _buffer.pid == os.getpid():
+        return _buffer.flush()
+    return 0
@@ -159,6 +159,103 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Cache
+# The default cache holds the per-session marked-student claims (attendance/marking.py). The
+# local-memory default is per process; with several workers point it at a cache they share,
+# e.g. CACHE_BACKEND=django.core.cache.backends.redis.RedisCache and CACHE_LOCATION=redis://...,
+# so only one of them reports a student as newly marked. `manage.py check` (with
+# ATTENDANCE_WRITE_BEHIND on) and gunicorn.conf.py (with several workers) warn when it is not shared.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+# Seconds a claim on a (session, student) mark is kept in the cache; longer than any session.
+ATTENDANCE_MARKED_CACHE_TIMEOUT = int(os.getenv("ATTENDANCE_MARKED_CACHE_TIMEOUT", str(24 * 60 * 60)))
+
+
+# Face recognition
+# Search backend for the face gallery: "exact" scans every stored encoding,
+# "ivf" scans only the k-means partitions nearest to each query (faster on
+# very large galleries, slightly lower recall; run `manage.py bench_index`).
+FACE_INDEX_BACKEND = os.getenv("FACE_INDEX_BACKEND", "exact")
+FACE_INDEX_OPTIONS = {
+    "n_probe": int(os.getenv("FACE_INDEX_N_PROBE", "8")),
+} if FACE_INDEX_BACKEND == "ivf" else {}
+# Optional index file written by `manage.py build_face_index`; loaded at startup instead of rebuilding.
+FACE_INDEX_PATH = os.getenv("FACE_INDEX_PATH") or None
+# Upper bound on the memory used by cached per-course galleries in each worker.
+FACE_GALLERY_CACHE_BYTES = int(os.getenv("FACE_GALLERY_CACHE_BYTES", str(64 * 1024 * 1024)))
+# Also match against every registered student when a face is not in the course, marking walk-ins.
+FACE_GALLERY_WALK_IN_FALLBACK = os.getenv("FACE_GALLERY_WALK_IN_FALLBACK", "False") == "True"
+# Most frames accepted by one request to the batched process-frames endpoint.
+FACE_BATCH_MAX_FRAMES = int(os.getenv("FACE_BATCH_MAX_FRAMES", "16"))
+# Worker processes for face detection and embedding (see attendance/inference.py);
+# 0 runs inference inline in the web worker.
+FACE_INFERENCE_WORKERS = int(os.getenv("FACE_INFERENCE_WORKERS", "0"))
+# With no inference workers, threads that encode enrollment samples in the web worker; 1 encodes
+# them one after another. Only raise it where bench_enrollment shows the threads running in parallel.
+FACE_INLINE_MAP_THREADS = int(os.getenv("FACE_INLINE_MAP_THREADS", "1"))
+# Jobs allowed to wait for a free inference worker before requests are turned away as busy.
+FACE_INFERENCE_QUEUE_SIZE = int(os.getenv("FACE_INFERENCE_QUEUE_SIZE", "8"))
+# Seconds a request waits for an inference result.
+FACE_INFERENCE_TIMEOUT = float(os.getenv("FACE_INFERENCE_TIMEOUT", "10"))
+# Threads running recognition for the async frame endpoint, and the number of frames it
+# will hold (queued or running) before answering 429.
+FACE_ASYNC_WORKERS = int(os.getenv("FACE_ASYNC_WORKERS", "4"))
+FACE_ASYNC_MAX_IN_FLIGHT = int(os.getenv("FACE_ASYNC_MAX_IN_FLIGHT", "8"))
+# Frames older than this when they arrive or reach a worker are dropped; 0 keeps every frame.
+# Ages use the terminal's capture timestamp, so terminal clocks should be kept in sync.
+FACE_FRAME_MAX_AGE_MS = int(os.getenv("FACE_FRAME_MAX_AGE_MS", "2000"))
+# Load the dlib models when Django starts instead of on the first recognition request.
+# Meant for web and enrollment worker processes; leave it off for other management commands.
+FACE_MODELS_WARM_UP = os.getenv("FACE_MODELS_WARM_UP", "False") == "True"
+# Follow each terminal's face across frames (attendance/tracking.py): frames whose face overlaps
+# the last confidently recognised one reuse its identity and skip the descriptor and matching.
+FACE_TRACKING = os.getenv("FACE_TRACKING", "True") == "True"
+# A track expires this long after its last frame.
+FACE_TRACK_TTL_MS = int(os.getenv("FACE_TRACK_TTL_MS", "1500"))
+# Overlap (intersection over union) a face needs with the track's box to continue it.
+FACE_TRACK_MIN_IOU = float(os.getenv("FACE_TRACK_MIN_IOU", "0.5"))
+# Only matches at least this close start a track (the match tolerance itself is 0.5).
+FACE_TRACK_MAX_DISTANCE = float(os.getenv("FACE_TRACK_MAX_DISTANCE", "0.45"))
+# A track's identity is reused for at most this long before a frame is described and matched
+# again, catching the next student stepping into the same spot.
+FACE_TRACK_REVERIFY_MS = int(os.getenv("FACE_TRACK_REVERIFY_MS", "500"))
+# Bearer token Prometheus sends to scrape /metrics; when empty only logged-in lecturers can read it.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Directory where every worker writes its metrics so /metrics can merge them; gunicorn.conf.py sets one
+# per server. Empty: /metrics reports only the worker that answers the scrape.
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+# Compact each new student's descriptors at enrollment (see attendance/compaction.py). Off by default:
+# check `manage.py compact_embeddings --evaluate` on real enrollments before turning it on.
+FACE_COMPACTION = os.getenv("FACE_COMPACTION", "False") == "True"
+# Enrollment descriptors kept per student after outlier pruning (see attendance/compaction.py);
+# 0 keeps every sample that survives pruning. "medoids" keeps real samples, "centroids" cluster means.
+FACE_COMPACTION_K = int(os.getenv("FACE_COMPACTION_K", "4"))
+FACE_COMPACTION_METHOD = os.getenv("FACE_COMPACTION_METHOD", "medoids")
+# Samples further than this from the student's most central sample are dropped as outliers.
+FACE_COMPACTION_OUTLIER_DISTANCE = float(os.getenv("FACE_COMPACTION_OUTLIER_DISTANCE", "0.4"))
+# Store student registrations as EnrollmentJob rows for `manage.py run_enrollment_jobs` to
+# encode, instead of encoding the face samples inside the registration request.
+ENROLLMENT_BACKGROUND_JOBS = os.getenv("ENROLLMENT_BACKGROUND_JOBS", "False") == "True"
+# Attempts a job gets for transient errors, and the delay before a retry (multiplied by the attempt number).
+ENROLLMENT_JOB_MAX_ATTEMPTS = int(os.getenv("ENROLLMENT_JOB_MAX_ATTEMPTS", "3"))
+ENROLLMENT_JOB_RETRY_DELAY = float(os.getenv("ENROLLMENT_JOB_RETRY_DELAY", "30"))
+# A job still running after this many seconds is assumed to belong to a dead worker and requeued.
+ENROLLMENT_JOB_STALE_SECONDS = int(os.getenv("ENROLLMENT_JOB_STALE_SECONDS", "600"))
+# Acknowledge attendance marks once they are journaled (fsync) on local disk and insert them
+# in batches from a background thread (attendance/writebehind.py). Unix only. The register
+# lags recognition by up to the interval; a crashed worker's journal is replayed on start.
+ATTENDANCE_WRITE_BEHIND = os.getenv("ATTENDANCE_WRITE_BEHIND", "False") == "True"
+# Flush every this many milliseconds, or as soon as this many records are waiting.
+ATTENDANCE_WRITE_BEHIND_INTERVAL_MS = int(os.getenv("ATTENDANCE_WRITE_BEHIND_INTERVAL_MS", "200"))
+ATTENDANCE_WRITE_BEHIND_BATCH = int(os.getenv("ATTENDANCE_WRITE_BEHIND_BATCH", "100"))
+# Must be on a local disk shared by every worker of the host.
+ATTENDANCE_JOURNAL_DIR = os.getenv("ATTENDANCE_JOURNAL_DIR", str(BASE_DIR / "attendance_journal"))
+
+
 JAZZMIN_SETTINGS = {
     "site_title": "Attendance System Admin",
     "site_header": "Attendance Admin",
@@ -0,0 +1,79 @@
+"""
+Gunicorn configuration for the attendance system.
+
+    gunicorn -c gunicorn.conf.py
+
+Preload (on by default, GUNICORN_PRELOAD=False to turn it off): the master
+imports Django, loads the dlib models and read-only gallery snapshots, closes
+its database connections and freezes the garbage collector before it forks
+(attendance/preload.py). Workers then share those pages copy-on-write instead of
+each holding a copy, so adding workers costs far less memory. Compare both
+modes on a box with `python manage.py bench_worker_memory`.
+
+Trade-offs of preloading:
+  * Code changes need a full restart; `kill -HUP` re-forks workers from the
+    already loaded master.
+  * Processes started by FACE_INFERENCE_WORKERS use the spawn method and load
+    their own models; preloading only covers the web workers.
+
+Metrics: each worker writes its recognition metrics to METRICS_DIR, by default a
+directory of this master's own that is emptied at startup, so a scrape of
+/metrics covers every worker whichever one answers it (attendance/metrics.py).
+
+Every setting can be overridden from the environment, e.g. GUNICORN_WORKERS=8.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+wsgi_app = os.getenv('GUNICORN_APP', 'core.wsgi:application')
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+threads = int(os.getenv('GUNICORN_THREADS', '1'))
+# Registration and classroom frames can keep a sync worker busy for several seconds.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True') == 'True'
+# An empty GUNICORN_ACCESSLOG turns the access log off.
+accesslog = os.getenv('GUNICORN_ACCESSLOG', '-') or None
+# Set before the app is loaded so Django's settings, and every worker, see it.
+default_metrics_dir = os.path.join(tempfile.gettempdir(), f'attendance-metrics-{os.getpid()}')
+metrics_dir = os.environ.setdefault('METRICS_DIR', default_metrics_dir)
+
+
+def on_starting(server):
+    """Runs in the master before the app is loaded; drops the metrics snapshots of a previous run."""
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        if name.endswith(('.json', '.json.tmp')):
+            os.unlink(os.path.join(metrics_dir, name))
+
+
+def on_exit(server):
+    """Runs in the master as it shuts down; removes the default metrics directory."""
+    if metrics_dir == default_metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def when_ready(server):
+    """Runs in the master after the app is loaded and before the first fork."""
+    # Without preload the app is not loaded in the master, but its settings can still be read.
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    from attendance.checks import warn_if_cache_per_process
+
+    warn_if_cache_per_process(workers, server.log)
+    if preload_app:
+        from attendance.preload import preload_for_fork
+
+        preload_for_fork()
+        server.log.info('Preloaded face models and galleries in the master.')
+
+
+def post_worker_init(worker):
+    """Runs in each worker once it has loaded the app."""
+    if not preload_app:
+        from attendance.preload import load_shared_state
+
+        load_shared_state()
+    worker.log.info(f'Worker {worker.pid} ready (preload={preload_app}).')